@@ -3,7 +3,10 @@ main.py - Core FastAPI
 
 This module defines the primary API endpoints for the insurance application. 
 It orchestrates the various components, including:
-1. **Data Extraction:** Processing form data from uploaded images (using a helper agent).
+1. **Data Extraction:** Processing form data from uploaded images (using a helper agent), 
+   after local preprocessing (orientation, downscaling, grayscale, re-encoding). 
+   Results are cached by image content and concurrent uploads of the same image 
+   share one extraction (`extraction_cache`).
 2. **Decision Making:** Determining the underwriting decision (Accept/Reject) using 
    the adaptive rules engine (`decide`).
 3. **Price Prediction:** Calculating the insurance premium adjustment using a 
@@ -11,38 +14,153 @@ It orchestrates the various components, including:
 4. **Explanation:** Generating detailed, natural-language reasoning for the decision 
    via a reasoning agent (SHAP + GPT).
 
-The service is initialized with a `lifespan` manager to ensure the ML model is 
-loaded before the server starts.
+LLM calls (image extraction, explanation) are awaited with the async OpenAI client, 
+so a single worker keeps many of them in flight; see `llm_limits` for the 
+per-call timeout and the concurrency cap. `/predict` can be given a latency 
+budget (`X-Latency-Budget-Ms` header or `PREDICT_LATENCY_BUDGET_MS`): if GPT has 
+not answered by then, the response carries a local explanation built from the 
+SHAP values, and the call completes in the background to fill the cache. The stages of `/predict` (rule decision, 
+price forest, decision forest + SHAP followed by GPT) run concurrently, the 
+CPU-bound ones on a bounded thread or process pool (`cpu_executor`); so do the 
+batch stages of `/predict_batch`.
+
+The service is initialized with a `lifespan` manager to ensure the ML models 
+(price model and decision explainer) are loaded before the server starts. If a 
+precomputed decision table (`decision_table`) is available, `/predict` answers 
+from it with an array lookup and falls back to the live models outside its grid.
+With `STARTUP_MODE=lazy` (see `startup`), the models and their heavy imports 
+(sklearn, SHAP, OpenAI) are loaded on first use instead, and `STARTUP_WARMUP=1` 
+runs one prediction before `/health/ready` reports the worker ready.
+
+The learned rules are served from immutable, versioned snapshots (`decide`): each 
+request reads the current snapshot once and uses it throughout, and 
+`/admin/update_rules` builds the replacement (with its indexes) while requests 
+keep being served from the old version, then swaps it in. Responses report the 
+`rules_version` they were computed with.
 
 Endpoints:
 - `/process`: Handles image upload and data extraction.
+- `/process_batch`: Many images at once, extracted concurrently (bounded, with 
+  retries) and streamed as NDJSON, each file as soon as it is done.
 - `/predict`: Accepts standardized form data and returns the decision, price 
   adjustment, and explanation.
-- `/admin/update_rules`: Administrative endpoint for rule table management.
+- `/predict_stream`: Same as `/predict`, streamed as NDJSON: the decision, price 
+  and SHAP values are sent immediately, then the GPT explanation token by token.
+- `/predict_batch`: Same as `/predict` for many records (at most 
+  `BATCH_MAX_RECORDS`), computed as array operations over the whole batch.
+- `/predict_bulk`: Uploaded CSV / Parquet file of applicants, read and scored in 
+  chunks (`bulk_underwriting`); results streamed as NDJSON or returned as a 
+  Parquet file.
+- `/health`, `/health/ready`: Liveness, and readiness with the loaded components 
+  and the startup-time breakdown.
+- `/admin/update_rules`: Administrative endpoint for rule table management. With 
+  `SHARED_STATE_DIR` set, the new table is published to all workers (`shared_state`).
+- `/admin/reload_explainer`: Reloads the decision explainer artifacts.
+- `/admin/explanation_cache`: Hit/miss statistics of the GPT explanation cache.
+- `/admin/extraction_cache`: Hit/miss statistics of the image extraction cache.
+- `/admin/shap_cache`: Hit/miss statistics of the explainer's SHAP value cache.
+- `/metrics`: Prometheus metrics: latency histograms per pipeline stage and per 
+  route, rule table size, cache hit rates, LLM calls in flight (`metrics`).
 """
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+import startup
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, ValidationError
-from typing import Optional
+from typing import List, Optional
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-from decide import predict_decision,replace_rule_table
-from price_predictor import insurance_model
+from decide import predict_decision, predict_decision_batch, current_rules, replace_rule_table, rules_loaded
+from price_predictor import insurance_model, price_adjustment, price_adjustment_batch
+from decision_table import decision_table
 from contextlib import asynccontextmanager
-from schemas import FormData
-from helpers import extract_form_fields_from_image, get_insurance_data
-from reasoning_agent import explain_insurance_decision
+from schemas import FormData, BatchFormData
+from image_preprocessing import preprocess_image_async
+from extraction_cache import extraction_cache, content_key
+from helpers import extract_form_fields_from_image_async, get_insurance_data, get_insurance_data_batch, get_async_client
+from reasoning_agent import explain_insurance_decision_async, explain_features, explain_features_batch, gpt_explanations_async, decision_explainer
+from explanation_cache import explanation_cache
+from llm_limits import PREDICT_LATENCY_BUDGET_MS, EXTRACTION_MAX_CONCURRENCY
+import llm_limits
+import metrics
+import reasoning_agent
 from schemas import RuleUpdate
+from cpu_executor import run_cpu, run_local
+import bulk_underwriting
+import cpu_executor
 
 load_dotenv()
 
+startup.record("imports", time.perf_counter() - startup.IMPORT_START)
+
+# workers reloading the explainer on another worker's request re-check the table too
+decision_explainer.reload_listeners.append(decision_table.load)
+decision_explainer.reload_listeners.append(cpu_executor.restart)
+
+# Applicant of the startup warm-up prediction
+WARMUP_APPLICANT = {"BMI": 24.2, "AGE": 45, "SMOKER": False, "PRACTICE_SPORT": True, "PRICE_INSURANCE": 1000.0}
+
+
+def warm_up():
+    """
+    Load whatever is not loaded yet and run one prediction (without GPT), so the
+    first requests do not pay for imports, model loads and first calls.
+    """
+    startup.set_warmup("running")
+    try:
+        with startup.timed("warmup"):
+            decide_and_price(WARMUP_APPLICANT, current_rules())
+            explainer = decision_explainer.get_explainer()
+            explainer.predict_with_explanation(
+                WARMUP_APPLICANT["BMI"], WARMUP_APPLICANT["AGE"],
+                WARMUP_APPLICANT["SMOKER"], WARMUP_APPLICANT["PRACTICE_SPORT"], use_gpt=False
+            )
+            # imports the OpenAI SDK
+            explainer.async_client
+            get_async_client()
+    except Exception as e:
+        print(f"❌ Warm-up failed: {e}")
+        startup.set_warmup("failed", str(e))
+        return
+    startup.set_warmup("done")
+    startup.mark_ready()
+    print("✅ Warm-up done")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Loading model")
-    insurance_model.load_model()
+    start = time.perf_counter()
+    # cheap components (no sklearn / SHAP / OpenAI imports)
+    print("Loading rules table")
+    current_rules()
+    print("Loading decision table")
+    decision_table.load()
+    if startup.STARTUP_MODE == "lazy":
+        print("Lazy startup: the price model and the decision explainer load on first use")
+    else:
+        print("Loading model")
+        insurance_model.load_model()
+        print("Loading decision explainer")
+        decision_explainer.load_model()
+
+    if not startup.STARTUP_WARMUP:
+        startup.mark_ready()
+    elif startup.STARTUP_MODE == "lazy":
+        # serve (liveness) right away, ready once warm
+        threading.Thread(target=warm_up, daemon=True).start()
+    else:
+        warm_up()
+    cpu_executor.start()
+    startup.record("lifespan", time.perf_counter() - start)
     yield
+    cpu_executor.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -53,6 +171,44 @@ app.add_middleware(
     allow_methods=["*"],              
     allow_headers=["*"],
 )
+app.add_middleware(metrics.RequestMetrics)
+
+ALLOWED_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+
+async def extract_form(image_bytes):
+    """
+    Form fields of an uploaded image: preprocessed, then extracted by the vision
+    model (with retries), or reused from the extraction cache.
+
+    Returns:
+        ((form_data, preprocessing), source) where source tells whether the
+        result came from the cache
+
+    Raises:
+        ValidationError: If the extracted data does not validate
+    """
+    async def extract():
+        # Shrink and normalize the image before sending it to the vision model
+        with metrics.timed("image_preprocessing"):
+            data, mime_type, preprocessing = await preprocess_image_async(image_bytes, extraction_cache.perceptual)
+        print(f"Image preprocessed: {preprocessing['bytes_before']} -> {preprocessing['bytes_after']} bytes")
+
+        # the same scan re-encoded: reuse its form data, with this upload's preprocessing stats
+        perceptual_key = preprocessing.get("perceptual_hash")
+        if perceptual_key is not None:
+            form_data = extraction_cache.get_perceptual(perceptual_key)
+            if form_data is not None:
+                return form_data, preprocessing
+
+        form_data = await extract_form_fields_from_image_async(data, mime_type)
+        if perceptual_key is not None:
+            extraction_cache.put(perceptual_key, form_data)
+        return form_data, preprocessing
+
+    return await extraction_cache.get_or_extract(content_key(image_bytes), extract)
+
+
 @app.post("/process")
 async def process_form(
     file: Optional[UploadFile] = File(None, description="Image file (required if type='image')"),
@@ -75,21 +231,22 @@ async def process_form(
             raise HTTPException(status_code=400, detail="Image file is required when type='image'")
         
         # Validate file type
-        allowed_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
-        if not file.filename.lower().endswith(allowed_extensions):
-            raise HTTPException(status_code=400, detail=f"File must be an image ({', '.join(allowed_extensions)})")
+        if not file.filename.lower().endswith(ALLOWED_IMAGE_EXTENSIONS):
+            raise HTTPException(status_code=400, detail=f"File must be an image ({', '.join(ALLOWED_IMAGE_EXTENSIONS)})")
         
         # Read image bytes
         image_bytes = await file.read()
         
-        # Extract form fields from image
+        # Extract form fields from image (or reuse the extraction of identical bytes)
         try:
-            form_data = extract_form_fields_from_image(image_bytes)
+            (form_data, preprocessing), source = await extract_form(image_bytes)
         
             return JSONResponse(content={
                 "status": "success",
                 "source": "image_extraction",
-                "data": form_data.model_dump()
+                "data": form_data.model_dump(),
+                "preprocessing": preprocessing,
+                "cache": source
             })
         except ValidationError as ve:
             return JSONResponse(status_code=400, content={
@@ -100,47 +257,373 @@ async def process_form(
         
     except Exception as e:
         return JSONResponse(status_code=400, content={"status": "error", "message": "Invalid request"})
+
+
+@app.post("/process_batch")
+async def process_forms(
+    files: List[UploadFile] = File(..., description="Image files of the scanned forms"),
+    max_concurrency: int = Form(EXTRACTION_MAX_CONCURRENCY, gt=0, description="Max extractions in flight")
+):
+    """
+    Extract the forms of many images concurrently (at most max_concurrency at
+    a time, within the worker-wide LLM cap), streamed as NDJSON in completion
+    order:
+    - {"type": "result", "index": ..., "filename": ..., "status": "success", "data": ...}
+      (same fields as /process), or "status": "error" with a message (and the
+      validation errors)
+    - {"type": "summary", "n_files": ..., "n_success": ..., "n_errors": ...} at the end
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def process_one(index, file):
+        result = {"type": "result", "index": index, "filename": file.filename}
+        if not (file.filename or "").lower().endswith(ALLOWED_IMAGE_EXTENSIONS):
+            return {**result, "status": "error",
+                    "message": f"File must be an image ({', '.join(ALLOWED_IMAGE_EXTENSIONS)})"}
+        async with semaphore:
+            # read only when a slot is free: at most max_concurrency images in memory
+            image_bytes = await file.read()
+            try:
+                (form_data, preprocessing), source = await extract_form(image_bytes)
+            except ValidationError as ve:
+                return {**result, "status": "error", "message": "Failed to validate extracted data",
+                        "errors": json.loads(ve.json())}
+            except asyncio.TimeoutError:
+                return {**result, "status": "error", "message": "Extraction timed out"}
+            except Exception as e:
+                return {**result, "status": "error", "message": f"Extraction failed: {str(e) or type(e).__name__}"}
+        return {**result, "status": "success", "source": "image_extraction", "data": form_data.model_dump(),
+                "preprocessing": preprocessing, "cache": source}
+
+    async def events():
+        tasks = [asyncio.create_task(process_one(i, file)) for i, file in enumerate(files)]
+        n_success = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                n_success += result["status"] == "success"
+                metrics.count(f"extraction_{result['status']}")
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"type": "summary", "n_files": len(files), "n_success": n_success,
+                              "n_errors": len(files) - n_success}) + "\n"
+        finally:
+            # client gone: stop the extractions still queued or running
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
     
-@app.post("/predict")
-async def predict(form_data: FormData):
-    # get insurance values
-    insurance_data = get_insurance_data(form_data)
+def decide_and_price(insurance_data, snapshot):
+    """
+    Rule decision and price adjustment for one applicant, from the precomputed
+    decision table when possible, otherwise from the live models. Learned
+    decisions come from the given rules snapshot.
 
-    # get prediction
-    print("Getting prediction..")
-    decision, comment = predict_decision(insurance_data)
+    Returns:
+        (decision, comment, prediction_output, cell) where cell holds the
+        precomputed results that were available for this input
+    """
+    # precomputed results for this input, empty outside of the table grid
+    cell = decision_table.lookup(insurance_data, snapshot) or {}
 
-    # get reasoning via shapey values
-    print("Getting explanation for decision..")
-    reasoning_advanced = explain_insurance_decision(insurance_data)
+    decision, comment = decide(insurance_data, snapshot, cell)
 
     # predict adjustment price change
     print("Getting price adjustment..")
-    prediction_output = insurance_model.calculate_price_adjustment(insurance_data)
+    prediction_output = price_adjustment(insurance_data, cell.get("predicted_price"))
+
+    return decision, comment, prediction_output, cell
+
+def decide(insurance_data, snapshot, cell):
+    """Rule decision for one applicant: precomputed in cell, else from the rules snapshot"""
+    print("Getting prediction..")
+    if "decision" in cell:
+        return cell["decision"], cell["comment"]
+    return predict_decision(insurance_data, snapshot)
+
+@app.post("/predict")
+async def predict(
+    form_data: FormData,
+    x_latency_budget_ms: Optional[float] = Header(None, description="Latency budget of this request in ms")
+):
+    # deadline for the GPT explanation, the local template explanation is used after it
+    budget_ms = PREDICT_LATENCY_BUDGET_MS if x_latency_budget_ms is None else x_latency_budget_ms
+    deadline = time.monotonic() + budget_ms / 1000 if budget_ms > 0 else None
+
+    # get insurance values
+    insurance_data = get_insurance_data(form_data)
+    snapshot = current_rules()
+    # precomputed results for this input, empty outside of the table grid
+    cell = decision_table.lookup(insurance_data, snapshot) or {}
+
+    # independent stages, awaited together: rule decision, price adjustment and
+    # reasoning via shapey values (forest + SHAP on the CPU executor, then GPT)
+    print("Getting prediction, price adjustment and explanation for decision..")
+    (decision, comment), prediction_output, reasoning_advanced = await asyncio.gather(
+        run_local(decide, insurance_data, snapshot, cell),
+        run_cpu(price_adjustment, insurance_data, cell.get("predicted_price")),
+        explain_insurance_decision_async(insurance_data, pred_proba=cell.get("probabilities"), deadline=deadline)
+    )
     
     return JSONResponse(content={
         "status": "success",
         "decision": decision,
         "reason": comment,
         "prediction_output": prediction_output.model_dump(),
-        "reasoning_advanced": reasoning_advanced
+        "reasoning_advanced": reasoning_advanced,
+        # "cache", "gpt" or "template" (GPT missed the deadline or failed)
+        "explanation_source": reasoning_advanced.get("explanation_source"),
+        "rules_version": snapshot.version
     })
 
 
+@app.post("/predict_stream")
+async def predict_stream(form_data: FormData):
+    """
+    Streaming variant of /predict (NDJSON, one JSON object per line):
+    - {"type": "decision", ...}: same fields as /predict, without the explanation
+    - {"type": "explanation_delta", "delta": ...}: GPT explanation pieces as they arrive
+    - {"type": "explanation_done", "explanation": ...}: the complete explanation
+    - {"type": "error", "message": ...}: if the explanation could not be generated
+    """
+    insurance_data = get_insurance_data(form_data)
+    snapshot = current_rules()
+    cell = decision_table.lookup(insurance_data, snapshot) or {}
+
+    # CPU-bound stages on the executor, as in /predict; GPT is streamed afterwards
+    (decision, comment), prediction_output, reasoning_advanced = await asyncio.gather(
+        run_local(decide, insurance_data, snapshot, cell),
+        run_cpu(price_adjustment, insurance_data, cell.get("predicted_price")),
+        run_cpu(explain_features, insurance_data, pred_proba=cell.get("probabilities"))
+    )
+    explainer = decision_explainer.get_explainer()
+
+    def line(event):
+        return json.dumps(event) + "\n"
+
+    async def events():
+        yield line({
+            "type": "decision",
+            "status": "success",
+            "decision": decision,
+            "reason": comment,
+            "prediction_output": prediction_output.model_dump(),
+            "reasoning_advanced": reasoning_advanced,
+            "rules_version": snapshot.version
+        })
+        parts = []
+        try:
+            async for delta in explainer.stream_gpt_explanation(reasoning_advanced):
+                parts.append(delta)
+                yield line({"type": "explanation_delta", "delta": delta})
+            yield line({"type": "explanation_done", "explanation": "".join(parts).strip()})
+        except Exception as e:
+            yield line({"type": "error", "message": f"Error generating explanation: {str(e) or type(e).__name__}"})
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/predict_batch")
+async def predict_batch(batch: BatchFormData):
+    # get insurance values for all records, invalid records are reported individually
+    insurance_df, errors = await run_local(get_insurance_data_batch, batch.records)
+
+    print(f"Getting predictions for {len(insurance_df)} records..")
+    snapshot = current_rules()
+    # CPU-bound stages on the executor, as in /predict
+    (decisions, comments), reasoning, prediction_outputs = await asyncio.gather(
+        run_local(predict_decision_batch, insurance_df, snapshot),
+        run_cpu(explain_features_batch, insurance_df),
+        run_cpu(price_adjustment_batch, insurance_df)
+    )
+    if batch.use_gpt:
+        # awaited concurrently, under the cache, cap and timeout of the LLM calls
+        explanations = await gpt_explanations_async(reasoning)
+        for result, explanation in zip(reasoning, explanations):
+            result["explanation"] = explanation
+
+    results = [
+        {"index": i, "status": "error", "message": message}
+        for i, message in errors.items()
+    ]
+    for row, i in enumerate(insurance_df.index):
+        results.append({
+            "index": int(i),
+            "status": "success",
+            "decision": decisions[row],
+            "reason": comments[row],
+            "prediction_output": prediction_outputs[row].model_dump(),
+            "reasoning_advanced": reasoning[row]
+        })
+    results.sort(key=lambda r: r["index"])
+
+    return JSONResponse(content={
+        "status": "success",
+        "n_success": len(insurance_df),
+        "n_errors": len(errors),
+        "rules_version": snapshot.version,
+        "results": results
+    })
+
+
+@app.post("/predict_bulk")
+async def predict_bulk(
+    file: UploadFile = File(..., description="CSV or Parquet file with FormData columns"),
+    output: str = Form("ndjson", description="'ndjson' (streamed) or 'parquet' (file)"),
+    use_gpt: bool = Form(False, description="Generate a GPT explanation for every record (slow)"),
+    chunk_size: int = Form(bulk_underwriting.BULK_CHUNK_SIZE, gt=0, description="Rows per chunk")
+):
+    """
+    Underwrite every applicant of an uploaded spreadsheet, in chunks:
+    - output=ndjson: one {"type": "result", ...} line per row (same fields as
+      the /predict_batch results), then a {"type": "summary", ...} line
+    - output=parquet: a Parquet file with one row per applicant
+    """
+    try:
+        fmt = bulk_underwriting.input_format(file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if output not in ("ndjson", "parquet"):
+        raise HTTPException(status_code=400, detail="output must be 'ndjson' or 'parquet'")
+
+    if output == "ndjson":
+        return StreamingResponse(
+            bulk_underwriting.iter_ndjson(file.file, fmt, use_gpt, chunk_size),
+            media_type="application/x-ndjson"
+        )
+
+    fd, path = tempfile.mkstemp(suffix=".parquet")
+    os.close(fd)
+    try:
+        stats = await bulk_underwriting.write_parquet(file.file, fmt, path, use_gpt, chunk_size)
+    except Exception as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=f"Bulk underwriting failed: {str(e) or type(e).__name__}")
+    return FileResponse(
+        path, media_type="application/vnd.apache.parquet", filename="underwriting_results.parquet",
+        headers={"X-Rules-Version": str(stats["rules_version"]), "X-Rows": str(stats["n_rows"])},
+        background=BackgroundTask(os.remove, path)
+    )
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Readiness: 200 once the startup (and the warm-up, if enabled) completed,
+    503 before. Lists which components are loaded and how long each took.
+    """
+    state = startup.status()
+    content = {
+        "status": "ready" if state["ready"] else "starting",
+        **state,
+        "components": {
+            "rules": rules_loaded(),
+            "decision_table": decision_table.table is not None,
+            "price_model": insurance_model.is_loaded(),
+            "decision_explainer": decision_explainer.is_loaded(),
+        },
+        "startup_seconds": startup.timings(),
+    }
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=content)
+
 @app.post("/admin/update_rules")
 def update_rules(update: RuleUpdate):
+    # Runs in the threadpool: /predict keeps serving the current snapshot while
+    # the new one and its precomputed positions are built
     try:
-        # Convert list of RuleItem into a DataFrame
-        nlines = replace_rule_table(update.rules)
-        return {"status": "success", "message": f"Rule table updated. {nlines} rules now active."}
+        snapshot = replace_rule_table(
+            (rule.model_dump() for rule in update.rules), prepare=decision_table.prepare_rules
+        )
+        nlines = len(snapshot.rules_df)
+        return {
+            "status": "success",
+            "message": f"Rule table updated. {nlines} rules now active (version {snapshot.version}).",
+            "rules_version": snapshot.version
+        }
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to update rules: {str(e)}")
 
+@app.post("/admin/reload_explainer")
+def reload_explainer():
+    if not decision_explainer.load_model():
+        raise HTTPException(status_code=500, detail="Failed to reload decision explainer")
+    # re-check the precomputed probabilities against the reloaded model file
+    decision_table.load()
+    # pool processes (PREDICT_EXECUTOR=process) hold their own explainer
+    cpu_executor.restart()
+    # the other workers reload on their next request
+    decision_explainer.announce_reload()
+    return {"status": "success", "message": "Decision explainer reloaded."}
+
+@app.get("/admin/explanation_cache")
+def explanation_cache_stats():
+    return {"status": "success", "stats": explanation_cache.stats()}
+
+@app.get("/admin/extraction_cache")
+def extraction_cache_stats():
+    return {"status": "success", "stats": extraction_cache.stats()}
+
+def collect_metrics():
+    """Values read at scrape time for /metrics (see `metrics.render`)"""
+    collected = [
+        ("llm_in_flight", "gauge", "LLM calls in flight in this worker.", llm_limits.in_flight),
+        ("llm_background_calls", "gauge", "GPT explanation calls still running after their request's deadline.",
+         len(reasoning_agent._background_calls)),
+        ("decision_table_loaded", "gauge", "1 if the precomputed decision table is loaded.",
+         int(decision_table.table is not None)),
+        ("ready", "gauge", "1 once the worker is ready (see /health/ready).", int(startup.status()["ready"])),
+    ]
+    if rules_loaded():
+        snapshot = current_rules()
+        collected += [
+            ("rules_count", "gauge", "Rules in the served learned rules table.", len(snapshot.rules_df)),
+            ("rules_version", "gauge", "Version of the served learned rules table.", snapshot.version),
+        ]
+
+    caches = {"explanation": explanation_cache.stats(), "extraction": extraction_cache.stats()}
+    if decision_explainer.is_loaded():
+        caches["shap"] = decision_explainer.get_explainer().shap_cache.stats()
+    hits = {
+        "explanation": caches["explanation"]["memory_hits"] + caches["explanation"]["disk_hits"],
+        "extraction": caches["extraction"]["hits"] + caches["extraction"]["coalesced"],
+    }
+    if "shap" in caches:
+        hits["shap"] = caches["shap"]["hits"]
+    collected += [
+        ("cache_hits_total", "counter", "Cache lookups answered from the cache.", hits, "cache"),
+        ("cache_misses_total", "counter", "Cache lookups that missed.",
+         {name: stats["misses"] for name, stats in caches.items()}, "cache"),
+        ("cache_hit_ratio", "gauge", "Share of cache lookups answered from the cache since start.",
+         {name: stats["hit_rate"] for name, stats in caches.items()}, "cache"),
+        ("cache_entries", "gauge", "Entries held in memory by the cache.", {
+            "explanation": caches["explanation"]["memory_entries"],
+            "extraction": caches["extraction"]["entries"],
+            "shap": caches["shap"]["entries"] if "shap" in caches else None,
+        }, "cache"),
+        ("extractions_in_flight", "gauge", "Image extractions in flight (coalesced per image).",
+         caches["extraction"]["in_flight"]),
+    ]
+    return collected
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of the metrics of this worker"""
+    return PlainTextResponse(metrics.render(collect_metrics()), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/shap_cache")
+def shap_cache_stats():
+    try:
+        explainer = decision_explainer.get_explainer()
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "success", "stats": explainer.shap_cache.stats()}
+
 # Run with: uvicorn main:app --reload
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,241 @@
+"""
+batch_learning.py - Batch Learning and Replay for the Learned Rule Table
+
+`learn_batch` feeds a whole population through the learning rule of
+`decide.decide_and_learn` and gives exactly the same decisions and final rules
+table as calling it once per applicant, in order:
+
+- exact key match with a rule: the rule's decision is served and corrected to
+  the operational decision if they differ,
+- otherwise: the decision of the most similar rule is served and a new rule
+  with the operational decision is appended.
+
+The population is processed in chunks. Within a chunk, the operational
+decisions, the nearest rule in the table as it was at the start of the chunk
+(`RuleIndex.query_batch`) and the similarity to the rules the chunk itself
+appends are computed as array operations; the effect of the earlier inputs of
+the chunk (new rules, corrections) is then resolved with the same tie-breaking
+as the sequential loop: earlier rules win ties, exact key matches come first.
+
+Every input is also scored for the convergence curves: whether the served
+(learned) decision disagrees with the operational one, the cumulative and
+rolling disagreement rates and the number of rules after each input.
+
+Usage (replay over a synthetic population, starting from learned_rules.csv):
+    python batch_learning.py --n-samples 1000000 --output /tmp/replayed_rules.csv
+"""
+
+import time
+import numpy as np
+import pandas as pd
+from decide import operational_rule_vectorized, OPERATIONAL_DECISIONS, OPERATIONAL_COMMENTS
+from rule_store import RuleStore
+
+CHUNK_SIZE = 1024
+
+ROLLING_WINDOW = 1000
+
+
+def learn_batch(rules, population, chunk_size=CHUNK_SIZE, learn_flag=True, window=ROLLING_WINDOW):
+    """
+    Run `decide_and_learn` over every row of `population`, in order.
+
+    Args:
+        rules: RuleStore (updated in place) or rules DataFrame (copied into a
+               new RuleStore)
+        population: DataFrame with 'BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT'
+        chunk_size: inputs processed together; does not change the results
+        learn_flag: same meaning as in `decide_and_learn`
+        window: length of the rolling disagreement window
+
+    Returns:
+        (store, results) where results is indexed like population, with the
+        columns DECISION, COMMENT, OPERATIONAL_DECISION, OPERATIONAL_COMMENT
+        (what decide_and_learn returns), RULE_POSITION, PERFECT_MATCH,
+        DISAGREE, DISAGREEMENT_RATE, ROLLING_DISAGREEMENT_RATE and N_RULES
+    """
+    store = rules if isinstance(rules, RuleStore) else RuleStore.from_frame(rules)
+    if store.size == 0:
+        raise ValueError("learn_batch needs a non-empty rules table")
+
+    BMI = population['BMI'].to_numpy(dtype=np.float64)
+    AGE = population['AGE'].to_numpy(dtype=np.float64)
+    SMOKER = population['SMOKER'].to_numpy(dtype=bool)
+    PRACTICE_SPORT = population['PRACTICE_SPORT'].to_numpy(dtype=bool)
+    n = len(BMI)
+
+    op_decision, op_comment = operational_rule_vectorized(BMI, AGE, SMOKER, PRACTICE_SPORT)
+    # operational outcomes as codes of the store vocabularies
+    op_decision_codes = np.array([store.decision_code(d) for d in OPERATIONAL_DECISIONS], dtype=np.int32)[op_decision]
+    op_comment_codes = np.array([store.comment_code(c) for c in OPERATIONAL_COMMENTS], dtype=np.int32)[op_comment]
+
+    decision = np.empty(n, dtype=np.int32)
+    comment = np.empty(n, dtype=np.int32)
+    rule_pos = np.empty(n, dtype=np.int64)
+    perfect = np.empty(n, dtype=bool)
+    n_rules = np.empty(n, dtype=np.int64)
+
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        chunk = slice(start, end)
+        _learn_chunk(
+            store, BMI[chunk], AGE[chunk], SMOKER[chunk], PRACTICE_SPORT[chunk],
+            op_decision_codes[chunk], op_comment_codes[chunk], learn_flag,
+            decision[chunk], comment[chunk], rule_pos[chunk], perfect[chunk], n_rules[chunk]
+        )
+
+    decisions = np.array(store.decisions, dtype=object)
+    comments = np.array(store.comments, dtype=object)
+    disagree = decision != op_decision_codes
+    results = pd.DataFrame({
+        'DECISION': decisions[decision],
+        'COMMENT': comments[comment],
+        'OPERATIONAL_DECISION': decisions[op_decision_codes],
+        'OPERATIONAL_COMMENT': comments[op_comment_codes],
+        'RULE_POSITION': rule_pos,
+        'PERFECT_MATCH': perfect,
+        'DISAGREE': disagree,
+        'DISAGREEMENT_RATE': np.cumsum(disagree) / np.arange(1, n + 1),
+        'ROLLING_DISAGREEMENT_RATE': pd.Series(disagree).rolling(window, min_periods=1).mean().to_numpy(),
+        'N_RULES': n_rules,
+    }, index=population.index)
+    return store, results
+
+
+def _learn_chunk(store, BMI, AGE, SMOKER, PRACTICE_SPORT, op_decision, op_comment, learn_flag,
+                 decision, comment, rule_pos, perfect, n_rules):
+    """Process one chunk in input order; writes the per-input outputs in place."""
+    c = len(BMI)
+    rows = np.arange(c)
+    size0 = store.size
+
+    # Exact key match with a rule of the table at chunk start, or else the
+    # nearest of those rules (both as in RuleIndex.query)
+    # (the nearest-rule scan is only needed for inputs without an exact match)
+    pre_exact = store.index.exact_batch(BMI, AGE, SMOKER, PRACTICE_SPORT)
+    pre_pos = pre_exact.copy()
+    pre_sim = np.full(c, np.inf)
+    scan = np.flatnonzero(pre_exact < 0)
+    if len(scan):
+        pre_pos[scan], pre_sim[scan] = store.index.query_batch(
+            BMI[scan], AGE[scan], SMOKER[scan], PRACTICE_SPORT[scan]
+        )
+
+    # First input of the chunk with the same key
+    keys = np.rec.fromarrays([BMI, AGE, SMOKER, PRACTICE_SPORT])
+    _, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    first_occurrence = first_index[inverse.ravel()]
+
+    if not learn_flag:
+        exact = pre_exact >= 0
+        rule_pos[:] = pre_pos
+        perfect[:] = exact
+        decision[:] = store.decision[rule_pos]
+        comment[:] = store.comment[rule_pos]
+        n_rules[:] = size0
+        return
+
+    # Inputs whose key is new append a rule, only the first of a repeated key
+    adds = (pre_exact < 0) & (first_occurrence == rows)
+    added = np.flatnonzero(adds)
+    new_pos = np.full(c, -1, dtype=np.int64)
+    new_pos[added] = size0 + np.arange(len(added))
+
+    # Nearest rule among those appended by earlier inputs of the chunk; same
+    # operation order as RuleIndex similarities, earliest rule wins ties
+    best = pre_pos.copy()
+    if len(added):
+        sims = 1 - np.abs(BMI[None, added] - BMI[:, None]) / 100
+        sims += 1 - np.abs(AGE[None, added] - AGE[:, None]) / 100
+        sims += SMOKER[None, added] == SMOKER[:, None]
+        sims += PRACTICE_SPORT[None, added] == PRACTICE_SPORT[:, None]
+        sims[added[None, :] >= rows[:, None]] = -np.inf
+        j = np.argmax(sims, axis=1)
+        use_new = sims[rows, j] > pre_sim
+        best[use_new] = size0 + j[use_new]
+
+    # Exact matches take precedence: with a table rule, or with a rule an
+    # earlier input of the chunk appended
+    pre_match = pre_exact >= 0
+    chunk_match = ~pre_match & (first_occurrence < rows)
+    best[pre_match] = pre_exact[pre_match]
+    best[chunk_match] = new_pos[first_occurrence[chunk_match]]
+
+    # Table rules corrected in this chunk: at their first exact match, if the
+    # stored decision differs from the operational one
+    first_match = np.flatnonzero(pre_match & (first_occurrence == rows))
+    matched_rules = pre_exact[first_match]
+    corrected = store.decision[matched_rules] != op_decision[first_match]
+    order = np.argsort(matched_rules)
+    matched_rules, first_match, corrected = matched_rules[order], first_match[order], corrected[order]
+
+    # Served decision: state of the best rule once the inputs before (and, for
+    # an exact match, including) this one were processed
+    dec = np.empty(c, dtype=np.int32)
+    com = np.empty(c, dtype=np.int32)
+    in_table = best < size0
+    dec[in_table] = store.decision[best[in_table]]
+    com[in_table] = store.comment[best[in_table]]
+    # appended rules carry the operational outcome of the input that added them
+    appended = ~in_table
+    adder = added[best[appended] - size0]
+    dec[appended] = op_decision[adder]
+    com[appended] = op_comment[adder]
+    # table rules corrected earlier in the chunk (or now, by an exact match)
+    if len(matched_rules):
+        k = np.searchsorted(matched_rules, best[in_table]).clip(max=len(matched_rules) - 1)
+        table_rows = np.flatnonzero(in_table)
+        was_corrected = (
+            (matched_rules[k] == best[in_table]) & corrected[k] & (first_match[k] <= table_rows)
+        )
+        corrected_rows = table_rows[was_corrected]
+        source = first_match[k[was_corrected]]
+        dec[corrected_rows] = op_decision[source]
+        com[corrected_rows] = op_comment[source]
+
+    decision[:] = dec
+    comment[:] = com
+    rule_pos[:] = best
+    perfect[:] = pre_match | chunk_match
+    n_rules[:] = size0 + np.cumsum(adds)
+
+    # Apply the chunk to the store
+    store.set_decision_codes(
+        matched_rules[corrected], op_decision[first_match[corrected]], op_comment[first_match[corrected]]
+    )
+    if len(added):
+        store.extend(
+            BMI[added], AGE[added], SMOKER[added], PRACTICE_SPORT[added],
+            [store.decisions[d] for d in op_decision[added]],
+            [store.comments[m] for m in op_comment[added]],
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+    import decide
+    from helpers import sample_population
+
+    parser = argparse.ArgumentParser(description="Replay rule learning over a synthetic population")
+    parser.add_argument("--n-samples", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--rules", default=decide.RULES_PATH, help="initial rules CSV")
+    parser.add_argument("--output", default=None, help="write the final rules table to this CSV")
+    parser.add_argument("--curve", default=None, help="write the convergence curves to this CSV")
+    args = parser.parse_args()
+
+    population = sample_population(args.n_samples, seed=args.seed)
+    rules_df = pd.read_csv(args.rules)
+    start = time.perf_counter()
+    store, results = learn_batch(rules_df, population, chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - start
+
+    print(f"Replayed {len(results)} inputs in {elapsed:.2f}s ({len(results) / elapsed:,.0f} inputs/s)")
+    print(f"Rules: {len(rules_df)} -> {len(store)}")
+    print(f"Final disagreement rate: {results['DISAGREEMENT_RATE'].iloc[-1]:.4f} "
+          f"(last {ROLLING_WINDOW}: {results['ROLLING_DISAGREEMENT_RATE'].iloc[-1]:.4f})")
+    if args.output:
+        store.to_frame().to_csv(args.output)
+    if args.curve:
+        results[['DISAGREE', 'DISAGREEMENT_RATE', 'ROLLING_DISAGREEMENT_RATE', 'N_RULES']].to_csv(args.curve)
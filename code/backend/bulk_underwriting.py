@@ -0,0 +1,327 @@
+"""
+bulk_underwriting.py - Streaming Bulk Underwriting of CSV / Parquet Files
+
+Brokers send spreadsheets with thousands of applicants. Instead of one
+`/predict` request per row, the file is read in chunks of `BULK_CHUNK_SIZE`
+rows, and every chunk goes through the same steps as `/predict_batch`:
+
+1. `helpers.get_insurance_data_batch` (rows that cannot be transformed are
+   reported individually, they do not stop the file),
+2. the rule decision of the rules snapshot taken when the file starts
+   (`decide.predict_decision_batch`), so the whole file uses one version,
+3. the price model (`calculate_price_adjustment_batch`),
+4. optionally the GPT explanation of each applicant (explanation cache, LLM
+   concurrency cap and timeout of the API).
+
+Results are produced chunk by chunk, as NDJSON lines (`iter_ndjson`, for the
+`/predict_bulk` endpoint) or as row groups of a Parquet file (`write_parquet`),
+so memory stays bounded by the chunk size whatever the file size.
+
+Input columns are those of `schemas.FormData` (height_cm, weight_kg,
+date_of_birth as DD.MM.YYYY, smokes, sports, insurance_price, ...). In CSV
+files `sports` lists the sports separated by ";", an empty cell means no
+sport; in Parquet files it may also be a list column.
+
+Configuration (environment variables):
+- `BULK_CHUNK_SIZE`: rows per chunk (default: 1000)
+
+Usage:
+    python bulk_underwriting.py applicants.csv --output results.parquet
+    python bulk_underwriting.py applicants.parquet --output results.ndjson --gpt
+"""
+
+import asyncio
+import json
+import os
+import numpy as np
+import pandas as pd
+from pydantic import ValidationError
+from schemas import FormData
+from helpers import get_insurance_data_batch
+from decide import current_rules, predict_decision_batch
+from price_predictor import insurance_model
+from reasoning_agent import decision_explainer, gpt_explanations_async
+from cpu_executor import run_local
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 1000))
+
+INPUT_FORMATS = ("csv", "parquet")
+
+FORM_COLUMNS = list(FormData.model_fields)
+
+# Text columns of the input, kept as strings when reading CSV
+TEXT_COLUMNS = ["first_name", "last_name", "date_of_birth", "sports"]
+
+# Columns of the flat (Parquet) results
+RESULT_COLUMNS = [
+    "index", "status", "message", "decision", "reason",
+    "predicted_price", "base_price", "adjustment_percentage", "adjustment_euro", "explanation"
+]
+
+
+def input_format(filename, declared=None):
+    """
+    Input format from the declared format or the file extension.
+
+    Raises:
+        ValueError: If the format is not csv or parquet
+    """
+    fmt = (declared or os.path.splitext(filename or "")[1].lstrip(".")).lower()
+    fmt = "parquet" if fmt == "pq" else fmt
+    if fmt not in INPUT_FORMATS:
+        raise ValueError(f"Unsupported input format {fmt!r}, expected a .csv or .parquet file")
+    return fmt
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError("Parquet files require pyarrow (conda install pyarrow), or use CSV") from e
+
+
+def iter_chunks(source, fmt, chunk_size=BULK_CHUNK_SIZE):
+    """
+    DataFrames of at most chunk_size input rows, read lazily from source (a
+    path or a binary file object).
+    """
+    if fmt == "parquet":
+        _require_pyarrow()
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        dtype = {column: str for column in TEXT_COLUMNS}
+        yield from pd.read_csv(source, chunksize=chunk_size, dtype=dtype, skipinitialspace=True)
+
+
+def _sports(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [s.strip() for s in value.split(";") if s.strip()]
+    return [str(s) for s in value]
+
+
+def parse_forms(chunk):
+    """
+    FormData objects of the rows of an input chunk.
+
+    Returns:
+        (forms, positions, errors) where forms are the valid rows, positions
+        their row positions in the chunk and errors maps the position of each
+        invalid row to a message
+    """
+    chunk = chunk.reindex(columns=FORM_COLUMNS)
+    records = chunk.astype(object).where(chunk.notna(), None).to_dict("records")
+    forms, positions, errors = [], [], {}
+    for i, record in enumerate(records):
+        record["sports"] = _sports(record["sports"])
+        try:
+            forms.append(FormData.model_validate(record))
+            positions.append(i)
+        except ValidationError as e:
+            first = e.errors()[0]
+            errors[i] = f"{'.'.join(str(p) for p in first['loc'])}: {first['msg']}"
+    return forms, positions, errors
+
+
+def underwrite_chunk(chunk, snapshot, offset=0, use_gpt=False):
+    """
+    Decision and price of every row of an input chunk (the explanation column
+    stays empty, see `add_explanations`).
+
+    Args:
+        chunk: DataFrame of input rows
+        snapshot: rules snapshot used for the decisions
+        offset: row number of the first row of the chunk in the file
+        use_gpt: also compute the explainer results needed for GPT
+
+    Returns:
+        (results, explainer_results) where results is a DataFrame with
+        RESULT_COLUMNS, one row per input row, and explainer_results maps
+        result rows to explainer results (empty without use_gpt)
+    """
+    n = len(chunk)
+    forms, positions, errors = parse_forms(chunk)
+    insurance_df, batch_errors = get_insurance_data_batch(forms)
+    positions = np.asarray(positions, dtype=np.int64)
+    for i, message in batch_errors.items():
+        errors[int(positions[i])] = message
+
+    results = pd.DataFrame({
+        "index": np.arange(offset, offset + n, dtype=np.int64),
+        "status": np.full(n, "error", dtype=object),
+        "message": np.full(n, None, dtype=object),
+        "decision": np.full(n, None, dtype=object),
+        "reason": np.full(n, None, dtype=object),
+        "predicted_price": np.full(n, np.nan),
+        "base_price": np.full(n, np.nan),
+        "adjustment_percentage": np.full(n, np.nan),
+        "adjustment_euro": np.full(n, np.nan),
+        "explanation": np.full(n, None, dtype=object),
+    })
+    for i, message in errors.items():
+        results.at[i, "message"] = message
+
+    explainer_results = {}
+    if len(insurance_df):
+        rows = positions[insurance_df.index.to_numpy()]
+        decisions, comments = predict_decision_batch(insurance_df, snapshot)
+        outputs = insurance_model.calculate_price_adjustment_batch(insurance_df)
+        results.loc[rows, "status"] = "success"
+        results.loc[rows, "decision"] = decisions
+        results.loc[rows, "reason"] = comments
+        for column in ("predicted_price", "base_price", "adjustment_percentage", "adjustment_euro"):
+            results.loc[rows, column] = [getattr(output, column) for output in outputs]
+        if use_gpt:
+            explained = decision_explainer.get_explainer().predict_with_explanation_batch(insurance_df)
+            explainer_results = dict(zip(rows.tolist(), explained))
+    return results, explainer_results
+
+
+async def add_explanations(results, explainer_results, gpt_model="gpt-4"):
+    """Fill the explanation column with GPT explanations, requested concurrently (cache, cap and timeout of the API)"""
+    if not explainer_results:
+        return results
+    rows = list(explainer_results)
+    results.loc[rows, "explanation"] = await gpt_explanations_async(
+        [explainer_results[row] for row in rows], gpt_model
+    )
+    return results
+
+
+async def iter_results(source, fmt, use_gpt=False, chunk_size=BULK_CHUNK_SIZE, snapshot=None):
+    """
+    Async iterator over the result DataFrames of the chunks of source. Reading
+    and scoring run in threads (`cpu_executor.run_local`), GPT calls are awaited.
+    """
+    snapshot = snapshot or current_rules()
+    chunks = iter_chunks(source, fmt, chunk_size)
+    offset = 0
+    while True:
+        chunk = await run_local(next, chunks, None)
+        if chunk is None:
+            return
+        results, explainer_results = await run_local(underwrite_chunk, chunk, snapshot, offset, use_gpt)
+        offset += len(chunk)
+        yield await add_explanations(results, explainer_results)
+
+
+def _line(event):
+    return json.dumps(event) + "\n"
+
+
+def result_records(results):
+    """NDJSON events of a result chunk, shaped like the results of /predict_batch"""
+    for row in results.to_dict("records"):
+        if row["status"] != "success":
+            yield {"type": "result", "index": row["index"], "status": "error", "message": row["message"]}
+            continue
+        event = {
+            "type": "result",
+            "index": row["index"],
+            "status": "success",
+            "decision": row["decision"],
+            "reason": row["reason"],
+            "prediction_output": {
+                "predicted_price": row["predicted_price"],
+                "base_price": row["base_price"],
+                "adjustment_percentage": row["adjustment_percentage"],
+                "adjustment_euro": row["adjustment_euro"],
+            },
+        }
+        if row["explanation"] is not None:
+            event["explanation"] = row["explanation"]
+        yield event
+
+
+async def iter_ndjson(source, fmt, use_gpt=False, chunk_size=BULK_CHUNK_SIZE):
+    """
+    NDJSON lines of the results (one "result" line per input row, in file
+    order), then a "summary" line with the counts and the rules version; an
+    "error" line ends the stream if the file cannot be read or scored.
+    """
+    snapshot = current_rules()
+    n_success = n_errors = 0
+    try:
+        async for results in iter_results(source, fmt, use_gpt, chunk_size, snapshot):
+            ok = int((results["status"] == "success").sum())
+            n_success += ok
+            n_errors += len(results) - ok
+            yield "".join(_line(event) for event in result_records(results))
+    except Exception as e:
+        yield _line({"type": "error", "message": f"Bulk underwriting failed: {str(e) or type(e).__name__}"})
+        return
+    yield _line({
+        "type": "summary",
+        "n_rows": n_success + n_errors,
+        "n_success": n_success,
+        "n_errors": n_errors,
+        "rules_version": snapshot.version,
+    })
+
+
+async def write_parquet(source, fmt, output_path, use_gpt=False, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Write the results to a Parquet file, one row group per chunk, as they are
+    produced.
+
+    Returns:
+        Dict with the row counts and the rules version
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("index", pa.int64()), ("status", pa.string()), ("message", pa.string()),
+        ("decision", pa.string()), ("reason", pa.string()),
+        ("predicted_price", pa.float64()), ("base_price", pa.float64()),
+        ("adjustment_percentage", pa.float64()), ("adjustment_euro", pa.float64()),
+        ("explanation", pa.string()),
+    ])
+    snapshot = current_rules()
+    n_rows = n_success = 0
+    with pq.ParquetWriter(output_path, schema) as writer:
+        async for results in iter_results(source, fmt, use_gpt, chunk_size, snapshot):
+            table = pa.Table.from_pandas(results[RESULT_COLUMNS], schema=schema, preserve_index=False)
+            await run_local(writer.write_table, table)
+            n_rows += len(results)
+            n_success += int((results["status"] == "success").sum())
+    return {
+        "n_rows": n_rows,
+        "n_success": n_success,
+        "n_errors": n_rows - n_success,
+        "rules_version": snapshot.version,
+    }
+
+
+async def _write_ndjson(source, fmt, output_path, use_gpt, chunk_size):
+    with open(output_path, "w") as f:
+        async for lines in iter_ndjson(source, fmt, use_gpt, chunk_size):
+            f.write(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Underwrite a CSV / Parquet file of applicants")
+    parser.add_argument("input", help="CSV or Parquet file with FormData columns")
+    parser.add_argument("--output", required=True, help="results file (.parquet or .ndjson)")
+    parser.add_argument("--format", default=None, choices=INPUT_FORMATS, help="input format (default: from the extension)")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE)
+    parser.add_argument("--gpt", action="store_true", help="add a GPT explanation per applicant (slow)")
+    args = parser.parse_args()
+
+    fmt = input_format(args.input, args.format)
+    if not insurance_model.load_model():
+        raise SystemExit("Could not load the price model")
+    start = time.perf_counter()
+    if args.output.endswith((".parquet", ".pq")):
+        stats = asyncio.run(write_parquet(args.input, fmt, args.output, args.gpt, args.chunk_size))
+        print(json.dumps(stats, indent=2))
+    else:
+        asyncio.run(_write_ndjson(args.input, fmt, args.output, args.gpt, args.chunk_size))
+    print(f"Done in {time.perf_counter() - start:.1f}s -> {args.output}")
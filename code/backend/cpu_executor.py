@@ -0,0 +1,129 @@
+"""
+cpu_executor.py - Executor for the CPU-Bound Stages of the API
+
+`/predict` used to run the rule decision, the price forest, the decision
+forest + SHAP and the GPT call one after the other on the event loop thread,
+so every millisecond of forest or SHAP work also stalled every other request
+of the worker. The CPU-bound stages are now submitted to a bounded pool and
+awaited together with the (I/O-bound) GPT call, so a request takes about as
+long as its slowest chain of stages and the event loop stays free.
+
+Two kinds of stages:
+- `run_cpu`: self-contained work on the process-wide models (price forest,
+  decision forest + SHAP). The function and its arguments must be picklable
+  (module-level functions, plain data) so it can run in a process pool.
+- `run_local`: work that needs state of this process (e.g. the rules snapshot
+  a request started with); always runs in a thread of this process.
+
+Modes (`PREDICT_EXECUTOR`):
+- "thread" (default): both kinds run on one thread pool. The forests and SHAP
+  release the GIL only partly, so this mostly keeps the event loop free and
+  overlaps the CPU work with the GPT round trip.
+- "process": `run_cpu` stages run in a pool of worker processes, each loading
+  its own price model and decision explainer (and SHAP cache) at start, in
+  exchange for real parallelism on several cores. `restart` replaces the
+  processes after a model reload.
+- "inline": no executor, the stages run on the event loop as before.
+
+Configuration (environment variables):
+- `PREDICT_EXECUTOR`: "thread", "process" or "inline" (default: "thread")
+- `PREDICT_EXECUTOR_WORKERS`: threads or processes of the pool
+  (default: min(4, CPU count))
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+PREDICT_EXECUTOR = os.getenv("PREDICT_EXECUTOR", "thread")
+PREDICT_EXECUTOR_WORKERS = int(os.getenv("PREDICT_EXECUTOR_WORKERS", min(4, os.cpu_count() or 1)))
+
+if PREDICT_EXECUTOR not in ("thread", "process", "inline"):
+    raise ValueError(f"PREDICT_EXECUTOR must be 'thread', 'process' or 'inline', not {PREDICT_EXECUTOR!r}")
+
+_lock = threading.Lock()
+_threads = None
+_processes = None
+
+
+def _load_process_models():
+    """Initializer of the pool processes: load the models before the first stage arrives"""
+    from price_predictor import insurance_model
+    from reasoning_agent import decision_explainer
+    insurance_model.load_model()
+    decision_explainer.load_model()
+
+
+def _thread_pool():
+    global _threads
+    with _lock:
+        if _threads is None:
+            _threads = ThreadPoolExecutor(max_workers=PREDICT_EXECUTOR_WORKERS, thread_name_prefix="predict")
+        return _threads
+
+
+def _process_pool():
+    global _processes
+    with _lock:
+        if _processes is None:
+            # spawn: forking a process that runs threads (uvicorn, warm-ups) is unsafe
+            _processes = ProcessPoolExecutor(
+                max_workers=PREDICT_EXECUTOR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_load_process_models
+            )
+        return _processes
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a self-contained CPU-bound stage on the configured pool and await its result"""
+    if PREDICT_EXECUTOR == "inline":
+        return fn(*args, **kwargs)
+    pool = _process_pool() if PREDICT_EXECUTOR == "process" else _thread_pool()
+    return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+
+
+async def run_local(fn, *args, **kwargs):
+    """Run a stage that needs this process' state in a thread and await its result"""
+    if PREDICT_EXECUTOR == "inline":
+        return fn(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_thread_pool(), functools.partial(fn, *args, **kwargs))
+
+
+def start():
+    """Create the pool now (process mode: starts loading the models in the processes)"""
+    if PREDICT_EXECUTOR == "process":
+        pool = _process_pool()
+        # processes are only spawned on the first submit
+        for _ in range(PREDICT_EXECUTOR_WORKERS):
+            pool.submit(os.getpid)
+    if PREDICT_EXECUTOR != "inline":
+        _thread_pool()
+
+
+def restart():
+    """
+    Replace the worker processes, so they load the current model files
+    (process mode; threads share the models of this process and need nothing).
+    Stages already submitted finish on the old processes.
+    """
+    global _processes
+    with _lock:
+        old, _processes = _processes, None
+    if old is not None:
+        old.shutdown(wait=False)
+        start()
+
+
+def shutdown():
+    """Stop the pools (end of the application lifespan)"""
+    global _threads, _processes
+    with _lock:
+        pools = [_threads, _processes]
+        _threads = _processes = None
+    for pool in pools:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
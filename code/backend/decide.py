@@ -10,24 +10,63 @@ The engine's primary function is to determine an insurance decision (e.g., 'acce
 
 Key Components:
 1. Operational Rules (`operational_rule`): A set of rigid, pre-defined business
-   rules.
+   rules. `operational_rule_vectorized` applies the same rules, with the same
+   first-match priority, to whole arrays of applicants.
 2. Learned Rules (`rules_df`): A pandas DataFrame loaded from a CSV that stores
-   past decisions and serves as a historical decision-making reference.
+   past decisions and serves as a historical decision-making reference. The
+   CSV is read on first use (`current_rules()`), not at import.
 3. Decision Logic (`decide_and_learn`): Compares the input to the Learned Rules
    using a custom similarity metric. If the global `LEARN_FLAG` is True, this
    function ensures the Operational Decision overrides the Learned Decision upon a
    perfect match, thereby **correcting** the learned rule, or **adding** a new
    rule if no match is found. This enables continuous learning.
+4. Rule Index (`rule_index.RuleIndex`): Nearest-rule lookups are answered by a
+   NumPy index partitioned by SMOKER/PRACTICE_SPORT instead of a row-wise scan,
+   and perfect matches by a hash map of the (BMI, AGE, SMOKER, PRACTICE_SPORT)
+   key; `compute_similarity` stays the reference definition of the metric.
+5. Rule Store (`rule_store.RuleStore`): `decide_and_learn` also accepts a
+   columnar rule store, on which learning appends and corrects rules in O(1)
+   instead of reallocating a DataFrame (for long learning loops).
+6. Compaction (`compact_rules`, `python decide.py compact`): Drops rules whose
+   key repeats an earlier rule. Queries always return the first of equal keys,
+   so the dropped rows were unreachable and decisions do not change. Learning
+   only adds rules for new keys, so a compacted table stays compacted.
+7. Snapshots (`current_rules`, `build_rule_snapshot`, `publish_rule_snapshot`):
+   The served rules table is an immutable, versioned snapshot (DataFrame +
+   rule index). A replacement is built off the read path and swapped in with
+   a single reference assignment; readers take no lock and in-flight requests
+   finish on the snapshot they started with. `replace_rule_table` serializes
+   whole updates, so each published table carries the arrays (e.g. decision
+   table positions) prepared for it. With `SHARED_STATE_DIR` set, the
+   snapshots are published as numbered generations shared by all workers
+   (`shared_state`), and the version of a snapshot is its generation.
 """
 
+import threading
 import pandas as pd
 import numpy as np
+from rule_index import get_rule_index
+from rule_store import RuleStore
+from startup import timed
+import metrics
+import shared_state
 
 LEARN_FLAG = True  # Global learning flag
 
 columns = ['BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT', 'DECISION', 'COMMENT']
 
-rules_df = pd.read_csv("../../assets/learned_rules.csv")
+KEY_COLUMNS = ['BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT']
+
+RULES_PATH = "../../assets/learned_rules.csv"
+
+# `rules_df` (the current learned rules table) is read from RULES_PATH on first
+# access, see `current_rules` and `__getattr__` below
+
+
+def __getattr__(name):
+    if name == "rules_df":
+        return current_rules().rules_df
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --------------------------------------------------
 # 1. Operational Analytical Rule
@@ -90,6 +129,127 @@ def operational_rule(BMI, AGE, SMOKER, PRACTICE_SPORT):
     return "accepted with extra charge", "moderate risk profile, no major issues"
 
 
+# The four decisions of the operational rules (alphabetical); decision codes
+# index this list
+OPERATIONAL_DECISIONS = [
+    "accepted",
+    "accepted with extra charge",
+    "need for additional information",
+    "rejected",
+]
+
+# Decisions and comments of the operational rules, in the priority order of
+# operational_rule (the last entry is the catch-all); comment codes index this list
+OPERATIONAL_OUTCOMES = [
+    ("rejected", "very high age (86+ years)"),
+    ("rejected", "morbid obesity (BMI > 45)"),
+    ("rejected", "severely underweight minor (BMI < 14)"),
+    ("rejected", "severe underweight adult (BMI < 16)"),
+    ("rejected", "obese smoker (BMI > 35)"),
+    ("rejected", "aged smoker without sport"),
+    ("need for additional information", "BMI outside healthy adolescent range"),
+    ("accepted", "healthy adolescent profile"),
+    ("accepted with extra charge", "healthy older adult (60–85), active and good BMI"),
+    ("rejected", "older adult (>=76), not active"),
+    ("accepted with extra charge", "smoker with overweight BMI"),
+    ("accepted with extra charge", "older smoker"),
+    ("accepted with extra charge", "obese (BMI 35–45)"),
+    ("accepted with extra charge", "underweight adult"),
+    ("accepted with extra charge", "advanced age (70+)"),
+    ("accepted with extra charge", "inactive overweight"),
+    ("need for additional information", "age between 65–70, require medical exam"),
+    ("need for additional information", "unusual BMI for young adult"),
+    ("accepted", "healthy BMI, non-smoker, active, age ≤ 60"),
+    ("accepted", "healthy BMI, non-smoker, age ≤ 60"),
+    ("accepted with extra charge", "moderate risk profile, no major issues"),
+]
+
+OPERATIONAL_COMMENTS = [comment for _, comment in OPERATIONAL_OUTCOMES]
+
+_OUTCOME_DECISION_CODES = np.array(
+    [OPERATIONAL_DECISIONS.index(decision) for decision, _ in OPERATIONAL_OUTCOMES], dtype=np.int8
+)
+
+
+def operational_rule_vectorized(BMI, AGE, SMOKER, PRACTICE_SPORT):
+    """
+    Vectorized `operational_rule` over arrays of applicants.
+
+    The conditions are the ones of `operational_rule`, listed in the same
+    order; for every applicant the first condition that holds wins.
+
+    Returns:
+        (decision_codes, comment_codes): int8 arrays indexing
+        OPERATIONAL_DECISIONS and OPERATIONAL_COMMENTS
+    """
+    BMI = np.asarray(BMI, dtype=np.float64)
+    AGE = np.asarray(AGE, dtype=np.float64)
+    S = np.asarray(SMOKER, dtype=bool)
+    P = np.asarray(PRACTICE_SPORT, dtype=bool)
+
+    healthy_bmi = (18.5 <= BMI) & (BMI <= 30)
+    conditions = [
+        # --- Hard rejections ---
+        AGE > 85,
+        BMI > 45,
+        (BMI < 14) & (AGE < 18),
+        (BMI < 16) & (AGE >= 18),
+        S & (BMI > 35),
+        S & (AGE > 67) & ~P,
+        # --- Adolescents ---
+        (AGE < 18) & ((BMI < 16) | (BMI > 30)),
+        AGE < 18,
+        # --- Very healthy older adults ---
+        (AGE <= 85) & (AGE > 60) & ~S & P & healthy_bmi,
+        (AGE > 75) & ~P,
+        # --- Extra charge rules ---
+        S & (BMI > 25),
+        S & (AGE > 60),
+        (35 <= BMI) & (BMI <= 45),
+        BMI < 18.5,
+        (AGE >= 70) & ~S,
+        ~P & (BMI > 30),
+        # --- Need more info ---
+        (65 <= AGE) & (AGE < 70),
+        (18 <= AGE) & (AGE <= 25) & ((BMI < 18.5) | (BMI > 30)),
+        # --- Default acceptance ---
+        healthy_bmi & (AGE <= 60) & ~S & P,
+        healthy_bmi & (AGE <= 60) & ~S,
+    ]
+    # Apply the conditions from lowest to highest priority so the first match wins
+    comment_codes = np.full(BMI.shape, len(conditions), dtype=np.int8)
+    for code in range(len(conditions) - 1, -1, -1):
+        comment_codes[conditions[code]] = code
+    return _OUTCOME_DECISION_CODES[comment_codes], comment_codes
+
+
+def check_operational_rule_vectorized(bmi_range=(0.0, 70.0), age_range=(0, 120)):
+    """
+    Exhaustive equivalence check of `operational_rule_vectorized` against
+    `operational_rule` on every BMI (0.1 steps) x AGE x SMOKER x PRACTICE_SPORT
+    combination of the given ranges.
+
+    Returns:
+        Number of combinations checked
+
+    Raises:
+        AssertionError: On the first combination where both versions disagree
+    """
+    n_bmi = int(round((bmi_range[1] - bmi_range[0]) * 10)) + 1
+    bmi_values = np.round(bmi_range[0] + np.arange(n_bmi) / 10, 1)
+    age_values = np.arange(age_range[0], age_range[1] + 1)
+    BMI, AGE, SMOKER, PRACTICE_SPORT = (
+        grid.ravel() for grid in np.meshgrid(bmi_values, age_values, [False, True], [False, True], indexing="ij")
+    )
+
+    decision_codes, comment_codes = operational_rule_vectorized(BMI, AGE, SMOKER, PRACTICE_SPORT)
+    for i, args in enumerate(zip(BMI.tolist(), AGE.tolist(), SMOKER.tolist(), PRACTICE_SPORT.tolist())):
+        expected = operational_rule(*args)
+        got = (OPERATIONAL_DECISIONS[decision_codes[i]], OPERATIONAL_COMMENTS[comment_codes[i]])
+        assert got == expected, f"operational_rule{args}: expected {expected}, got {got}"
+    return len(BMI)
+
+
 # --------------------------------------------------
 # 2. Similarity and rule selection
 # --------------------------------------------------
@@ -103,18 +263,34 @@ def compute_similarity(row, x_input):
 
 
 def find_best_rule(rules_df, x_input):
-    similarities = rules_df.apply(lambda r: compute_similarity(r, x_input), axis=1)
-    best_idx = similarities.idxmax()
-    return rules_df.loc[best_idx], similarities[best_idx]
+    # Same result as rules_df.apply(compute_similarity).idxmax(), via the rule index
+    with metrics.timed("find_best_rule"):
+        best_pos, similarity = get_rule_index(rules_df).query(x_input)
+    return rules_df.iloc[best_pos], similarity
+
+
+def find_top_rules(rules_df, x_input, k=5):
+    """
+    Return the k rules most similar to x_input, most similar first,
+    with their similarity in a 'SIMILARITY' column.
+    """
+    positions, similarities = get_rule_index(rules_df).query_topk(x_input, k)
+    top_rules = rules_df.iloc[positions].copy()
+    top_rules['SIMILARITY'] = similarities
+    return top_rules
 
 
 # --------------------------------------------------
 # 3. Decision and learning logic
 # --------------------------------------------------
 def decide_and_learn(rules_df, x_input, learn_flag=True):
-    operational_decision, operational_comment = operational_rule(
-        x_input['BMI'], x_input['AGE'], x_input['SMOKER'], x_input['PRACTICE_SPORT']
-    )
+    if isinstance(rules_df, RuleStore):
+        return _decide_and_learn_store(rules_df, x_input, learn_flag)
+
+    with metrics.timed("operational_rule"):
+        operational_decision, operational_comment = operational_rule(
+            x_input['BMI'], x_input['AGE'], x_input['SMOKER'], x_input['PRACTICE_SPORT']
+        )
 
     best_rule, similarity = find_best_rule(rules_df, x_input)
 
@@ -149,36 +325,286 @@ def decide_and_learn(rules_df, x_input, learn_flag=True):
     return decision, operational_decision, comment, operational_comment, rules_df
 
 
+def _decide_and_learn_store(store, x_input, learn_flag=True):
+    """`decide_and_learn` on a RuleStore: same decisions, in-place learning"""
+    # not timed (`metrics`): this is the path of long offline learning loops
+    operational_decision, operational_comment = operational_rule(
+        x_input['BMI'], x_input['AGE'], x_input['SMOKER'], x_input['PRACTICE_SPORT']
+    )
+
+    best_pos, _ = store.best_rule(x_input)
+    best_rule = store.row(best_pos)
+    decision = best_rule['DECISION']
+    comment = best_rule['COMMENT']
+
+    perfect_match = (
+        (best_rule['BMI'] == x_input['BMI']) and
+        (best_rule['AGE'] == x_input['AGE']) and
+        (best_rule['SMOKER'] == x_input['SMOKER']) and
+        (best_rule['PRACTICE_SPORT'] == x_input['PRACTICE_SPORT'])
+    )
+
+    if perfect_match:
+        if decision != operational_decision and learn_flag:
+            store.set_decision(best_pos, operational_decision, operational_comment)
+            decision = operational_decision
+            comment = operational_comment
+    elif learn_flag:
+        store.append({
+            'BMI': x_input['BMI'],
+            'AGE': x_input['AGE'],
+            'SMOKER': x_input['SMOKER'],
+            'PRACTICE_SPORT': x_input['PRACTICE_SPORT'],
+            'DECISION': operational_decision,
+            'COMMENT': operational_comment
+        })
+
+    return decision, operational_decision, comment, operational_comment, store
+
+
 # --------------------------------------------------
-# 4. Helper for API use (no learning)
+# 4. Versioned rule table snapshots
 # --------------------------------------------------
-def predict_decision(x_input):
+class RuleSnapshot:
+    """
+    One immutable version of the learned rules table: the DataFrame, its rule
+    index, a version number and named arrays computed from the table (e.g. the
+    decision-table positions of its rules), which are shared with it. Never
+    modify `rules_df` of a published snapshot; install a new snapshot instead.
+    """
+
+    __slots__ = ("version", "rules_df", "index", "arrays")
+
+    def __init__(self, version, rules_df, index=None, arrays=None):
+        self.version = version
+        self.rules_df = rules_df
+        self.index = get_rule_index(rules_df) if index is None else index
+        self.arrays = {} if arrays is None else arrays
+
+    def with_version(self, version):
+        """The same table (index and arrays included) under another version number"""
+        return RuleSnapshot(version, self.rules_df, self.index, self.arrays)
+
+
+_snapshot = None
+_publish_lock = threading.Lock()
+# serializes whole updates (build -> prepare -> publish), see `replace_rule_table`
+_update_lock = threading.Lock()
+# generation of the shared rules table, if the workers share their state
+_rules_watch = shared_state.GenerationWatch("rules") if shared_state.enabled() else None
+# newest shared generation a background attach was started for
+_attach_lock = threading.Lock()
+_attach_target = 0
+
+
+def current_rules():
+    """
+    The rules snapshot currently in use. Read it once per request and use it
+    for every lookup of that request, so a concurrent swap cannot mix versions.
+    """
+    snapshot = _snapshot
+    if snapshot is None:
+        snapshot = _load_rules()
+    elif _rules_watch is not None and _rules_watch.latest() > snapshot.version:
+        # another worker published a newer table: attach it in the background
+        # and keep serving this snapshot until it is ready
+        _attach_in_background(_rules_watch.latest())
+    return snapshot
+
+
+def _load_rules():
+    """
+    Read the learned rules CSV as the first snapshot (once, on first use). With
+    shared state, attach the current shared table instead; the first worker
+    publishes the CSV as generation 1.
+    """
+    global _snapshot, rules_df
+    with _publish_lock:
+        if _snapshot is None:
+            with timed("rules"):
+                if shared_state.enabled():
+                    generation = shared_state.generation("rules") or shared_state.publish_rules(
+                        pd.read_csv(RULES_PATH), only_if_first=True
+                    )
+                    table, arrays = shared_state.load_rules(generation)
+                    _snapshot = RuleSnapshot(generation, table, arrays=arrays)
+                else:
+                    _snapshot = RuleSnapshot(1, pd.read_csv(RULES_PATH))
+            rules_df = _snapshot.rules_df
+        return _snapshot
+
+
+def _attach_in_background(generation):
+    """Start attaching a shared generation in a thread (once per generation)"""
+    global _attach_target
+    with _attach_lock:
+        if generation <= _attach_target:
+            return
+        _attach_target = generation
+    threading.Thread(target=_attach_rules, args=(generation,), daemon=True).start()
+
+
+def _attach_rules(generation):
+    """Switch to a newer shared generation (kept on the current one if it cannot be read)"""
+    global _snapshot, rules_df
+    # read the columns and build the index before taking the lock
+    try:
+        table, arrays = shared_state.load_rules(generation)
+        snapshot = RuleSnapshot(generation, table, arrays=arrays)
+    except (OSError, ValueError) as e:
+        print(f"Rules generation {generation} not attached: {e}")
+        return
+    with _publish_lock:
+        if generation > _snapshot.version:
+            _snapshot = snapshot
+            rules_df = table
+
+
+def rules_loaded():
+    """Whether the learned rules table was read already"""
+    return _snapshot is not None
+
+
+def build_rule_snapshot(new_rules):
+    """
+    Build (without publishing) the snapshot of a new rules table, including
+    its rule index. The version is the one it will get when published next.
+
+    Parameters:
+    - new_rules: list of dicts with keys
+        'BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT', 'DECISION', 'COMMENT'
+    """
+    new_df = pd.DataFrame(list(new_rules), columns=columns)
+    if new_df.empty:
+        raise ValueError("The new rules table is empty")
+    if new_df[KEY_COLUMNS].isna().any().any():
+        raise ValueError("Rules must define BMI, AGE, SMOKER and PRACTICE_SPORT")
+
+    # Duplicate keys are unreachable
+    new_df, removed = compact_rules(new_df)
+    if removed:
+        print(f"build_rule_snapshot: dropped {removed} rules with duplicate keys")
+    return RuleSnapshot(current_rules().version + 1, new_df)
+
+
+def publish_rule_snapshot(snapshot):
+    """
+    Atomically make `snapshot` the current rules table. Requests that already
+    hold the previous snapshot finish on it.
+    """
+    global _snapshot, rules_df
+    current_rules()
+    if shared_state.enabled():
+        # the shared generation number becomes the version in every worker
+        snapshot = snapshot.with_version(shared_state.publish_rules(snapshot.rules_df, snapshot.arrays))
+        with _publish_lock:
+            if snapshot.version > _snapshot.version:
+                _snapshot = snapshot
+                rules_df = snapshot.rules_df
+        return snapshot
+
+    with _publish_lock:
+        if snapshot.version <= _snapshot.version:
+            # another table was published since this one was built
+            snapshot = snapshot.with_version(_snapshot.version + 1)
+        _snapshot = snapshot
+        rules_df = snapshot.rules_df
+    return snapshot
+
+
+# --------------------------------------------------
+# 5. Helper for API use (no learning)
+# --------------------------------------------------
+def predict_decision(x_input, snapshot=None):
     """
     Predict decision from form data without modifying the rules table.
+    Same result as decide_and_learn(..., learn_flag=False).
+    """
+    snapshot = snapshot or current_rules()
+    with metrics.timed("find_best_rule"):
+        best_pos, _ = snapshot.index.query(x_input)
+    best_rule = snapshot.rules_df.iloc[best_pos]
+    return best_rule['DECISION'], best_rule['COMMENT']
+
+def predict_decision_batch(insurance_df, snapshot=None):
+    """
+    Vectorized `predict_decision` for a DataFrame of insurance data
+    (columns 'BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT').
+
+    Returns:
+        (decisions, comments) as lists aligned with the rows of insurance_df
     """
-    decision,_,comment,_, _ = decide_and_learn(rules_df, x_input, learn_flag=False)
-    return decision, comment
+    snapshot = snapshot or current_rules()
+    with metrics.timed("find_best_rule_batch"):
+        positions, _ = snapshot.index.query_batch(
+            insurance_df['BMI'], insurance_df['AGE'],
+            insurance_df['SMOKER'], insurance_df['PRACTICE_SPORT']
+        )
+    table = snapshot.rules_df
+    decisions = table['DECISION'].to_numpy()[positions].tolist()
+    comments = table['COMMENT'].to_numpy()[positions].tolist()
+    return decisions, comments
 
 # --------------------------------------------------
-# 5. Admin bulk rule update
+# 6. Compaction and admin bulk rule update
 # --------------------------------------------------
-def replace_rule_table(new_rules):
+def compact_rules(rules_df):
     """
-    Replace the entire rules table with new rules.
+    Keep only the first rule of each (BMI, AGE, SMOKER, PRACTICE_SPORT) key.
+
+    Returns:
+        (compacted DataFrame with a fresh RangeIndex, number of rows removed)
+    """
+    duplicated = rules_df.duplicated(KEY_COLUMNS, keep='first')
+    compacted = rules_df[~duplicated].reset_index(drop=True)
+    return compacted, int(duplicated.sum())
+
+
+def replace_rule_table(new_rules, prepare=None):
+    """
+    Replace the entire rules table with new rules: builds the new snapshot,
+    lets `prepare` add its arrays, and publishes it.
+
+    Updates are serialized, so concurrent updates build consecutive versions
+    and the arrays prepared for a table are always published with that table.
 
     Parameters:
-    - rules_df: current DataFrame of rules
     - new_rules: list of dicts, each with keys:
         'BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT', 'DECISION', 'COMMENT'
+    - prepare: optional function called with the snapshot before it is
+        published (e.g. `decision_table.prepare_rules`)
 
     Returns:
-    - Updated rules_df
-    """
-    global rules_df
-    # Convert new rules list into a DataFrame
-    new_df = pd.DataFrame(new_rules, columns=rules_df.columns)
-    
-    # Replace the current rules_df with the new one
-    rules_df = new_df.copy()
-    
-    return len(rules_df)
+    - The published snapshot
+    """
+    with _update_lock:
+        snapshot = build_rule_snapshot(new_rules)
+        if prepare is not None:
+            prepare(snapshot)
+        return publish_rule_snapshot(snapshot)
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Rules engine maintenance")
+    parser.add_argument("command", nargs="?", default="check", choices=["check", "compact"],
+                        help="check: verify operational_rule_vectorized; compact: drop duplicate rule keys")
+    parser.add_argument("--path", default=RULES_PATH, help="rules CSV to compact")
+    parser.add_argument("--output", default=None, help="compacted CSV (default: overwrite --path)")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        n_checked = check_operational_rule_vectorized()
+        print(f"operational_rule_vectorized matches operational_rule on {n_checked} combinations")
+    else:
+        table = pd.read_csv(args.path)
+        compacted, removed = compact_rules(table)
+        output = args.output or args.path
+        bytes_before = os.path.getsize(args.path)
+        compacted[columns].to_csv(output)
+        bytes_after = os.path.getsize(output)
+        print(f"Rules: {len(table)} -> {len(compacted)} ({removed} duplicate keys removed, "
+              f"{removed / max(len(table), 1):.1%})")
+        print(f"File:  {bytes_before} -> {bytes_after} bytes")
@@ -0,0 +1,376 @@
+"""
+decision_table.py - Precomputed Full-Domain Decision and Price Table
+
+`get_insurance_data` rounds BMI to 0.1, AGE is an integer and SMOKER /
+PRACTICE_SPORT are booleans, so over realistic ranges the whole input domain is
+a finite grid (about 200k cells for BMI 10-60 and AGE 0-100). This module
+tabulates, for every cell:
+
+- the operational decision and comment codes (`decide.operational_rule`),
+- the position of the best learned rule (`decide.find_best_rule`),
+- the price predicted by the price forest (`price_predictor.insurance_model`),
+- the class probabilities of the decision forest (`reasoning_agent`),
+
+and stores them as one structured NumPy array (`.npy`, loaded memory-mapped)
+plus a JSON sidecar with the grid and the fingerprints of the inputs it was
+built from. At serving time `/predict` answers with an O(1) array lookup and
+falls back to the live models for inputs outside the grid.
+
+Every part is only used while its inputs are unchanged: the learned part is
+bound to the rules snapshot it was built from, and the price /
+probability / operational parts are checked against the fingerprints of the model files and
+of the operational rule code on load. Rebuild the table after changing rules
+or models:
+
+    python decision_table.py
+
+When `/admin/update_rules` installs a new rules snapshot, `prepare_rules`
+recomputes the best-rule positions over the grid for the new version before it
+is published, so the learned part keeps being served across rule updates. The
+positions are stored in the snapshot's arrays, so with shared state
+(`shared_state`) the other workers attach them instead of recomputing them.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import decide
+from decide import operational_rule, operational_rule_vectorized, OPERATIONAL_DECISIONS, OPERATIONAL_COMMENTS
+from rule_index import get_rule_index
+from price_predictor import insurance_model
+from reasoning_agent import decision_explainer
+from startup import timed
+
+TABLE_PATH = os.getenv("DECISION_TABLE_PATH", "../../assets/decision_table.npy")
+
+RULE_COLUMNS = ['BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT', 'DECISION', 'COMMENT']
+
+N_CLASSES = 4
+
+CELL_DTYPE = np.dtype([
+    ("op_decision", np.int8),
+    ("op_comment", np.int8),
+    ("rule_pos", np.int32),
+    ("price", np.float64),
+    ("proba", np.float64, (N_CLASSES,)),
+])
+
+
+# --------------------------------------------------
+# Fingerprints of the table inputs
+# --------------------------------------------------
+def rules_fingerprint(rules_df):
+    """Content hash of the rules table (row order matters, like for the rule index)."""
+    hashes = pd.util.hash_pandas_object(rules_df[RULE_COLUMNS], index=False)
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
+
+
+def file_fingerprint(path):
+    """Content hash of a model file, or None if it does not exist."""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def operational_fingerprint():
+    """Hash of the operational rule source, so rule edits invalidate the table."""
+    return hashlib.sha256(inspect.getsource(operational_rule).encode()).hexdigest()
+
+
+def price_model_path():
+    return f"../../assets/{insurance_model.model_path}"
+
+
+# --------------------------------------------------
+# Grid
+# --------------------------------------------------
+class Grid:
+    """BMI (0.1 steps) x AGE x SMOKER x PRACTICE_SPORT grid, flattened in C order."""
+
+    def __init__(self, bmi_min=10.0, bmi_max=60.0, age_min=0, age_max=100):
+        self.bmi_lo = int(round(bmi_min * 10))
+        self.bmi_hi = int(round(bmi_max * 10))
+        self.age_min = int(age_min)
+        self.age_max = int(age_max)
+        # k / 10 is the double nearest to the decimal value, like round(x, 1)
+        self.bmi_values = np.arange(self.bmi_lo, self.bmi_hi + 1) / 10
+        self.age_values = np.arange(self.age_min, self.age_max + 1)
+        self.shape = (len(self.bmi_values), len(self.age_values), 2, 2)
+        self.size = int(np.prod(self.shape))
+
+    def to_dict(self):
+        return {
+            "bmi_min": self.bmi_lo / 10, "bmi_max": self.bmi_hi / 10,
+            "age_min": self.age_min, "age_max": self.age_max,
+        }
+
+    def cells(self):
+        """All cells as flat BMI, AGE, SMOKER, PRACTICE_SPORT arrays."""
+        return tuple(
+            grid.ravel() for grid in np.meshgrid(
+                self.bmi_values, self.age_values, [False, True], [False, True], indexing="ij"
+            )
+        )
+
+    def cell_index(self, x_input):
+        """Flat index of the cell of x_input, or None if it is not on the grid."""
+        BMI, AGE = x_input['BMI'], x_input['AGE']
+        try:
+            k = int(round(BMI * 10))
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if not (self.bmi_lo <= k <= self.bmi_hi) or self.bmi_values[k - self.bmi_lo] != BMI:
+            return None
+        try:
+            if AGE != int(AGE) or not (self.age_min <= AGE <= self.age_max):
+                return None
+        except (TypeError, ValueError, OverflowError):
+            return None
+        i = ((k - self.bmi_lo) * self.shape[1] + int(AGE) - self.age_min) * 2
+        return (i + bool(x_input['SMOKER'])) * 2 + bool(x_input['PRACTICE_SPORT'])
+
+
+# --------------------------------------------------
+# Offline build
+# --------------------------------------------------
+def build_decision_table(path=TABLE_PATH, grid=None, rules_df=None):
+    """
+    Tabulate decisions, prices and class probabilities over the grid and write
+    them to `path` (+ `.json` metadata). Models that cannot be loaded leave
+    their column empty (NaN) and are marked as missing in the metadata.
+
+    Returns:
+        The metadata dict that was written
+    """
+    grid = grid or Grid()
+    rules_df = decide.current_rules().rules_df if rules_df is None else rules_df
+    BMI, AGE, SMOKER, PRACTICE_SPORT = grid.cells()
+    table = np.zeros(grid.size, dtype=CELL_DTYPE)
+    timings = {}
+
+    start = time.perf_counter()
+    table["op_decision"], table["op_comment"] = operational_rule_vectorized(BMI, AGE, SMOKER, PRACTICE_SPORT)
+    timings["operational"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table["rule_pos"], _ = get_rule_index(rules_df).query_batch(BMI, AGE, SMOKER, PRACTICE_SPORT)
+    timings["learned"] = time.perf_counter() - start
+
+    features = pd.DataFrame({
+        "BMI": BMI, "AGE": AGE.astype(int),
+        "SMOKER": SMOKER.astype(int), "PRACTICE_SPORT": PRACTICE_SPORT.astype(int)
+    })
+
+    start = time.perf_counter()
+    price_fp = None
+    if insurance_model.is_loaded() or insurance_model.load_model():
+        table["price"] = insurance_model.rf_model.predict(features.to_numpy(dtype=np.float64))
+        price_fp = file_fingerprint(price_model_path())
+    else:
+        table["price"] = np.nan
+    timings["price"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    proba_fp, classes = None, None
+    if decision_explainer.is_loaded() or decision_explainer.load_model():
+        clf = decision_explainer.get_explainer().clf
+        table["proba"] = clf.predict_proba(features)
+        proba_fp = file_fingerprint(decision_explainer.model_path)
+        classes = [int(c) for c in clf.classes_]
+    else:
+        table["proba"] = np.nan
+    timings["proba"] = time.perf_counter() - start
+
+    # drop the old metadata first so a half-written table is never considered valid
+    if os.path.exists(path + ".json"):
+        os.remove(path + ".json")
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, table)
+    os.replace(tmp_path, path)
+
+    metadata = {
+        "grid": grid.to_dict(),
+        "n_cells": grid.size,
+        "operational_fingerprint": operational_fingerprint(),
+        "operational_decisions": OPERATIONAL_DECISIONS,
+        "operational_comments": OPERATIONAL_COMMENTS,
+        "rules_fingerprint": rules_fingerprint(rules_df),
+        "n_rules": len(rules_df),
+        "price_model_fingerprint": price_fp,
+        "decision_model_fingerprint": proba_fp,
+        "classes": classes,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "build_seconds": timings,
+    }
+    with open(path + ".json", "w") as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
+
+
+# --------------------------------------------------
+# Serving
+# --------------------------------------------------
+class DecisionTable:
+    """
+    Memory-mapped lookup table with per-part validity. `lookup` returns only
+    the parts that are still consistent with the live rules and models.
+    """
+
+    def __init__(self, path=TABLE_PATH):
+        self.path = path
+        self.grid = None
+        self.table = None
+        self.metadata = None
+        self.operational_valid = False
+        self.price_valid = False
+        self.proba_valid = False
+        # name of the best-rule positions of the cells in RuleSnapshot.arrays
+        self.positions_key = None
+
+    def load(self) -> bool:
+        """Loads the table (memory-mapped) and checks it against the live inputs"""
+        with timed("decision_table"):
+            return self._load()
+
+    def _load(self) -> bool:
+        try:
+            with open(self.path + ".json") as f:
+                metadata = json.load(f)
+            table = np.load(self.path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            print(f"Decision table not loaded: {e}")
+            self.table = None
+            return False
+
+        self.grid = Grid(**metadata["grid"])
+        if table.dtype != CELL_DTYPE or len(table) != self.grid.size:
+            print("Decision table not loaded: layout does not match, rebuild it")
+            self.table = None
+            return False
+
+        self.metadata = metadata
+        self.table = table
+        table_id = hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()[:16]
+        self.positions_key = f"decision_table_rule_pos_{table_id}"
+        self.operational_valid = (
+            metadata["operational_fingerprint"] == operational_fingerprint()
+            and metadata["operational_comments"] == OPERATIONAL_COMMENTS
+        )
+        self.price_valid = (
+            metadata["price_model_fingerprint"] is not None
+            and metadata["price_model_fingerprint"] == file_fingerprint(price_model_path())
+        )
+        self.proba_valid = (
+            metadata["decision_model_fingerprint"] is not None
+            and metadata["decision_model_fingerprint"] == file_fingerprint(decision_explainer.model_path)
+        )
+        snapshot = decide.current_rules()
+        if metadata["rules_fingerprint"] == rules_fingerprint(snapshot.rules_df):
+            snapshot.arrays.setdefault(self.positions_key, table["rule_pos"])
+        print(f"✅ Decision table loaded ({self.grid.size} cells): {self.status()}")
+        return True
+
+    def invalidate_rules(self):
+        """Stop serving learned decisions of the current rules from the table"""
+        if self.positions_key is not None:
+            decide.current_rules().arrays.pop(self.positions_key, None)
+
+    def prepare_rules(self, snapshot):
+        """
+        Compute the best-rule position of every cell for a rules snapshot that
+        is about to be published, and store them in its arrays.
+
+        Returns:
+            False if no table is loaded
+        """
+        if self.table is None:
+            return False
+        positions, _ = snapshot.index.query_batch(*self.grid.cells())
+        snapshot.arrays[self.positions_key] = positions.astype(np.int32)
+        return True
+
+    def invalidate_models(self):
+        """Stop serving prices and probabilities from the table (models changed)"""
+        self.price_valid = False
+        self.proba_valid = False
+
+    def rule_positions(self, snapshot):
+        """Best-rule positions of the cells for a rules snapshot, or None"""
+        if self.table is None:
+            return None
+        positions = snapshot.arrays.get(self.positions_key)
+        if positions is None or len(positions) != self.grid.size:
+            return None
+        return positions
+
+    def status(self):
+        return {
+            "loaded": self.table is not None,
+            "operational": self.table is not None and self.operational_valid,
+            "learned": self.table is not None and self.rule_positions(decide.current_rules()) is not None,
+            "price": self.table is not None and self.price_valid,
+            "probabilities": self.table is not None and self.proba_valid,
+        }
+
+    def lookup(self, x_input, snapshot=None):
+        """
+        Look up the precomputed results for x_input (learned decision from the
+        given rules snapshot, by default the current one).
+
+        Returns:
+            None if the table is not loaded or x_input is outside the grid,
+            otherwise a dict with the valid entries among 'decision', 'comment',
+            'operational_decision', 'operational_comment', 'predicted_price'
+            and 'probabilities'
+        """
+        table = self.table
+        if table is None:
+            return None
+        i = self.grid.cell_index(x_input)
+        if i is None:
+            return None
+        cell = table[i]
+        result = {}
+        snapshot = snapshot or decide.current_rules()
+        positions = self.rule_positions(snapshot)
+        if positions is not None:
+            best_rule = snapshot.rules_df.iloc[int(positions[i])]
+            result["decision"] = best_rule["DECISION"]
+            result["comment"] = best_rule["COMMENT"]
+        if self.operational_valid:
+            result["operational_decision"] = OPERATIONAL_DECISIONS[cell["op_decision"]]
+            result["operational_comment"] = OPERATIONAL_COMMENTS[cell["op_comment"]]
+        if self.price_valid:
+            result["predicted_price"] = cell["price"]
+        if self.proba_valid:
+            result["probabilities"] = np.array(cell["proba"])
+        return result
+
+
+# =========================
+# Global instance (singleton)
+# =========================
+decision_table = DecisionTable()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the precomputed decision/price table")
+    parser.add_argument("--path", default=TABLE_PATH)
+    parser.add_argument("--bmi-min", type=float, default=10.0)
+    parser.add_argument("--bmi-max", type=float, default=60.0)
+    parser.add_argument("--age-min", type=int, default=0)
+    parser.add_argument("--age-max", type=int, default=100)
+    args = parser.parse_args()
+
+    metadata = build_decision_table(
+        args.path, Grid(args.bmi_min, args.bmi_max, args.age_min, args.age_max)
+    )
+    print(json.dumps({k: metadata[k] for k in ("n_cells", "n_rules", "build_seconds")}, indent=2))
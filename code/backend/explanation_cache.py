@@ -0,0 +1,247 @@
+"""
+explanation_cache.py - Persistent Cache for GPT Underwriting Explanations
+
+The GPT explanation of a decision only depends on what goes into the prompt:
+the decision, its confidence, the applicant profile and the SHAP ranking. These
+repeat constantly in real traffic, so this module caches explanations under a
+hash of those inputs, normalized to the precision at which they appear in the
+prompt, and lets repeated profiles skip the chat-completion round trip.
+
+Two tiers:
+- an in-memory LRU (fast path, per process),
+- an SQLite file (survives restarts, shared by processes on the same host),
+
+both with a time-to-live and a size limit. Hit/miss counters are available via
+`stats()`. Async code uses `get_async` / `put_behind`, which keep the SQLite
+reads and writes (and evictions) off the event loop thread.
+
+Configuration (environment variables):
+- `EXPLANATION_CACHE_PATH`: SQLite file (default: ../../assets/explanation_cache.sqlite3)
+- `EXPLANATION_CACHE_TTL`: entry lifetime in seconds (default: 30 days)
+- `EXPLANATION_CACHE_MAX_ENTRIES`: max entries on disk (default: 100000)
+- `EXPLANATION_CACHE_MEMORY_ENTRIES`: max entries in memory (default: 2048)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Evict expired / excess disk entries every N writes instead of on every write,
+# so the disk store may briefly exceed max_entries by up to N entries
+_DISK_EVICTION_INTERVAL = 256
+
+
+def make_key(model, result):
+    """
+    Normalized hash of the prompt inputs of an explainer result.
+
+    Values are rounded the way the prompt renders them, so results that would
+    produce the same prompt share the same key.
+    """
+    input_vals = result["input_values"]
+    payload = {
+        "model": model,
+        "decision": result["decision"],
+        "confidence": f"{result['probability']:.1%}",
+        "BMI": f"{input_vals['BMI']:.1f}",
+        "AGE": int(input_vals["AGE"]),
+        "SMOKER": bool(input_vals["SMOKER"]),
+        "PRACTICE_SPORT": bool(input_vals["PRACTICE_SPORT"]),
+        "shap": [[feat, f"{val:+.4f}"] for feat, val in result["top_features"]],
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ExplanationCache:
+    """
+    Two-tier (memory LRU + SQLite) cache of explanation strings with TTL and
+    size-based eviction. Safe to use from several threads.
+
+    The memory tier and the SQLite file have separate locks, so memory lookups
+    never wait for disk I/O. On the event loop, use `get_async` / `put_behind`:
+    they answer from memory inline and do the SQLite read / write-back in a
+    thread.
+    """
+
+    def __init__(self, path, ttl_seconds=30 * 24 * 3600, max_entries=100_000,
+                 max_memory_entries=2048):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        # _lock: memory tier and counters; _disk_lock: the SQLite connection
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0,
+                         "memory_evictions": 0, "disk_evictions": 0}
+
+    def _connection(self):
+        # called with _disk_lock held
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS explanations ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON explanations (accessed_at)")
+                conn.commit()
+                self._conn = conn
+            except sqlite3.Error as e:
+                # Keep serving from memory only
+                print(f"Explanation cache: disk store unavailable ({e})")
+                self._conn = False
+        return self._conn or None
+
+    def get(self, key):
+        """Returns the cached explanation for key, or None"""
+        value = self._get_memory(key)
+        if value is None:
+            value = self._get_disk(key)
+        return value
+
+    async def get_async(self, key):
+        """`get` for the event loop: the memory tier inline, the SQLite read in a thread"""
+        value = self._get_memory(key)
+        if value is None:
+            value = await asyncio.get_running_loop().run_in_executor(None, self._get_disk, key)
+        return value
+
+    def _get_memory(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+        return None
+
+    def _get_disk(self, key):
+        now = time.time()
+        row = None
+        with self._disk_lock:
+            conn = self._connection()
+            if conn is not None:
+                try:
+                    row = conn.execute(
+                        "SELECT value, created_at FROM explanations WHERE key = ? AND created_at >= ?",
+                        (key, now - self.ttl_seconds)
+                    ).fetchone()
+                    if row is not None:
+                        conn.execute("UPDATE explanations SET accessed_at = ? WHERE key = ?", (now, key))
+                        conn.commit()
+                except sqlite3.Error as e:
+                    print(f"Explanation cache: read failed ({e})")
+        with self._lock:
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            self._remember(key, row[0], row[1])
+            self.counters["disk_hits"] += 1
+            return row[0]
+
+    def put(self, key, value):
+        """Stores an explanation in both tiers"""
+        now = self._put_memory(key, value)
+        self._put_disk(key, value, now)
+
+    def put_behind(self, key, value):
+        """
+        `put` for the event loop: stores in memory now and writes the SQLite
+        entry from a thread (write-behind, not awaited).
+        """
+        now = self._put_memory(key, value)
+        asyncio.get_running_loop().run_in_executor(None, self._put_disk, key, value, now)
+
+    def _put_memory(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self.counters["writes"] += 1
+        return now
+
+    def _put_disk(self, key, value, now):
+        with self._disk_lock:
+            conn = self._connection()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO explanations (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._writes += 1
+                if self._writes % _DISK_EVICTION_INTERVAL == 0:
+                    self._evict_disk(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Explanation cache: write failed ({e})")
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.counters["memory_evictions"] += 1
+
+    def _evict_disk(self, conn, now):
+        expired = conn.execute(
+            "DELETE FROM explanations WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        excess = conn.execute(
+            "DELETE FROM explanations WHERE key IN ("
+            "SELECT key FROM explanations ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        ).rowcount
+        with self._lock:
+            self.counters["disk_evictions"] += max(expired, 0) + max(excess, 0)
+
+    def clear(self):
+        """Drops every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        with self._disk_lock:
+            conn = self._connection()
+            if conn is not None:
+                conn.execute("DELETE FROM explanations")
+                conn.commit()
+
+    def stats(self):
+        """Hit/miss counters, hit rate and sizes of both tiers"""
+        with self._lock:
+            counters = dict(self.counters)
+            counters["memory_entries"] = len(self._memory)
+        with self._disk_lock:
+            conn = self._connection()
+            counters["disk_entries"] = (
+                conn.execute("SELECT COUNT(*) FROM explanations").fetchone()[0] if conn is not None else 0
+            )
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        counters["hit_rate"] = (counters["memory_hits"] + counters["disk_hits"]) / lookups if lookups else 0.0
+        return counters
+
+
+# =========================
+# Global instance (singleton)
+# =========================
+explanation_cache = ExplanationCache(
+    path=os.getenv("EXPLANATION_CACHE_PATH", "../../assets/explanation_cache.sqlite3"),
+    ttl_seconds=float(os.getenv("EXPLANATION_CACHE_TTL", 30 * 24 * 3600)),
+    max_entries=int(os.getenv("EXPLANATION_CACHE_MAX_ENTRIES", 100_000)),
+    max_memory_entries=int(os.getenv("EXPLANATION_CACHE_MEMORY_ENTRIES", 2048)),
+)
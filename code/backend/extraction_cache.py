@@ -0,0 +1,143 @@
+"""
+extraction_cache.py - Deduplication of Form Image Extractions
+
+Brokers often upload the same scanned form several times, and every upload
+used to pay a full GPT-4o vision call. This module caches the validated
+`FormData` extracted from an image under the SHA-256 of the uploaded bytes, and
+coalesces concurrent uploads of the same image into a single in-flight
+extraction whose result all callers share.
+
+Optionally, the form data is also stored under a perceptual hash of the
+normalized image (a 1024-bit difference hash, see `get_perceptual`), which
+catches the same scan re-encoded or resized by another tool. Only exact perceptual-hash matches are reused, and
+the option is off by default: forms filled on the same template look alike, so
+enable it only when uploads are known to be re-sends.
+
+Configuration (environment variables):
+- `EXTRACTION_CACHE_MAX_ENTRIES`: max cached extractions (default: 512)
+- `EXTRACTION_CACHE_TTL`: entry lifetime in seconds (default: 24 hours)
+- `EXTRACTION_CACHE_PERCEPTUAL`: "1" to also match on the perceptual hash (default: "0")
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(image_bytes: bytes) -> str:
+    """Cache key of an upload: hash of its exact bytes"""
+    return "sha256:" + hashlib.sha256(image_bytes).hexdigest()
+
+
+class ExtractionCache:
+    """
+    LRU + TTL cache of extraction results with coalescing of concurrent
+    extractions of the same key.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=24 * 3600, perceptual=False):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.perceptual = perceptual
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.counters = {"hits": 0, "perceptual_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def get(self, key):
+        """Returns the cached value for key, or None"""
+        with self._lock:
+            return self._lookup(key)
+
+    def get_perceptual(self, key):
+        """
+        Returns the form data cached under a perceptual hash, or None. Only
+        the form data is shared between uploads: the preprocessing stats
+        belong to each upload.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.counters["perceptual_hits"] += 1
+            return value
+
+    def _lookup(self, key):
+        # called with _lock held
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, created_at = entry
+        if time.time() - created_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    async def get_or_extract(self, key, extract):
+        """
+        Return the cached result for key, or run `extract()` (a coroutine
+        function) once for all concurrent callers asking for the same key.
+
+        The extraction runs in its own task, so a caller that disconnects does
+        not cancel it for the others. Failed extractions are not cached.
+
+        Returns:
+            (value, source) where source is "cache", "coalesced" or "extraction"
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.counters["hits"] += 1
+                return value, "cache"
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._count("coalesced")
+            return await asyncio.shield(task), "coalesced"
+
+        self._count("misses")
+        task = asyncio.ensure_future(self._run(key, extract))
+        self._in_flight[key] = task
+        return await asyncio.shield(task), "extraction"
+
+    async def _run(self, key, extract):
+        try:
+            value = await extract()
+            self.put(key, value)
+            return value
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            counters["entries"] = len(self._entries)
+        counters["in_flight"] = len(self._in_flight)
+        lookups = counters["hits"] + counters["coalesced"] + counters["misses"]
+        counters["hit_rate"] = (counters["hits"] + counters["coalesced"]) / lookups if lookups else 0.0
+        return counters
+
+
+# =========================
+# Global instance (singleton)
+# =========================
+extraction_cache = ExtractionCache(
+    max_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", 512)),
+    ttl_seconds=float(os.getenv("EXTRACTION_CACHE_TTL", 24 * 3600)),
+    perceptual=os.getenv("EXTRACTION_CACHE_PERCEPTUAL", "0") == "1",
+)
@@ -0,0 +1,266 @@
+"""
+forest_eval.py - Flat-Array Random Forest Evaluator
+
+For the one-row inputs of `/predict`, sklearn's `predict` / `predict_proba`
+spend most of their time in input validation and per-tree dispatch rather than
+in the tree traversal itself. `FlatForest` copies the nodes of all trees of a
+fitted `RandomForestClassifier` / `RandomForestRegressor` into contiguous NumPy
+arrays and walks all trees at once, one tree level per step.
+
+The outputs are bit-identical to sklearn's:
+- inputs are cast to float32 like sklearn does, then compared with the float64
+  thresholds (NaN follows `missing_go_to_left`),
+- classifier leaves are normalized like `DecisionTreeClassifier.predict_proba`,
+- per-tree outputs are summed in estimator order starting from zero, then
+  divided by the number of trees, like `ForestClassifier.predict_proba` /
+  `ForestRegressor.predict`.
+
+Key Components:
+- `FlatForest.from_sklearn`: Flattens a fitted forest (raises TypeError for
+  other models, callers then keep the sklearn path).
+- `predict_proba` / `predict`: Same results as the sklearn methods, for one
+  row or for batches (processed in blocks of rows to bound memory). Large
+  batches are faster in sklearn itself (see `FLAT_MAX_ROWS`).
+- `save` / `load`: The node arrays as `.npy` files, loadable memory-mapped so
+  several processes share one copy (`shared_state`).
+
+Micro-benchmark and equality check against sklearn:
+    python forest_eval.py
+"""
+
+import json
+import os
+import numpy as np
+
+# Rows per traversal block (the traversal holds rows x trees node indices)
+BLOCK_ROWS = 1024
+
+# Node arrays written by `save`
+ARRAY_NAMES = ("left", "right", "feature", "threshold", "missing_left", "value", "roots")
+
+# Above this many rows sklearn's compiled traversal is faster than FlatForest,
+# callers should use the sklearn model for larger batches
+FLAT_MAX_ROWS = 128
+
+
+class FlatForest:
+    """All trees of a fitted random forest as flat node arrays."""
+
+    def __init__(self, left, right, feature, threshold, missing_left, value, roots, max_depth,
+                 classes=None):
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.classes_ = classes
+        self.n_trees = len(roots)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """
+        Flatten a fitted RandomForestClassifier / RandomForestRegressor (or any
+        single-output forest of sklearn decision trees).
+
+        Raises:
+            TypeError: If the model is not a supported forest
+        """
+        estimators = getattr(model, "estimators_", None)
+        if not estimators or not all(hasattr(e, "tree_") for e in estimators):
+            raise TypeError(f"Not a fitted tree forest: {type(model).__name__}")
+        if getattr(model, "n_outputs_", 1) != 1:
+            raise TypeError("Multi-output forests are not supported")
+
+        is_classifier = hasattr(model, "classes_")
+        lefts, rights, features, thresholds, missing, values, roots = [], [], [], [], [], [], []
+        offset, max_depth = 0, 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            n = tree.node_count
+            nodes = np.arange(offset, offset + n)
+            leaf = tree.children_left == -1
+            # leaves point to themselves and always "go left"
+            lefts.append(np.where(leaf, nodes, tree.children_left + offset))
+            rights.append(np.where(leaf, nodes, tree.children_right + offset))
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(np.where(leaf, np.inf, tree.threshold))
+            missing_left = getattr(tree, "missing_go_to_left", None)
+            missing.append(np.zeros(n, dtype=bool) if missing_left is None else missing_left.astype(bool))
+            if is_classifier:
+                # as DecisionTreeClassifier.predict_proba
+                proba = tree.value[:, 0, :estimator.n_classes_]
+                normalizer = proba.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                values.append(proba / normalizer)
+            else:
+                values.append(tree.value[:, 0, :1])
+            roots.append(offset)
+            offset += n
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            missing_left=np.concatenate(missing),
+            value=np.ascontiguousarray(np.concatenate(values), dtype=np.float64),
+            roots=np.array(roots, dtype=np.intp),
+            max_depth=max_depth,
+            classes=np.asarray(model.classes_) if is_classifier else None,
+        )
+
+    # --------------------------------------------------
+    # Persistence
+    # --------------------------------------------------
+    def save(self, directory):
+        """Write the node arrays as .npy files plus a meta.json into directory (created)."""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        if self.classes_ is not None:
+            if self.classes_.dtype == object:
+                raise TypeError("Only numeric class labels can be saved")
+            np.save(os.path.join(directory, "classes.npy"), self.classes_)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"max_depth": int(self.max_depth), "classifier": self.classes_ is not None}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """Load a forest written by `save`, memory-mapped (read-only) by default."""
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ARRAY_NAMES
+        }
+        classes = np.load(os.path.join(directory, "classes.npy")) if meta["classifier"] else None
+        return cls(max_depth=meta["max_depth"], classes=classes, **arrays)
+
+    # --------------------------------------------------
+    # Traversal
+    # --------------------------------------------------
+    def apply(self, X):
+        """Leaf node (flat index) of every row in every tree, shape (n_rows, n_trees)."""
+        # same input precision as sklearn trees, compared in float64
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        has_nan = bool(np.isnan(X).any())
+        row_offsets = (np.arange(len(X)) * X.shape[1])[:, np.newaxis]
+        X = X.ravel()
+        node = np.broadcast_to(self.roots, (len(row_offsets), self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            x = X.take(row_offsets + self.feature.take(node))
+            go_left = x <= self.threshold.take(node)
+            if has_nan:
+                go_left |= np.isnan(x) & self.missing_left.take(node)
+            node = np.where(go_left, self.left.take(node), self.right.take(node))
+        return node
+
+    def _mean_leaf_value(self, X):
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        out = np.empty((len(X), self.value.shape[1]))
+        for start in range(0, len(X), BLOCK_ROWS):
+            leaves = self.apply(X[start:start + BLOCK_ROWS])
+            # (trees, rows, outputs): reduced tree by tree, in estimator order
+            per_tree = self.value[leaves.T]
+            total = np.zeros(per_tree.shape[1:])
+            for tree_values in per_tree:
+                total += tree_values
+            out[start:start + BLOCK_ROWS] = total
+        out /= self.n_trees
+        return out
+
+    def predict_proba(self, X):
+        """Class probabilities, same as the classifier's `predict_proba`."""
+        if self.classes_ is None:
+            raise TypeError("predict_proba needs a classifier forest")
+        return self._mean_leaf_value(X)
+
+    def predict(self, X):
+        """Same as the forest's `predict` (class labels or regression values)."""
+        values = self._mean_leaf_value(X)
+        if self.classes_ is not None:
+            return self.classes_.take(np.argmax(values, axis=1), axis=0)
+        return values[:, 0]
+
+
+def flatten_or_none(model, name="model", path=None):
+    """
+    `FlatForest.from_sklearn`, or None (with a message) if the model is not
+    supported. If the workers share their state and the model file path is
+    given, the arrays are memory-mapped from the shared directory instead.
+    """
+    import shared_state
+
+    try:
+        if path is not None and shared_state.enabled():
+            try:
+                return shared_state.shared_flat_forest(model, path)
+            except OSError as e:
+                print(f"Shared flat arrays not available for {name}, using a private copy: {e}")
+        return FlatForest.from_sklearn(model)
+    except TypeError as e:
+        print(f"Flat evaluator not available for {name}, using sklearn: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import warnings
+    import joblib
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Check and benchmark FlatForest against sklearn")
+    parser.add_argument("models", nargs="*", default=[
+        "../../assets/predictor_decision.joblib", "../../assets/insurance_model.joblib"
+    ])
+    parser.add_argument("--rows", type=int, default=20_000, help="rows for the equality check")
+    parser.add_argument("--repeat", type=int, default=200, help="single-row calls to time")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    rng = np.random.default_rng(0)
+    X = np.column_stack([
+        np.round(rng.uniform(10, 60, args.rows), 1), rng.integers(0, 101, args.rows),
+        rng.integers(0, 2, args.rows), rng.integers(0, 2, args.rows)
+    ]).astype(np.float64)
+    columns = ["BMI", "AGE", "SMOKER", "PRACTICE_SPORT"]
+
+    def timed(fn, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return (time.perf_counter() - start) / repeat
+
+    for path in args.models:
+        try:
+            model = joblib.load(path)
+        except OSError as e:
+            print(f"{path}: skipped ({e})")
+            continue
+        flat = FlatForest.from_sklearn(model)
+        # the decision classifier is fitted on a DataFrame, the price model on arrays
+        as_input = (lambda a: pd.DataFrame(a, columns=columns)) if hasattr(model, "feature_names_in_") else (lambda a: a)
+        method = "predict_proba" if flat.classes_ is not None else "predict"
+        expected = getattr(model, method)(as_input(X))
+        actual = getattr(flat, method)(X)
+        print(f"{path}: {flat.n_trees} trees, {len(flat.left)} nodes, max depth {flat.max_depth}")
+        print(f"  {method} identical to sklearn on {args.rows} rows: {np.array_equal(expected, actual)}")
+
+        one = X[:1]
+        sk_one = timed(lambda: getattr(model, method)(as_input(one)), args.repeat)
+        flat_one = timed(lambda: getattr(flat, method)(one), args.repeat)
+        print(f"  1 row:     sklearn {sk_one * 1e3:8.3f} ms   flat {flat_one * 1e3:8.3f} ms   x{sk_one / flat_one:.1f}")
+        for n in (64, 4096):
+            batch = X[:n]
+            sk = timed(lambda: getattr(model, method)(as_input(batch)), 5)
+            fl = timed(lambda: getattr(flat, method)(batch), 5)
+            print(f"  {n:4d} rows: sklearn {sk * 1e3:8.3f} ms   flat {fl * 1e3:8.3f} ms   x{sk / fl:.1f}")
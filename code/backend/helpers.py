@@ -9,13 +9,17 @@ Key Functions:
 1. `sample_population`: Creates a statistically realistic, synthetic population 
    sample based on Swiss demographic data, including age, sex, and health metrics
    (BMI, Smoker status, Sport activity). This is crucial for training and testing 
-   risk models.
+   risk models. `iter_population` yields the same population block by block.
 2. `get_insurance_data`: Transforms raw input (often from a form) into the
    standardized feature dictionary required by the downstream prediction models.
+   `get_insurance_data_batch` does the same for many forms at once, as arrays.
 3. `extract_form_fields_from_image`: Uses the OpenAI Vision API (GPT-4o) and 
    Pydantic schemas to parse and extract structured data fields (like height, 
    weight, and DOB) directly from an uploaded image file, enabling an OCR-like 
-   workflow.
+   workflow. `extract_form_fields_from_image_async` is the non-blocking variant 
+   used by the API (timeout and concurrency cap from `llm_limits`). The OpenAI
+   clients are created on first use (`get_client`, `get_async_client`), so
+   importing this module does not import the OpenAI SDK.
 """
 
 import numpy as np
@@ -24,103 +28,94 @@ import numpy as np
 from schemas import FormData
 from dotenv import load_dotenv
 import base64
-from openai import OpenAI
+from llm_limits import call_llm, LLM_TIMEOUT_SECONDS, LLM_EXTRACTION_RETRIES
+import metrics
+import time
 
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI()
+# OpenAI clients, created on first use
+_client = None
+_async_client = None
 
 
-def sample_population(n_samples=10_000, seed=42):
-    """
-    Generate a realistic Swiss population sample (all ages) 
-    based on menuCH data and Swiss demographics.
+def get_client():
+    """Shared synchronous OpenAI client"""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI()
+    return _client
 
-    Returns:
-        DataFrame with columns:
-        ['AGE', 'SEX', 'HEIGHT_CM', 'WEIGHT_KG', 'BMI', 'SMOKER', 'PRACTICE_SPORT']
-    """
-    np.random.seed(seed)
 
-    # -------------------------------------------------------------------------
-    # 1. Swiss population age distribution (source: Swiss Federal Statistics)
-    # -------------------------------------------------------------------------
-    # Total adds up to 1.0
-    age_groups = {
-        '0-19': 0.20,
-        '20-64': 0.60,
-        '65-79': 0.14,
-        '80+': 0.06
-    }
-
-    # Sex ratio roughly 50/50
-    sex_categories = ['Male', 'Female']
-    sex_probs = [0.5, 0.5]
+def get_async_client():
+    """Shared asynchronous OpenAI client"""
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI()
+    return _async_client
+
+
+def __getattr__(name):
+    # `client` / `async_client` module attributes, as before
+    if name == "client":
+        return get_client()
+    if name == "async_client":
+        return get_async_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
+# Rows per block of the synthetic population (see iter_population)
+POPULATION_CHUNK_SIZE = 1_000_000
+
+# Swiss population age distribution (source: Swiss Federal Statistics),
+# as [low, high) age bounds and probabilities. Total adds up to 1.0
+AGE_GROUPS = {
+    '0-19': (0, 20, 0.20),
+    '20-64': (20, 65, 0.60),
+    '65-79': (65, 80, 0.14),
+    '80+': (80, 95, 0.06),
+}
+
+
+def _sample_block(rng, n_samples, start=0):
+    """One block of `n_samples` people drawn from the Generator `rng`."""
     # -------------------------------------------------------------------------
-    # 2. Sample age (continuous within each group)
+    # 1. Sample age (uniform integer within each group)
     # -------------------------------------------------------------------------
-    ages = []
-    for _ in range(n_samples):
-        group = np.random.choice(list(age_groups.keys()), p=list(age_groups.values()))
-        if group == '0-19':
-            ages.append(np.random.randint(0, 20))
-        elif group == '20-64':
-            ages.append(np.random.randint(20, 65))
-        elif group == '65-79':
-            ages.append(np.random.randint(65, 80))
-        else:
-            ages.append(np.random.randint(80, 95))
-    ages = np.array(ages)
+    bounds = np.array([(low, high) for low, high, _ in AGE_GROUPS.values()])
+    group = rng.choice(len(AGE_GROUPS), size=n_samples, p=[p for _, _, p in AGE_GROUPS.values()])
+    ages = rng.integers(bounds[group, 0], bounds[group, 1])
 
     # -------------------------------------------------------------------------
-    # 3. Assign sex
+    # 2. Assign sex (roughly 50/50)
     # -------------------------------------------------------------------------
-    sexes = np.random.choice(sex_categories, size=n_samples, p=sex_probs)
+    sexes = rng.choice(np.array(['Male', 'Female'], dtype=object), size=n_samples, p=[0.5, 0.5])
+    male = sexes == 'Male'
 
     # -------------------------------------------------------------------------
-    # 4. Anthropometrics
+    # 3. Anthropometrics: mean/sd of height and BMI per age band and sex
     # -------------------------------------------------------------------------
-    height = np.zeros(n_samples)
-    weight = np.zeros(n_samples)
-    bmi = np.zeros(n_samples)
-
-    for i, sex in enumerate(sexes):
-        age = ages[i]
-
-        # Children & adolescents
-        if age < 20:
-            if sex == 'Male':
-                height[i] = np.random.normal(165 if age > 15 else 150, 10)
-                bmi[i] = np.random.normal(20 if age > 15 else 18, 2.5)
-            else:
-                height[i] = np.random.normal(160 if age > 15 else 145, 10)
-                bmi[i] = np.random.normal(19 if age > 15 else 17.5, 2.5)
-
-        # Adults
-        elif age < 65:
-            if sex == 'Male':
-                bmi_mean = 25.0 if age < 50 else 25.9
-                bmi_sd = 3.8
-                height[i] = np.random.normal(178, 7.5)
-            else:
-                bmi_mean = 23.8 if age < 50 else 24.5
-                bmi_sd = 4.0
-                height[i] = np.random.normal(165, 6.5)
-            bmi[i] = np.random.normal(bmi_mean, bmi_sd)
-
-        # Seniors (65+)
-        else:
-            if sex == 'Male':
-                bmi[i] = np.random.normal(26.0, 3.5)
-                height[i] = np.random.normal(173, 7.0)
-            else:
-                bmi[i] = np.random.normal(25.0, 3.8)
-                height[i] = np.random.normal(160, 6.0)
-
-        # Compute weight
-        weight[i] = bmi[i] * (height[i] / 100) ** 2
+    child = ages < 20
+    teen = ages > 15
+    adult = (ages >= 20) & (ages < 65)
+    over_50 = ages >= 50
+
+    conditions = [child & male, child & ~male, adult & male, adult & ~male, male]
+    height_mean = np.select(conditions, [
+        np.where(teen, 165, 150), np.where(teen, 160, 145), 178, 165, 173
+    ], default=160)
+    height_sd = np.select(conditions, [10, 10, 7.5, 6.5, 7.0], default=6.0)
+    bmi_mean = np.select(conditions, [
+        np.where(teen, 20, 18), np.where(teen, 19, 17.5),
+        np.where(over_50, 25.9, 25.0), np.where(over_50, 24.5, 23.8), 26.0
+    ], default=25.0)
+    bmi_sd = np.select(conditions, [2.5, 2.5, 3.8, 4.0, 3.5], default=3.8)
+
+    height = rng.normal(height_mean, height_sd)
+    bmi = rng.normal(bmi_mean, bmi_sd)
+    weight = bmi * (height / 100) ** 2
 
     # Sanity checks (clip)
     height = np.clip(height, 50, 202)
@@ -128,37 +123,23 @@ def sample_population(n_samples=10_000, seed=42):
     bmi = np.round(weight / (height / 100) ** 2, 1)
 
     # -------------------------------------------------------------------------
-    # 5. Lifestyle & behavior (only for adults)
+    # 4. Lifestyle & behavior (no smoking under 16)
     # -------------------------------------------------------------------------
-    smoker = np.zeros(n_samples, dtype=bool)
-    practice_sport = np.zeros(n_samples, dtype=bool)
-
-    for i, age in enumerate(ages):
-        if age < 16:
-            smoker[i] = False
-            practice_sport[i] = np.random.rand() < 0.65  # active kids
-        else:
-            # Smoking: ~25% overall, slightly higher in men
-            smoker[i] = np.random.rand() < (0.27 if sexes[i] == 'Male' else 0.22)
-
-            # Physical activity: decreases with age
-            if age < 35:
-                p_sport = 0.65
-            elif age < 65:
-                p_sport = 0.55
-            elif age < 80:
-                p_sport = 0.45
-            else:
-                p_sport = 0.30
-            practice_sport[i] = np.random.rand() < p_sport
-    # ------------------- NEW: Remove sport for obese adults -------------------
-    for i in range(n_samples):
-        if (sexes[i] == 'Female' and weight[i] > 90) or (sexes[i] == 'Male' and weight[i] > 100):
-            practice_sport[i] = False
+    # Smoking: ~25% overall, slightly higher in men
+    p_smoke = np.where(ages < 16, 0.0, np.where(male, 0.27, 0.22))
+    smoker = rng.random(n_samples) < p_smoke
+
+    # Physical activity: active kids, then decreases with age
+    p_sport = np.select([ages < 35, ages < 65, ages < 80], [0.65, 0.55, 0.45], default=0.30)
+    practice_sport = rng.random(n_samples) < p_sport
+
+    # Remove sport for obese adults
+    practice_sport &= ~((~male & (weight > 90)) | (male & (weight > 100)))
+
     # -------------------------------------------------------------------------
-    # 6. Assemble DataFrame
+    # 5. Assemble DataFrame
     # -------------------------------------------------------------------------
-    df = pd.DataFrame({
+    return pd.DataFrame({
         'AGE': ages,
         'SEX': sexes,
         'HEIGHT_CM': np.round(height, 1),
@@ -166,65 +147,187 @@ def sample_population(n_samples=10_000, seed=42):
         'BMI': bmi,
         'SMOKER': smoker,
         'PRACTICE_SPORT': practice_sport
-    })
+    }, index=pd.RangeIndex(start, start + n_samples))
 
-    return df
+
+def iter_population(n_samples, seed=42, chunk_size=POPULATION_CHUNK_SIZE):
+    """
+    Stream a synthetic population as DataFrames of `chunk_size` rows (the last
+    one may be shorter), indexed by global row number. Only one block is held
+    in memory at a time, so `n_samples` can exceed RAM.
+
+    With the same seed and chunk_size, the concatenated blocks are exactly
+    `sample_population(n_samples, seed, chunk_size)`.
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_samples, chunk_size):
+        yield _sample_block(rng, min(chunk_size, n_samples - start), start)
+
+
+def sample_population(n_samples=10_000, seed=42, chunk_size=POPULATION_CHUNK_SIZE):
+    """
+    Generate a realistic Swiss population sample (all ages) 
+    based on menuCH data and Swiss demographics.
+
+    Draws are vectorized on a `numpy.random.Generator` (the distributions are
+    the ones of the former per-person loop, but the random stream differs, so
+    a given seed yields a different sample than before).
+
+    Returns:
+        DataFrame with columns:
+        ['AGE', 'SEX', 'HEIGHT_CM', 'WEIGHT_KG', 'BMI', 'SMOKER', 'PRACTICE_SPORT']
+    """
+    blocks = list(iter_population(n_samples, seed, chunk_size))
+    if not blocks:
+        return _sample_block(np.random.default_rng(seed), 0)
+    return blocks[0] if len(blocks) == 1 else pd.concat(blocks)
 
 def get_insurance_data(form_data: FormData):
     """
     Transforms raw user data from a FormData object into a structured dictionary
     of features required for insurance risk assessment or pricing models.
     """
-    height_m = form_data.height_cm / 100
-    BMI = round(form_data.weight_kg / (height_m ** 2), 1)
-    birth_year = int(form_data.date_of_birth.split(".")[-1])
+    with metrics.timed("get_insurance_data"):
+        height_m = form_data.height_cm / 100
+        BMI = round(form_data.weight_kg / (height_m ** 2), 1)
+        birth_year = int(form_data.date_of_birth.split(".")[-1])
+        current_year = 2025
+        AGE = current_year - birth_year
+        return {
+            'BMI': BMI,
+            'AGE': AGE,
+            'SMOKER': form_data.smokes,
+            'PRACTICE_SPORT': len(form_data.sports) > 0,
+            'PRICE_INSURANCE': form_data.insurance_price
+        }
+
+def get_insurance_data_batch(forms):
+    """
+    Vectorized `get_insurance_data` for a list of FormData objects.
+
+    Records that cannot be transformed (missing fields, malformed date of
+    birth, non-positive height) are reported instead of raising, so one bad
+    record does not fail the whole batch.
+
+    Returns:
+        (insurance_df, errors) where insurance_df has the columns
+        ['BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT', 'PRICE_INSURANCE'] indexed by
+        the position of the record in `forms`, and errors maps the position of
+        each rejected record to a message.
+    """
+    start = time.perf_counter()
+    n = len(forms)
+    errors = {}
+
+    def as_float(value):
+        return np.nan if value is None else value
+
+    height = np.array([as_float(f.height_cm) for f in forms], dtype=np.float64)
+    weight = np.array([as_float(f.weight_kg) for f in forms], dtype=np.float64)
+    price = np.array([as_float(f.insurance_price) for f in forms], dtype=np.float64)
+    smoker = np.array([f.smokes for f in forms], dtype=bool)
+    sport = np.array([len(f.sports) > 0 if f.sports is not None else False for f in forms], dtype=bool)
+
+    birth_year = np.zeros(n, dtype=np.int64)
+    for i, f in enumerate(forms):
+        try:
+            birth_year[i] = int(f.date_of_birth.split(".")[-1])
+        except (AttributeError, ValueError):
+            errors[i] = "date_of_birth must be given as DD.MM.YYYY"
+
+    checks = [
+        (np.isnan(height) | (height <= 0), "height_cm must be a positive number"),
+        (np.isnan(weight), "weight_kg is required"),
+        (np.isnan(price), "insurance_price is required"),
+        (np.array([f.sports is None for f in forms], dtype=bool), "sports is required"),
+    ]
+    for mask, message in checks:
+        for i in np.flatnonzero(mask):
+            errors.setdefault(int(i), message)
+
+    valid = np.ones(n, dtype=bool)
+    valid[list(errors)] = False
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        height_m = height[valid] / 100
+        raw_bmi = weight[valid] / (height_m ** 2)
     current_year = 2025
-    AGE = current_year - birth_year
-    return {
+    # Python's round() to stay identical to get_insurance_data
+    BMI = np.array([round(b, 1) for b in raw_bmi.tolist()], dtype=np.float64)
+
+    insurance_df = pd.DataFrame({
         'BMI': BMI,
-        'AGE': AGE,
-        'SMOKER': form_data.smokes,
-        'PRACTICE_SPORT': len(form_data.sports) > 0,
-        'PRICE_INSURANCE': form_data.insurance_price
-    }
+        'AGE': current_year - birth_year[valid],
+        'SMOKER': smoker[valid],
+        'PRACTICE_SPORT': sport[valid],
+        'PRICE_INSURANCE': price[valid]
+    }, index=np.flatnonzero(valid))
+
+    metrics.observe("get_insurance_data_batch", time.perf_counter() - start)
+    return insurance_df, errors
+
+def _extraction_input(image_bytes: bytes, mime_type: str = "image/jpeg") -> list:
+    """Builds the vision request (system prompt + image) for form extraction"""
+    # Encode the image
+    base64_image = base64.b64encode(image_bytes).decode('utf-8')
+    
+    return [
+        {
+            "role": "system",
+            "content": "You are a medical form extraction assistant. Extract health-related information from the form. For height and weight, convert to centimeters and kilograms if given in other units. If smoking status is 'No' or unchecked, set cigarettes_per_day to None."
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "input_text",
+                    "text": "Please extract all the form fields from this image."
+                },
+                {
+                    "type": "input_image",
+                    "image_url": f"data:{mime_type};base64,{base64_image}"
+                }
+            ]
+        }
+    ]
 
-def extract_form_fields_from_image(image_bytes: bytes) -> FormData:
+def extract_form_fields_from_image(image_bytes: bytes, mime_type: str = "image/jpeg") -> FormData:
     """
     Extract form fields from an image using OpenAI's structured outputs
     
     Args:
         image_bytes: Image file bytes
+        mime_type: MIME type of image_bytes
         
     Returns:
         FormData object with extracted fields
     """
-    # Encode the image
-    base64_image = base64.b64encode(image_bytes).decode('utf-8')
-    
     # Make API call with structured output
-    response = client.responses.parse(
-        model="gpt-4o",  # Vision-capable model
-        input=[
-            {
-                "role": "system",
-                "content": "You are a medical form extraction assistant. Extract health-related information from the form. For height and weight, convert to centimeters and kilograms if given in other units. If smoking status is 'No' or unchecked, set cigarettes_per_day to None."
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "input_text",
-                        "text": "Please extract all the form fields from this image."
-                    },
-                    {
-                        "type": "input_image",
-                        "image_url": f"data:image/jpeg;base64,{base64_image}"
-                    }
-                ]
-            }
-        ],
-        text_format=FormData
-    )
+    with metrics.timed("image_extraction"):
+        response = get_client().responses.parse(
+            model="gpt-4o",  # Vision-capable model
+            input=_extraction_input(image_bytes, mime_type),
+            text_format=FormData,
+            timeout=LLM_TIMEOUT_SECONDS
+        )
     
     # Return parsed structured data
+    return response.output_parsed
+
+async def extract_form_fields_from_image_async(image_bytes: bytes, mime_type: str = "image/jpeg") -> FormData:
+    """
+    Async `extract_form_fields_from_image`: awaits the vision call without
+    blocking the event loop, under the LLM concurrency cap and timeout, and
+    retries transient failures (`LLM_EXTRACTION_RETRIES`).
+    
+    Raises:
+        asyncio.TimeoutError: If the extraction does not finish in time
+    """
+    with metrics.timed("image_extraction"):
+        response = await call_llm(lambda: get_async_client().responses.parse(
+            model="gpt-4o",  # Vision-capable model
+            input=_extraction_input(image_bytes, mime_type),
+            text_format=FormData
+        ), retries=LLM_EXTRACTION_RETRIES)
+    
     return response.output_parsed
\ No newline at end of file
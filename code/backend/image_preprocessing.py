@@ -0,0 +1,142 @@
+"""
+image_preprocessing.py - Image Preparation Before Vision Extraction
+
+Uploaded forms are often multi-megabyte phone photos or PNG scans. Sending them
+as-is inflates upload time, request payload and vision token cost, so `/process`
+first runs them through a local pipeline:
+
+1. EXIF orientation fix (phone photos are often stored rotated),
+2. downscaling so the longest side is at most `IMAGE_MAX_SIDE` pixels,
+3. grayscale conversion and contrast normalization (forms carry no colour
+   information the extraction needs),
+4. re-encoding as JPEG, with the MIME type of the bytes actually sent.
+
+If re-encoding does not make an image smaller and nothing else had to change,
+the original bytes are kept (with their real MIME type). The work runs in a
+thread pool (Pillow releases the GIL while decoding, resizing and encoding),
+so the event loop stays free. Before/after sizes are returned with every image
+and accumulated in `stats`. On request, a perceptual hash of the normalized
+image is computed in the same pass (used by `extraction_cache`).
+
+Configuration (environment variables):
+- `IMAGE_MAX_SIDE`: max width/height in pixels (default: 2048)
+- `IMAGE_GRAYSCALE`: "0" keeps colour (default: "1")
+- `IMAGE_JPEG_QUALITY`: JPEG quality of the re-encoded image (default: 85)
+- `IMAGE_PREPROCESS_WORKERS`: size of the preprocessing thread pool (default: 4)
+"""
+
+import asyncio
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", 2048))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "1") != "0"
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 85))
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", 4))
+
+# Formats the vision API accepts as-is, with their MIME types
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
+# Side of the difference hash grid (PERCEPTUAL_HASH_SIZE ** 2 bits)
+PERCEPTUAL_HASH_SIZE = 32
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_PREPROCESS_WORKERS, thread_name_prefix="image-preprocess")
+
+_stats_lock = threading.Lock()
+stats = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def perceptual_hash(image) -> str:
+    """
+    Difference hash of a normalized (grayscale) image: one bit per horizontally
+    adjacent pixel pair of a downsampled copy, as a hex string.
+    """
+    size = PERCEPTUAL_HASH_SIZE
+    pixels = list(image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR).getdata())
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"dhash:{bits:0{size * size // 4}x}"
+
+
+def preprocess_image(image_bytes: bytes, with_hash: bool = False):
+    """
+    Prepare an uploaded image for the vision model.
+
+    Args:
+        image_bytes: Raw upload
+        with_hash: Also compute the perceptual hash of the normalized image
+
+    Returns:
+        (data, mime_type, info): the bytes to send, their MIME type and a dict
+        with before/after byte sizes and pixel dimensions
+
+    Raises:
+        ValueError: If the bytes are not a readable image
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError(f"Unsupported or corrupt image: {e}") from e
+
+    source_format = image.format
+    original_size = image.size
+
+    # 1. Orientation (exif_transpose always returns a copy, so check the tag)
+    changed = image.getexif().get(0x0112, 1) != 1
+    image = ImageOps.exif_transpose(image)
+
+    # 2. Downscale
+    if max(image.size) > IMAGE_MAX_SIDE:
+        image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.Resampling.LANCZOS)
+        changed = True
+
+    # 3. Colour / contrast (flatten transparency on white first)
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    image = image.convert("L" if IMAGE_GRAYSCALE else "RGB")
+    image = ImageOps.autocontrast(image, cutoff=1)
+
+    # 4. Re-encode
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    data, mime_type = buffer.getvalue(), "image/jpeg"
+
+    final_size = image.size
+    if not changed and len(data) >= len(image_bytes) and source_format in MIME_TYPES:
+        data, mime_type, final_size = image_bytes, MIME_TYPES[source_format], original_size
+
+    info = {
+        "source_format": source_format,
+        "mime_type": mime_type,
+        "bytes_before": len(image_bytes),
+        "bytes_after": len(data),
+        "size_before": list(original_size),
+        "size_after": list(final_size),
+    }
+    if with_hash:
+        info["perceptual_hash"] = perceptual_hash(image)
+    with _stats_lock:
+        stats["images"] += 1
+        stats["bytes_in"] += len(image_bytes)
+        stats["bytes_out"] += len(data)
+    return data, mime_type, info
+
+
+async def preprocess_image_async(image_bytes: bytes, with_hash: bool = False):
+    """Runs `preprocess_image` on the preprocessing pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, preprocess_image, image_bytes, with_hash)
@@ -0,0 +1,104 @@
+"""
+llm_limits.py - Timeouts and Concurrency Cap for LLM Calls
+
+Every async OpenAI call of the backend (form extraction, decision explanation)
+goes through `call_llm`, which:
+- limits the number of LLM calls in flight per worker (the event loop itself
+  is never blocked, requests beyond the cap wait for a free slot),
+- applies a per-call timeout to the API round trip (time spent waiting for a
+  slot is not counted),
+- keeps a count of the calls currently in flight,
+- optionally retries transient failures (timeouts, connection errors, rate
+  limits, server errors) with exponential backoff and jitter; the slot is
+  released while waiting.
+
+Configuration (environment variables):
+- `LLM_MAX_CONCURRENCY`: max LLM calls in flight per worker (default: 16)
+- `LLM_TIMEOUT_SECONDS`: timeout of one LLM call in seconds (default: 30)
+- `LLM_EXTRACTION_RETRIES`: retries of a failed form extraction call (default: 2)
+- `LLM_RETRY_BACKOFF_SECONDS`: delay before the first retry, doubled for each
+  further retry (default: 0.5)
+- `EXTRACTION_MAX_CONCURRENCY`: max extractions in flight for one multi-image
+  `/process_batch` request (default: 8)
+- `PREDICT_LATENCY_BUDGET_MS`: default latency budget of a `/predict` request
+  in milliseconds, after which it answers with the local template explanation
+  instead of waiting for GPT; requests can set their own with the
+  `X-Latency-Budget-Ms` header (default: 0, no budget)
+"""
+
+import asyncio
+import os
+import random
+import weakref
+from contextlib import asynccontextmanager
+import metrics
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 30))
+LLM_EXTRACTION_RETRIES = int(os.getenv("LLM_EXTRACTION_RETRIES", 2))
+LLM_RETRY_BACKOFF_SECONDS = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", 0.5))
+EXTRACTION_MAX_CONCURRENCY = int(os.getenv("EXTRACTION_MAX_CONCURRENCY", 8))
+PREDICT_LATENCY_BUDGET_MS = float(os.getenv("PREDICT_LATENCY_BUDGET_MS", 0))
+
+# One semaphore per event loop (asyncio primitives are bound to their loop)
+_semaphores = weakref.WeakKeyDictionary()
+
+in_flight = 0
+
+
+def _semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return semaphore
+
+
+@asynccontextmanager
+async def llm_slot():
+    """Holds one of the LLM_MAX_CONCURRENCY slots for the duration of the block"""
+    global in_flight
+    async with _semaphore():
+        in_flight += 1
+        try:
+            yield
+        finally:
+            in_flight -= 1
+
+
+def is_transient(error):
+    """Whether a failed LLM call is worth retrying (timeout, connection, rate limit, server error)"""
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    return isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+
+async def call_llm(make_call, timeout=None, retries=0, backoff=LLM_RETRY_BACKOFF_SECONDS):
+    """
+    Run one LLM call under the concurrency cap and timeout.
+
+    Args:
+        make_call: zero-argument function returning the awaitable API call
+                   (created only once a slot is free, again for each retry)
+        timeout: seconds per attempt, defaults to LLM_TIMEOUT_SECONDS
+        retries: attempts after a transient failure (`is_transient`)
+        backoff: delay before the first retry, doubled for each further one
+
+    Raises:
+        asyncio.TimeoutError: if the (last) attempt does not finish in time
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with llm_slot():
+                return await asyncio.wait_for(make_call(), LLM_TIMEOUT_SECONDS if timeout is None else timeout)
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            print(f"LLM call failed ({e!r}), retry {attempt + 1}/{retries}")
+        metrics.count("llm_retry")
+        # jitter spreads the retries of calls that failed together
+        await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.0))
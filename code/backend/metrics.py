@@ -0,0 +1,226 @@
+"""
+metrics.py - Stage Latency Histograms and Prometheus Text Exposition
+
+The backend used to report what it was doing only through `print`. This
+module records the latency of every pipeline stage in a fixed-bucket
+histogram and renders them, together with counters and gauges read at scrape
+time (rule table size, cache hit rates, LLM calls in flight, ...), in the
+Prometheus text format served by `/metrics`.
+
+Recording is meant to stay on in production: `timed(stage)` costs two
+`perf_counter` calls, a bisect over the bucket bounds and a few increments
+under a lock (a couple of microseconds, against milliseconds for the stages
+it measures), and there is no dependency on `prometheus_client`.
+
+Stages (label `stage` of `insurance_stage_seconds`):
+- `image_preprocessing`, `image_extraction` (vision call, retries included)
+- `get_insurance_data`
+- `find_best_rule` (learned-rule lookup), `operational_rule`
+- `price_forest`, `decision_forest` (forest predict / predict_proba)
+- `shap`, `gpt_call`
+- `price_calculation` (price adjustment, forest included)
+
+Whole-batch calls (`/predict_batch`, `/predict_bulk`) are one observation per
+batch, recorded under their own `*_batch` stages (`get_insurance_data_batch`,
+`find_best_rule_batch`, `price_calculation_batch`, `price_forest_batch`,
+`decision_forest_batch`, `shap_batch`), so the stages above only hold
+per-request latencies.
+
+Metrics are per process: with several uvicorn workers each worker exposes its
+own, and with `PREDICT_EXECUTOR=process` the forest and SHAP stages run (and
+are recorded) in the pool processes, so they are missing from `/metrics`.
+
+Configuration (environment variables):
+- `METRICS_ENABLED`: "0" to turn recording off (default: "1")
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Upper bounds (seconds) of the latency buckets, from 100 µs to 30 s
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+PREFIX = "insurance_"
+
+
+class Histogram:
+    """Latency histogram per label value, with fixed bucket bounds."""
+
+    def __init__(self, name, help, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label value -> [count per bucket (last one is +Inf), sum]
+        self._series = {}
+
+    def observe(self, label_value, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def snapshot(self):
+        """label value -> (cumulative bucket counts, sum, count)"""
+        with self._lock:
+            series = {k: (list(counts), total) for k, (counts, total) in self._series.items()}
+        out = {}
+        for label_value, (counts, total) in series.items():
+            cumulative, running = [], 0
+            for c in counts:
+                running += c
+                cumulative.append(running)
+            out[label_value] = (cumulative, total, running)
+        return out
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        bounds = [_format(b) for b in self.buckets] + ["+Inf"]
+        for label_value, (cumulative, total, count) in sorted(self.snapshot().items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            for bound, c in zip(bounds, cumulative):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {c}')
+            lines.append(f"{self.name}_sum{{{label}}} {_format(total)}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter per label value."""
+
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(values.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {_format(value)}')
+        return lines
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# --------------------------------------------------
+# Process-wide metrics
+# --------------------------------------------------
+stage_seconds = Histogram(
+    PREFIX + "stage_seconds", "Latency of the pipeline stages in seconds.", "stage"
+)
+request_seconds = Histogram(
+    PREFIX + "request_seconds", "Duration of the API requests in seconds (until the body is sent), by route.", "route"
+)
+events = Counter(
+    PREFIX + "events_total", "Pipeline events (explanation sources, extraction outcomes, LLM retries).", "event"
+)
+
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stage_seconds.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+def timed(stage):
+    """Context manager recording the duration of its block (exceptions included) under stage"""
+    return _Timer(stage) if METRICS_ENABLED else _NO_TIMER
+
+
+def observe(stage, seconds):
+    """Record one duration of stage"""
+    if METRICS_ENABLED:
+        stage_seconds.observe(stage, seconds)
+
+
+def count(event, amount=1):
+    """Count an event (e.g. "explanation_source_template")"""
+    if METRICS_ENABLED:
+        events.inc(event, amount)
+
+
+def render(collected=()):
+    """
+    All metrics in the Prometheus text format.
+
+    Args:
+        collected: values read at scrape time, as (name, type, help, value) or
+                   (name, type, help, {label_value: value}, label) with type
+                   "gauge" or "counter"; None values are skipped
+    """
+    lines = stage_seconds.render() + request_seconds.render() + events.render()
+    for metric in collected:
+        name, kind, help, value = PREFIX + metric[0], metric[1], metric[2], metric[3]
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        if isinstance(value, dict):
+            for label_value, v in sorted(value.items()):
+                if v is not None:
+                    lines.append(f'{name}{{{metric[4]}="{_escape(label_value)}"}} {_format(v)}')
+        elif value is not None:
+            lines.append(f"{name} {_format(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    """ASGI middleware recording the duration of every HTTP request by route (`request_seconds`)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            request_seconds.observe(getattr(route, "path", "unmatched"), time.perf_counter() - start)
@@ -0,0 +1,299 @@
+"""
+portfolio_simulator.py - Parallel Portfolio Simulation
+
+Runs the full underwriting pipeline over a large synthetic portfolio drawn with
+`helpers.sample_population`, for capacity and pricing studies:
+
+1. operational decision (`decide.operational_rule_vectorized`),
+2. learned decision (nearest rule of the current rules snapshot),
+3. predicted price (`price_predictor.insurance_model`),
+4. decision class probabilities (`reasoning_agent` classifier).
+
+The population is split into shards that are processed by a process pool.
+Every shard is generated inside its worker from its own seed
+(`SeedSequence.spawn`), so tasks only carry a few integers and the results do
+not depend on the number of workers. The model artifacts and the rule index
+are loaded once in the parent before the pool starts: with the `fork` start
+method workers inherit them copy-on-write instead of unpickling them per task
+(with `spawn` each worker loads them once, in its initializer).
+
+Each worker writes its shard to its own file in the output directory
+(`part-00000.parquet`, ...; readable as one dataset with `pd.read_parquet(dir)`
+or `pyarrow.dataset`) and returns only aggregates, which are combined into
+throughput, acceptance and surcharge statistics.
+
+Usage:
+    python portfolio_simulator.py --n-samples 10000000 --workers 8 --output ../../assets/simulation
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import decide
+from decide import operational_rule_vectorized, OPERATIONAL_DECISIONS, OPERATIONAL_COMMENTS
+from helpers import sample_population
+from price_predictor import insurance_model
+from reasoning_agent import decision_explainer
+
+SHARD_SIZE = 500_000
+
+SURCHARGE_DECISION = "accepted with extra charge"
+
+OUTPUT_FORMATS = ("parquet", "csv", None)
+
+
+# --------------------------------------------------
+# Worker side
+# --------------------------------------------------
+def load_artifacts() -> bool:
+    """Loads the price model and decision classifier if not loaded yet"""
+    price_ok = insurance_model.is_loaded() or insurance_model.load_model()
+    proba_ok = decision_explainer.is_loaded() or decision_explainer.load_model()
+    return price_ok and proba_ok
+
+
+def simulate_block(population):
+    """
+    Run the pipeline on a DataFrame of applicants (as from `sample_population`).
+
+    Returns:
+        (results DataFrame, stage timings in seconds)
+    """
+    BMI = population['BMI'].to_numpy(dtype=np.float64)
+    AGE = population['AGE'].to_numpy()
+    SMOKER = population['SMOKER'].to_numpy(dtype=bool)
+    PRACTICE_SPORT = population['PRACTICE_SPORT'].to_numpy(dtype=bool)
+    timings = {}
+    results = population[['AGE', 'SEX', 'BMI', 'SMOKER', 'PRACTICE_SPORT']].copy()
+
+    start = time.perf_counter()
+    op_decision, op_comment = operational_rule_vectorized(BMI, AGE, SMOKER, PRACTICE_SPORT)
+    results['OPERATIONAL_DECISION'] = pd.Categorical.from_codes(op_decision, OPERATIONAL_DECISIONS)
+    results['OPERATIONAL_COMMENT'] = pd.Categorical.from_codes(op_comment, OPERATIONAL_COMMENTS)
+    timings["operational"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    snapshot = decide.current_rules()
+    positions, _ = snapshot.index.query_batch(BMI, AGE, SMOKER, PRACTICE_SPORT)
+    results['DECISION'] = pd.Categorical(snapshot.rules_df['DECISION'].to_numpy()[positions])
+    results['RULE_POSITION'] = positions.astype(np.int32)
+    timings["learned"] = time.perf_counter() - start
+
+    features = pd.DataFrame({
+        "BMI": BMI, "AGE": AGE.astype(int),
+        "SMOKER": SMOKER.astype(int), "PRACTICE_SPORT": PRACTICE_SPORT.astype(int)
+    })
+
+    start = time.perf_counter()
+    results['PREDICTED_PRICE'] = insurance_model.rf_model.predict(features.to_numpy(dtype=np.float64))
+    # same fields and definitions as the API's PredictionOutput
+    results['ADJUSTMENT_PERCENTAGE'], results['ADJUSTMENT_EURO'] = insurance_model.adjustment_arrays(
+        results['PREDICTED_PRICE'].to_numpy(), insurance_model.base_price
+    )
+    timings["price"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    explainer = decision_explainer.get_explainer()
+    proba = explainer.clf.predict_proba(features)
+    for j, name in enumerate(explainer.le.inverse_transform(explainer.clf.classes_)):
+        results['P_' + name.upper().replace(' ', '_')] = proba[:, j]
+    timings["proba"] = time.perf_counter() - start
+
+    return results, timings
+
+
+def summarize_block(results):
+    """Additive aggregates of a results block (combined with `combine_summaries`)"""
+    price = results['PREDICTED_PRICE'].to_numpy()
+    surcharged = (results['DECISION'] == SURCHARGE_DECISION).to_numpy()
+    return {
+        "n": len(results),
+        "decisions": {k: int(v) for k, v in results['DECISION'].value_counts().items()},
+        "operational_decisions": {k: int(v) for k, v in results['OPERATIONAL_DECISION'].value_counts().items()},
+        "agreement": int((results['DECISION'].astype(str) == results['OPERATIONAL_DECISION'].astype(str)).sum()),
+        "price_sum": float(price.sum()),
+        "price_sq_sum": float(np.square(price).sum()),
+        "price_min": float(price.min()) if len(price) else None,
+        "price_max": float(price.max()) if len(price) else None,
+        "adjustment_sum": float(results['ADJUSTMENT_PERCENTAGE'].sum()),
+        "surcharge_adjustment_sum": float(results['ADJUSTMENT_PERCENTAGE'].to_numpy()[surcharged].sum()),
+    }
+
+
+def _init_worker():
+    # no-op for forked workers, which inherit the parent's loaded artifacts
+    if not load_artifacts():
+        raise RuntimeError("Could not load the model artifacts")
+
+
+def _write_block(results, output_dir, shard, output_format):
+    if output_format is None:
+        return None
+    path = os.path.join(output_dir, f"part-{shard:05d}.{output_format}")
+    tmp_path = path + ".tmp"
+    if output_format == "parquet":
+        results.to_parquet(tmp_path, index=True)
+    else:
+        results.to_csv(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def run_shard(shard, start, n_samples, seed_seq, output_dir, output_format):
+    """Generate, simulate and write one shard. Returns its summary."""
+    t0 = time.perf_counter()
+    population = sample_population(n_samples, seed=seed_seq, chunk_size=max(n_samples, 1))
+    population.index = pd.RangeIndex(start, start + n_samples)
+    timings = {"sampling": time.perf_counter() - t0}
+
+    results, stage_timings = simulate_block(population)
+    timings.update(stage_timings)
+
+    t0 = time.perf_counter()
+    path = _write_block(results, output_dir, shard, output_format)
+    timings["write"] = time.perf_counter() - t0
+
+    summary = summarize_block(results)
+    summary.update({"shard": shard, "path": path, "timings": timings, "pid": os.getpid()})
+    return summary
+
+
+# --------------------------------------------------
+# Driver
+# --------------------------------------------------
+def combine_summaries(summaries, base_price=None):
+    """Aggregate statistics of a whole run from the shard summaries"""
+    n = sum(s["n"] for s in summaries)
+    decisions, operational, timings = {}, {}, {}
+    for s in summaries:
+        for k, v in s["decisions"].items():
+            decisions[k] = decisions.get(k, 0) + v
+        for k, v in s["operational_decisions"].items():
+            operational[k] = operational.get(k, 0) + v
+        for k, v in s["timings"].items():
+            timings[k] = timings.get(k, 0.0) + v
+
+    price_mean = sum(s["price_sum"] for s in summaries) / n if n else None
+    price_var = sum(s["price_sq_sum"] for s in summaries) / n - price_mean ** 2 if n else None
+    n_surcharged = decisions.get(SURCHARGE_DECISION, 0)
+    mins = [s["price_min"] for s in summaries if s["price_min"] is not None]
+    maxs = [s["price_max"] for s in summaries if s["price_max"] is not None]
+    return {
+        "n_samples": n,
+        "decision_rates": {k: v / n for k, v in sorted(decisions.items())} if n else {},
+        "operational_decision_rates": {k: v / n for k, v in sorted(operational.items())} if n else {},
+        "acceptance_rate": (decisions.get("accepted", 0) + n_surcharged) / n if n else None,
+        "surcharge_rate": n_surcharged / n if n else None,
+        "rules_agreement_rate": sum(s["agreement"] for s in summaries) / n if n else None,
+        "price": {
+            "base_price": base_price,
+            "mean": price_mean,
+            "std": float(np.sqrt(max(price_var, 0.0))) if n else None,
+            "min": min(mins) if mins else None,
+            "max": max(maxs) if maxs else None,
+            "mean_adjustment_percentage": sum(s["adjustment_sum"] for s in summaries) / n if n else None,
+            "mean_surcharge_adjustment_percentage": (
+                sum(s["surcharge_adjustment_sum"] for s in summaries) / n_surcharged if n_surcharged else None
+            ),
+        },
+        "worker_seconds": timings,
+    }
+
+
+def simulate_portfolio(n_samples, seed=42, workers=None, shard_size=SHARD_SIZE,
+                       output_dir="../../assets/simulation", output_format="parquet"):
+    """
+    Simulate the pipeline over `n_samples` synthetic applicants.
+
+    Args:
+        n_samples: portfolio size
+        seed: seed of the population (same seed and shard_size, same portfolio)
+        workers: process count (default: CPU count); 0 runs in this process
+        shard_size: applicants per task / output file
+        output_dir: directory of the part files
+        output_format: "parquet", "csv" or None (statistics only)
+
+    Returns:
+        Dict with the run statistics (also written to `output_dir/summary.json`)
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}")
+    if output_format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow (conda install pyarrow), or use output_format='csv'") from e
+    if not load_artifacts():
+        raise RuntimeError("Could not load the model artifacts")
+    if output_format is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    workers = os.cpu_count() if workers is None else workers
+    n_shards = -(-n_samples // shard_size)
+    seeds = np.random.SeedSequence(seed).spawn(n_shards)
+    tasks = [
+        (shard, shard * shard_size, min(shard_size, n_samples - shard * shard_size), seeds[shard],
+         output_dir, output_format)
+        for shard in range(n_shards)
+    ]
+
+    start = time.perf_counter()
+    summaries = []
+
+    def progress(summary):
+        summaries.append(summary)
+        done = sum(s["n"] for s in summaries)
+        print(f"Shard {summary['shard']} done ({done}/{n_samples}, "
+              f"{done / (time.perf_counter() - start):,.0f} applicants/s)")
+
+    if workers == 0 or n_shards <= 1:
+        for task in tasks:
+            progress(run_shard(*task))
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, n_shards), mp_context=context,
+                                 initializer=_init_worker) as pool:
+            futures = [pool.submit(run_shard, *task) for task in tasks]
+            for future in as_completed(futures):
+                progress(future.result())
+
+    elapsed = time.perf_counter() - start
+    summaries.sort(key=lambda s: s["shard"])
+    stats = combine_summaries(summaries, base_price=float(insurance_model.base_price))
+    stats.update({
+        "seed": seed,
+        "workers": workers,
+        "n_shards": n_shards,
+        "rules_version": decide.current_rules().version,
+        "elapsed_seconds": elapsed,
+        "throughput_per_second": n_samples / elapsed if elapsed > 0 else None,
+        "files": [s["path"] for s in summaries if s["path"] is not None],
+    })
+    if output_format is not None:
+        with open(os.path.join(output_dir, "summary.json"), "w") as f:
+            json.dump(stats, f, indent=2)
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate the underwriting pipeline over a synthetic portfolio")
+    parser.add_argument("--n-samples", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--output", default="../../assets/simulation")
+    parser.add_argument("--format", default="parquet", choices=["parquet", "csv", "none"])
+    args = parser.parse_args()
+
+    stats = simulate_portfolio(
+        args.n_samples, seed=args.seed, workers=args.workers, shard_size=args.shard_size,
+        output_dir=args.output, output_format=None if args.format == "none" else args.format
+    )
+    print(json.dumps({k: v for k, v in stats.items() if k != "files"}, indent=2))
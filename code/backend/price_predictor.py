@@ -11,15 +11,25 @@ relative to a provided base price.
 
 Key Components:
 - `InsuranceModel`: Handles loading the Random Forest model and a base price 
-  constant using `joblib`.
+  constant using `joblib` (memory-mapped if `MODEL_MMAP` is set). The model is
+  loaded on first use if the startup did not load it (lazy startup mode).
 - `calculate_price_adjustment`: The core method for predicting the final premium 
   and computing the adjustment metrics.
+- `calculate_price_adjustment_batch`: Same for a whole DataFrame of customers, 
+  with a single model call.
+- `adjustment_arrays`: The adjustment metrics for arrays of predicted prices
+  (e.g. the portfolio simulation), with the API's definitions.
+- `price_adjustment`, `price_adjustment_batch`: Module-level entry points on the
+  singleton, for the API's CPU executor (`cpu_executor`, also in a process pool).
 """
 
 from schemas import PredictionOutput
+from forest_eval import flatten_or_none, FLAT_MAX_ROWS
+from startup import load_joblib, timed
+import metrics
 from typing import Optional
+import threading
 import numpy as np
-import joblib
 
 # =========================
 # Class to manage the model
@@ -30,24 +40,38 @@ class InsuranceModel:
         self.model_path = model_path
         self.base_price_path = base_price_path
         self.rf_model: Optional[object] = None
+        # flat-array copy of rf_model for single rows / small batches
+        self.flat_model: Optional[object] = None
         self.base_price: Optional[float] = None
+        self._load_lock = threading.Lock()
         
     def load_model(self) -> bool:
         """Loads the model and base price"""
         try:
-            self.rf_model = joblib.load(f"../../assets/{self.model_path}")
-            self.base_price = joblib.load(f"../../assets/{self.base_price_path}")
+            with timed("price_model"):
+                path = f"../../assets/{self.model_path}"
+                self.rf_model = load_joblib(path)
+                self.base_price = load_joblib(f"../../assets/{self.base_price_path}")
+                self.flat_model = flatten_or_none(self.rf_model, self.model_path, path)
             print("✅ Model loaded successfully")
             return True
         except Exception as e:
             print(f"❌ Error loading model: {e}")
             self.rf_model = None
+            self.flat_model = None
             self.base_price = None
             return False
     
     def is_loaded(self) -> bool:
         """Checks if the model is loaded"""
         return self.rf_model is not None and self.base_price is not None
+
+    def ensure_loaded(self) -> bool:
+        """Loads the model on first use if it is not loaded yet (lazy startup)"""
+        if self.is_loaded():
+            return True
+        with self._load_lock:
+            return self.is_loaded() or self.load_model()
     
     def calculate_price_adjustment(self, data) -> PredictionOutput:
         """
@@ -62,17 +86,56 @@ class InsuranceModel:
         Raises:
             ValueError: If the model is not loaded
         """
-        if not self.is_loaded():
+        if not self.ensure_loaded():
             raise ValueError("Model not loaded. Run load_model() first.")
         
         # Prepare data for prediction
         input_data = np.array([[data["BMI"], data["AGE"], data["SMOKER"], data["PRACTICE_SPORT"]]])
         base_price = data["PRICE_INSURANCE"]
         
-        # Prediction
-        predicted_price = self.rf_model.predict(input_data)[0]
+        # Prediction (same result as rf_model.predict, without sklearn's per-call overhead)
+        predicted_price = self._predict(input_data)[0]
+
+        return self.build_prediction_output(predicted_price, base_price)
 
+    def calculate_price_adjustment_batch(self, data) -> list:
+        """
+        Vectorized `calculate_price_adjustment` for many customers.
+        
+        Args:
+            data: DataFrame with columns BMI, AGE, SMOKER, PRACTICE_SPORT, PRICE_INSURANCE
         
+        Returns:
+            List of PredictionOutput, aligned with the rows of data
+            
+        Raises:
+            ValueError: If the model is not loaded
+        """
+        if not self.ensure_loaded():
+            raise ValueError("Model not loaded. Run load_model() first.")
+        if len(data) == 0:
+            return []
+
+        with metrics.timed("price_calculation_batch"):
+            input_data = data[["BMI", "AGE", "SMOKER", "PRACTICE_SPORT"]].to_numpy(dtype=np.float64)
+            predicted_prices = self._predict(input_data, stage="price_forest_batch")
+            base_prices = data["PRICE_INSURANCE"].to_numpy(dtype=np.float64)
+
+            return [
+                self.build_prediction_output(predicted_price, base_price)
+                for predicted_price, base_price in zip(predicted_prices, base_prices)
+            ]
+
+    def _predict(self, input_data, stage="price_forest"):
+        """rf_model.predict, on the flat-array evaluator for small inputs (timed as stage)"""
+        with metrics.timed(stage):
+            if self.flat_model is not None and len(input_data) <= FLAT_MAX_ROWS:
+                return self.flat_model.predict(input_data)
+            return self.rf_model.predict(input_data)
+
+    @staticmethod
+    def build_prediction_output(predicted_price, base_price) -> PredictionOutput:
+        """Computes the adjustment metrics for one predicted price (e.g. from a lookup table)"""
         # Calculate adjustment
         difference = predicted_price - base_price
 
@@ -88,7 +151,38 @@ class InsuranceModel:
             adjustment_euro=round(difference, 2)
         )
 
+    @staticmethod
+    def adjustment_arrays(predicted_prices, base_prices):
+        """
+        Vectorized adjustment metrics of `build_prediction_output` (same
+        rounding): (adjustment_percentage, adjustment_euro) arrays, with the
+        percentage 0 below the base price.
+        """
+        difference = np.asarray(predicted_prices, dtype=np.float64) - base_prices
+        percentage = np.where(difference >= 0, difference / base_prices * 100, 0.0)
+        return np.round(percentage, 2), np.round(difference, 2)
+
 # =========================
 # Global instance (singleton)
 # =========================
-insurance_model = InsuranceModel()
\ No newline at end of file
+insurance_model = InsuranceModel()
+
+
+def price_adjustment(data, predicted_price=None) -> PredictionOutput:
+    """
+    Price adjustment of one customer with the `insurance_model` singleton.
+    
+    Args:
+        data: Customer data (age, bmi, smoker, sport, base price)
+        predicted_price: Price already predicted for data (e.g. from the
+                         precomputed decision table), used if the model is loaded
+    """
+    with metrics.timed("price_calculation"):
+        if predicted_price is not None and insurance_model.is_loaded():
+            return insurance_model.build_prediction_output(predicted_price, data["PRICE_INSURANCE"])
+        return insurance_model.calculate_price_adjustment(data)
+
+
+def price_adjustment_batch(data) -> list:
+    """`calculate_price_adjustment_batch` on the `insurance_model` singleton (for the CPU executor)"""
+    return insurance_model.calculate_price_adjustment_batch(data)
@@ -8,19 +8,58 @@ to generate natural language explanations for the predicted decision.
 
 Key Features:
 - Loads a trained model and encoder (joblib files).
-- Calculates prediction, probability, and SHAP contributions.
-- Uses SHAP values to prompt GPT-4 for human-readable underwriting explanations.
+- Calculates prediction, probability, and SHAP contributions, for one applicant 
+  or for a whole batch in a single forest/SHAP pass.
+- Uses SHAP values to prompt GPT-4 for human-readable underwriting explanations, 
+  cached by prompt inputs (`explanation_cache`) so repeated profiles skip the call.
+  Async variants (`*_async`) await the OpenAI call under the timeout and 
+  concurrency cap of `llm_limits`, for use from the API's event loop; the
+  forest and SHAP part then runs on the CPU executor (`cpu_executor`).
+- Deadline-aware explanations (`explain_within_deadline`): if GPT cannot answer
+  before the request's deadline (or fails), a deterministic explanation is
+  built locally from the SHAP ranking and the operational rule comment
+  (`template_explanation`); the GPT call keeps running in the background and
+  fills the explanation cache for the next request.
+- SHAP values of the predicted class are cached per quantized input
+  (`shap_cache`), computed for that class only, and optionally pre-warmed from
+  the synthetic traffic distribution after loading.
+- `decision_explainer`: Process-wide holder of a warm explainer, loaded once at
+  startup (like `price_predictor.insurance_model`) and swapped atomically on reload.
+- SHAP and the OpenAI SDK are imported when an explainer is created (and the
+  OpenAI clients on first GPT call), not when this module is imported.
 """
 
-import joblib
+import asyncio
+import copy
+import threading
+import time
 import pandas as pd
 import numpy as np
-import shap
-from openai import OpenAI
 from dotenv import load_dotenv
+from explanation_cache import explanation_cache, make_key
+from forest_eval import flatten_or_none, FLAT_MAX_ROWS
+from shap_cache import ShapCache, shap_key, SHAP_CACHE_WARMUP_SAMPLES, SHAP_CACHE_WARMUP_KEYS
+from llm_limits import call_llm, llm_slot, LLM_TIMEOUT_SECONDS
+from decide import operational_rule
+from startup import load_joblib, timed
+import metrics
+from cpu_executor import run_cpu
+import shared_state
 
 load_dotenv()
 
+FEATURES = ["BMI", "AGE", "SMOKER", "PRACTICE_SPORT"]
+
+# Rows per SHAP call during the cache warm-up, so requests interleave with it
+WARMUP_CHUNK_SIZE = 256
+
+# Rows per SHAP call of a batch: the SHAP extension holds the GIL for a whole
+# call, so a batch scored in a thread would otherwise stall the event loop
+BATCH_SHAP_CHUNK_SIZE = 32
+
+# GPT calls that outlived their request's deadline (kept referenced until done)
+_background_calls = set()
+
 class InsuranceDecisionExplainer:
     """
     Explains insurance decisions using Random Forest predictions and SHAP values.
@@ -37,13 +76,39 @@ class InsuranceDecisionExplainer:
             encoder_path: Path to the saved LabelEncoder
             openai_api_key: OpenAI API key (or set via OPENAI_API_KEY env var)
         """
-        self.clf = joblib.load(model_path)
-        self.le = joblib.load(encoder_path)
+        import shap
+
+        self.clf = load_joblib(model_path)
+        # flat-array copy of clf for single rows / small batches
+        self.flat_clf = flatten_or_none(self.clf, model_path, model_path)
+        self.le = load_joblib(encoder_path)
         self.explainer = shap.TreeExplainer(self.clf)
-        self.client = OpenAI(api_key=openai_api_key) if openai_api_key else OpenAI()
+        self.class_explainers = self._single_class_explainers()
+        self.shap_cache = ShapCache()
+        self._openai_api_key = openai_api_key
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        """OpenAI client, created on first use"""
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self._openai_api_key) if self._openai_api_key else OpenAI()
+        return self._client
+
+    @property
+    def async_client(self):
+        """Async OpenAI client, created on first use"""
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = (
+                AsyncOpenAI(api_key=self._openai_api_key) if self._openai_api_key else AsyncOpenAI()
+            )
+        return self._async_client
         
     def predict_with_explanation(self, BMI, AGE, SMOKER, PRACTICE_SPORT, 
-                                 use_gpt=True, gpt_model="gpt-4"):
+                                 use_gpt=True, gpt_model="gpt-4", pred_proba=None):
         """
         Predict insurance decision and generate explanation using SHAP + GPT.
         
@@ -54,6 +119,8 @@ class InsuranceDecisionExplainer:
             PRACTICE_SPORT: Whether person practices sports (bool or int: 0/1)
             use_gpt: Whether to generate GPT explanation (default: True)
             gpt_model: Which GPT model to use (default: "gpt-4")
+            pred_proba: Class probabilities if already known (e.g. from the
+                        precomputed decision table), skips the forest call
             
         Returns:
             dict with keys:
@@ -73,17 +140,189 @@ class InsuranceDecisionExplainer:
         })
         
         # Get prediction
-        pred_proba = self.clf.predict_proba(test_sample)[0]
-        pred_label = self.clf.predict(test_sample)[0]
+        if pred_proba is None:
+            pred_proba = self._predict_proba(test_sample)[0]
+        # same as clf.predict(): class with the highest probability
+        pred_label = self.clf.classes_.take(np.argmax(pred_proba))
         pred_decision = self.le.inverse_transform([pred_label])[0]
         
-        # Compute SHAP values
-        shap_values = self.explainer.shap_values(test_sample)
-        
-        # Extract SHAP values for predicted class
+        # SHAP values of the predicted class (cached per quantized input)
         pred_class_idx = int(pred_label)
-        sv = shap_values[0, :, pred_class_idx]
+        key = shap_key(BMI, AGE, SMOKER, PRACTICE_SPORT, pred_class_idx)
+        sv = self.shap_cache.get(key)
+        if sv is None:
+            with metrics.timed("shap"):
+                sv = self._shap_values(test_sample, np.array([pred_class_idx]))[0]
+            self.shap_cache.put(key, sv)
+        
+        result = self._build_result(BMI, AGE, SMOKER, PRACTICE_SPORT,
+                                    pred_decision, pred_proba, pred_class_idx, sv)
+        
+        # Generate GPT explanation if requested
+        if use_gpt:
+            explanation = self._generate_gpt_explanation(result, gpt_model)
+            result["explanation"] = explanation
+        
+        return result
+    
+    def predict_with_explanation_batch(self, data, use_gpt=False, gpt_model="gpt-4"):
+        """
+        Vectorized `predict_with_explanation` for many applicants: one
+        `predict_proba` call and one SHAP computation for the whole batch.
+        
+        Args:
+            data: DataFrame with columns BMI, AGE, SMOKER, PRACTICE_SPORT
+            use_gpt: Whether to generate a GPT explanation per applicant (default: False)
+            gpt_model: Which GPT model to use (default: "gpt-4")
+            
+        Returns:
+            list of result dicts (same keys as `predict_with_explanation`),
+            aligned with the rows of data
+        """
+        if len(data) == 0:
+            return []
+        
+        samples = pd.DataFrame({
+            "BMI": data["BMI"].to_numpy(dtype=float),
+            "AGE": data["AGE"].to_numpy(dtype=int),
+            "SMOKER": data["SMOKER"].to_numpy(dtype=int),
+            "PRACTICE_SPORT": data["PRACTICE_SPORT"].to_numpy(dtype=int)
+        })
+        
+        # predict() is the argmax of predict_proba(), so one forest pass is enough
+        pred_proba = self._predict_proba(samples, stage="decision_forest_batch")
+        pred_labels = self.clf.classes_.take(np.argmax(pred_proba, axis=1))
+        pred_decisions = self.le.inverse_transform(pred_labels)
+        
+        # SHAP values of the predicted class of each row, computed for cache misses only
+        class_idx = pred_labels.astype(int)
+        keys = [
+            shap_key(*row, c) for row, c in zip(samples.itertuples(index=False), class_idx)
+        ]
+        cached = [self.shap_cache.get(key) for key in keys]
+        missing = np.array([i for i, sv in enumerate(cached) if sv is None], dtype=np.intp)
+        if len(missing):
+            with metrics.timed("shap_batch"):
+                for start in range(0, len(missing), BATCH_SHAP_CHUNK_SIZE):
+                    rows = missing[start:start + BATCH_SHAP_CHUNK_SIZE]
+                    for i, sv in zip(rows, self._shap_values(samples.iloc[rows], class_idx[rows])):
+                        cached[i] = sv
+                        self.shap_cache.put(keys[i], sv)
+        svs = np.array(cached).reshape(len(samples), len(FEATURES))
+        
+        results = []
+        for i, row in enumerate(samples.itertuples(index=False)):
+            result = self._build_result(row.BMI, row.AGE, row.SMOKER, row.PRACTICE_SPORT,
+                                        pred_decisions[i], pred_proba[i], int(class_idx[i]), svs[i])
+            if use_gpt:
+                result["explanation"] = self._generate_gpt_explanation(result, gpt_model)
+            results.append(result)
+        return results
+    
+    # --------------------------------------------------
+    # SHAP values
+    # --------------------------------------------------
+    def _single_class_explainers(self):
+        """
+        One TreeExplainer per class, restricted to the leaf values of that class.
+        TreeSHAP then accumulates a single output instead of all of them (about
+        40% less time per applicant on the decision forest), with the same
+        values. Returns None (all classes are computed, then sliced) if the
+        tree ensemble cannot be restricted or a probe gives different values.
+        """
+        try:
+            model = self.explainer.model
+            n_classes = model.values.shape[2]
+            if n_classes < 2:
+                return None
+            explainers = []
+            for k in range(n_classes):
+                class_model = copy.copy(model)
+                class_model.values = np.ascontiguousarray(model.values[:, :, k:k + 1])
+                class_model.base_offset = np.atleast_1d(model.base_offset)[k:k + 1]
+                class_model.trees = []
+                for tree in model.trees:
+                    class_tree = copy.copy(tree)
+                    class_tree.values = np.ascontiguousarray(tree.values[:, k:k + 1])
+                    class_model.trees.append(class_tree)
+                class_explainer = copy.copy(self.explainer)
+                class_explainer.model = class_model
+                class_explainer.expected_value = np.atleast_1d(self.explainer.expected_value)[k]
+                explainers.append(class_explainer)
+
+            probe = pd.DataFrame({
+                "BMI": [18.5, 27.3, 41.0],
+                "AGE": [25, 52, 78],
+                "SMOKER": [0, 1, 0],
+                "PRACTICE_SPORT": [1, 0, 0]
+            })
+            expected = self.explainer.shap_values(probe)
+            for k, class_explainer in enumerate(explainers):
+                values = np.asarray(class_explainer.shap_values(probe)).reshape(len(probe), -1)
+                if not np.array_equal(values, expected[:, :, k]):
+                    raise ValueError(f"class {k} values differ from the full explainer")
+            return explainers
+        except Exception as e:
+            print(f"Per-class SHAP explainers not available, computing all classes: {e}")
+            return None
+
+    def _shap_values(self, samples, class_idx):
+        """
+        SHAP values of class class_idx[i] for every row i of samples, shape
+        (n_rows, n_features).
+        """
+        if self.class_explainers is None:
+            shap_values = self.explainer.shap_values(samples)
+            return shap_values[np.arange(len(samples)), :, class_idx]
+        out = np.empty((len(samples), len(FEATURES)))
+        for k in np.unique(class_idx):
+            rows = np.flatnonzero(class_idx == k)
+            values = self.class_explainers[k].shap_values(samples.iloc[rows])
+            out[rows] = np.asarray(values).reshape(len(rows), -1)
+        return out
+
+    def warm_up_shap_cache(self, n_samples=SHAP_CACHE_WARMUP_SAMPLES, max_keys=SHAP_CACHE_WARMUP_KEYS,
+                           seed=0):
+        """
+        Pre-compute the SHAP values of the most frequent profiles of a synthetic
+        population (`helpers.sample_population`, the traffic distribution).
         
+        Returns:
+            Number of SHAP vectors added to the cache
+        """
+        from helpers import sample_population
+        population = sample_population(n_samples, seed=seed)
+        counts = population.groupby(FEATURES).size().sort_values(ascending=False, kind="stable")
+        profiles = counts.index[:max_keys].to_frame(index=False)
+        samples = pd.DataFrame({
+            "BMI": profiles["BMI"].to_numpy(dtype=float),
+            "AGE": profiles["AGE"].to_numpy(dtype=int),
+            "SMOKER": profiles["SMOKER"].to_numpy(dtype=int),
+            "PRACTICE_SPORT": profiles["PRACTICE_SPORT"].to_numpy(dtype=int)
+        })
+        class_idx = self.clf.classes_.take(np.argmax(self.clf.predict_proba(samples), axis=1)).astype(int)
+        keys = [shap_key(*row, c) for row, c in zip(samples.itertuples(index=False), class_idx)]
+        todo = np.array([i for i, key in enumerate(keys) if key not in self.shap_cache], dtype=np.intp)
+
+        for start in range(0, len(todo), WARMUP_CHUNK_SIZE):
+            rows = todo[start:start + WARMUP_CHUNK_SIZE]
+            for i, sv in zip(rows, self._shap_values(samples.iloc[rows], class_idx[rows])):
+                self.shap_cache.put(keys[i], sv, warm=True)
+        return len(todo)
+
+    def _predict_proba(self, samples, stage="decision_forest"):
+        """clf.predict_proba, on the flat-array evaluator for small inputs (timed as stage)"""
+        with metrics.timed(stage):
+            if self.flat_clf is not None and len(samples) <= FLAT_MAX_ROWS:
+                return self.flat_clf.predict_proba(samples.to_numpy(dtype=np.float64))
+            return self.clf.predict_proba(samples)
+
+    def _build_result(self, BMI, AGE, SMOKER, PRACTICE_SPORT,
+                      pred_decision, pred_proba, pred_class_idx, sv):
+        """
+        Assemble the result dict for one applicant from its class probabilities
+        and the SHAP values of the predicted class.
+        """
         # Create feature importance dict
         shap_dict = {
             "BMI": float(sv[0]),
@@ -95,8 +334,7 @@ class InsuranceDecisionExplainer:
         # Sort by absolute importance
         top_features = sorted(shap_dict.items(), key=lambda x: abs(x[1]), reverse=True)
         
-        # Build result
-        result = {
+        return {
             "decision": pred_decision,
             "probability": float(pred_proba[pred_class_idx]),
             "all_probabilities": dict(zip(self.le.classes_, [float(p) for p in pred_proba])),
@@ -109,21 +347,13 @@ class InsuranceDecisionExplainer:
                 "PRACTICE_SPORT": bool(PRACTICE_SPORT)
             }
         }
-        
-        # Generate GPT explanation if requested
-        if use_gpt:
-            explanation = self._generate_gpt_explanation(result, gpt_model)
-            result["explanation"] = explanation
-        
-        return result
     
-    def _generate_gpt_explanation(self, result, model="gpt-4"):
+    def _build_gpt_messages(self, result):
         """
-        Generate a natural language explanation using GPT based on SHAP values.
+        Build the chat messages asking GPT to explain the decision from its SHAP values.
         """
         decision = result["decision"]
         input_vals = result["input_values"]
-        shap_vals = result["shap_values"]
         top_features = result["top_features"]
         
         # Format SHAP contributions for GPT
@@ -159,22 +389,323 @@ Example styles:
 Your explanation:"""
         print(prompt)
 
+        return [
+            {"role": "system", "content": "You are a concise insurance underwriter. Provide brief, factual explanations."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _generate_gpt_explanation(self, result, model="gpt-4"):
+        """
+        Generate a natural language explanation using GPT based on SHAP values.
+        """
+        # Identical prompt inputs were already explained: skip the GPT round trip
+        cache_key = make_key(model, result)
+        cached = explanation_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        messages = self._build_gpt_messages(result)
+
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are a concise insurance underwriter. Provide brief, factual explanations."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=100
-            )
+            with metrics.timed("gpt_call"):
+                response = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.3,
+                    max_tokens=100,
+                    timeout=LLM_TIMEOUT_SECONDS
+                )
             
             explanation = response.choices[0].message.content.strip()
+            explanation_cache.put(cache_key, explanation)
             return explanation
             
         except Exception as e:
             return f"Error generating explanation: {str(e)}"
+    
+    async def _generate_gpt_explanation_async(self, result, model="gpt-4"):
+        """
+        Async `_generate_gpt_explanation`: awaits the API without blocking the
+        event loop, under the LLM concurrency cap and timeout (`llm_limits`).
+        """
+        cache_key = make_key(model, result)
+        cached = await explanation_cache.get_async(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            return await self._request_gpt_explanation(result, model, cache_key)
+        except asyncio.TimeoutError:
+            return f"Error generating explanation: no answer within {LLM_TIMEOUT_SECONDS:g}s"
+        except Exception as e:
+            return f"Error generating explanation: {str(e)}"
+    
+    async def _request_gpt_explanation(self, result, model, cache_key):
+        """One GPT round trip (cap and timeout of `llm_limits`); caches and returns the explanation"""
+        messages = self._build_gpt_messages(result)
+        with metrics.timed("gpt_call"):
+            response = await call_llm(lambda: self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=100
+            ))
+        
+        explanation = response.choices[0].message.content.strip()
+        explanation_cache.put_behind(cache_key, explanation)
+        return explanation
+    
+    async def explain_within_deadline(self, result, model="gpt-4", deadline=None):
+        """
+        GPT explanation if it is cached or arrives before deadline, else the
+        local `template_explanation`.
+        
+        Args:
+            result: explainer result (decision, probabilities, SHAP values)
+            model: Which GPT model to use
+            deadline: `time.monotonic()` time by which the explanation is
+                      needed; None waits for the call (up to LLM_TIMEOUT_SECONDS)
+        
+        Returns:
+            (explanation, source) with source "cache", "gpt" or "template". A
+            call still running at the deadline continues in the background and
+            caches its answer.
+        """
+        cache_key = make_key(model, result)
+        cached = await explanation_cache.get_async(cache_key)
+        if cached is not None:
+            metrics.count("explanation_source_cache")
+            return cached, "cache"
+        
+        call = asyncio.ensure_future(self._request_gpt_explanation(result, model, cache_key))
+        remaining = None if deadline is None else deadline - time.monotonic()
+        try:
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError
+            explanation = await asyncio.wait_for(asyncio.shield(call), remaining)
+            metrics.count("explanation_source_gpt")
+            return explanation, "gpt"
+        except asyncio.TimeoutError:
+            if not call.done():
+                _background_calls.add(call)
+                call.add_done_callback(_finish_background_call)
+                print("GPT explanation missed the deadline, using the template explanation")
+            elif call.exception() is not None:
+                print(f"GPT explanation failed, using the template explanation: {call.exception()!r}")
+        except Exception as e:
+            print(f"GPT explanation failed, using the template explanation: {e!r}")
+        metrics.count("explanation_source_template")
+        return template_explanation(result), "template"
+
+    
+    async def stream_gpt_explanation(self, result, model="gpt-4"):
+        """
+        Async generator yielding the GPT explanation piece by piece as the
+        tokens arrive (a cached explanation is yielded in one piece). The full,
+        stripped explanation is cached once the stream completes.
+
+        The OpenAI stream is read by a separate task that holds the LLM slot
+        and the timeout; this generator only forwards its pieces, so a slow
+        client neither keeps the slot nor counts against LLM_TIMEOUT_SECONDS.
+        If the consumer stops early, the task finishes in the background and
+        still caches the explanation.
+
+        Raises:
+            TimeoutError: If the stream does not complete within LLM_TIMEOUT_SECONDS
+        """
+        cache_key = make_key(model, result)
+        cached = await explanation_cache.get_async(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        deltas = asyncio.Queue()
+        reader = asyncio.ensure_future(self._read_gpt_stream(result, model, cache_key, deltas))
+        try:
+            while (delta := await deltas.get()) is not None:
+                yield delta
+        finally:
+            if not reader.done():
+                _background_calls.add(reader)
+                reader.add_done_callback(_finish_background_call)
+        # re-raises the failure of the stream, if any
+        await reader
+    
+    async def _read_gpt_stream(self, result, model, cache_key, deltas):
+        """
+        Read one streamed GPT explanation (cap and timeout of `llm_limits`) and
+        put its pieces on the deltas queue, then None; caches the explanation.
+        """
+        messages = self._build_gpt_messages(result)
+        parts = []
+        try:
+            async with llm_slot():
+                with metrics.timed("gpt_call"):
+                    async with asyncio.timeout(LLM_TIMEOUT_SECONDS):
+                        stream = await self.async_client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            temperature=0.3,
+                            max_tokens=100,
+                            stream=True
+                        )
+                        async for chunk in stream:
+                            delta = chunk.choices[0].delta.content if chunk.choices else None
+                            if delta:
+                                parts.append(delta)
+                                deltas.put_nowait(delta)
+            explanation_cache.put_behind(cache_key, "".join(parts).strip())
+        finally:
+            deltas.put_nowait(None)
+
+
+def _finish_background_call(call):
+    _background_calls.discard(call)
+    if not call.cancelled() and call.exception() is not None:
+        print(f"Background GPT explanation failed: {call.exception()!r}")
+
+
+# Wording of the feature values in template explanations
+_TEMPLATE_FEATURES = {
+    "BMI": lambda v: f"a BMI of {float(v):.1f}",
+    "AGE": lambda v: f"an age of {int(v)} years",
+    "SMOKER": lambda v: "smoking" if v else "not smoking",
+    "PRACTICE_SPORT": lambda v: "regular sport" if v else "no regular sport",
+}
+
+
+def template_explanation(result, max_features=2):
+    """
+    Deterministic explanation of an explainer result without GPT: the
+    strongest SHAP contributions and the comment of the operational rule
+    matching the applicant.
+    """
+    input_vals = result["input_values"]
+    factors = [
+        f"{_TEMPLATE_FEATURES[feat](input_vals[feat])} "
+        f"({'increases' if val > 0 else 'decreases'} the likelihood of this decision)"
+        for feat, val in result["top_features"][:max_features]
+        if val != 0
+    ]
+    explanation = f"{str(result['decision']).capitalize()} ({result['probability']:.0%} confidence)"
+    if factors:
+        explanation += ", mainly driven by " + " and ".join(factors)
+    with metrics.timed("operational_rule"):
+        _, comment = operational_rule(
+            input_vals["BMI"], input_vals["AGE"], input_vals["SMOKER"], input_vals["PRACTICE_SPORT"]
+        )
+    return f"{explanation}. Underwriting rule: {comment}."
+
+
+# =========================
+# Warm explainer (singleton)
+# =========================
+class DecisionExplainerService:
+    """
+    Keeps one loaded `InsuranceDecisionExplainer` per process so the forest,
+    label encoder, SHAP TreeExplainer and OpenAI client are created once
+    instead of on every request.
+
+    With shared state, a reload announced by one worker (`announce_reload`)
+    makes every other worker reload in the background on its next request,
+    then call the `reload_listeners` (e.g. to re-check the decision table).
+    """
+
+    def __init__(self, model_path="../../assets/predictor_decision.joblib",
+                 encoder_path="../../assets/label_encoder.joblib"):
+        self.model_path = model_path
+        self.encoder_path = encoder_path
+        self._explainer = None
+        self._load_lock = threading.RLock()
+        self.reload_listeners = []
+        # shared "explainer" generation of the loaded explainer
+        self._generation = shared_state.generation("explainer") if shared_state.enabled() else 0
+        self._watch = shared_state.GenerationWatch("explainer") if shared_state.enabled() else None
+        self._reloading = False
+
+    def load_model(self) -> bool:
+        """
+        Loads (or reloads) the explainer. The new instance is fully built before
+        it replaces the current one, so requests already holding the old
+        explainer finish on it and never see a half-loaded state.
+        """
+        with self._load_lock:
+            try:
+                with timed("decision_explainer"):
+                    explainer = InsuranceDecisionExplainer(
+                        model_path=self.model_path,
+                        encoder_path=self.encoder_path
+                    )
+            except Exception as e:
+                print(f"❌ Error loading decision explainer: {e}")
+                return False
+            self._explainer = explainer
+            print("✅ Decision explainer loaded successfully")
+        if SHAP_CACHE_WARMUP_SAMPLES > 0:
+            # in the background: requests are served (and fill the cache) meanwhile
+            threading.Thread(target=self._warm_up, args=(explainer,), daemon=True).start()
+        return True
+
+    @staticmethod
+    def _warm_up(explainer):
+        start = time.perf_counter()
+        try:
+            added = explainer.warm_up_shap_cache()
+        except Exception as e:
+            print(f"❌ SHAP cache warm-up failed: {e}")
+            return
+        print(f"✅ SHAP cache warmed with {added} profiles in {time.perf_counter() - start:.1f}s")
+
+    def is_loaded(self) -> bool:
+        """Checks if the explainer is loaded"""
+        return self._explainer is not None
+
+    def get_explainer(self) -> InsuranceDecisionExplainer:
+        """
+        Returns the warm explainer, loading it on first use if the startup
+        load did not happen.
+
+        Raises:
+            ValueError: If the explainer cannot be loaded
+        """
+        explainer = self._explainer
+        if explainer is None:
+            # concurrent first requests (lazy startup) load it only once
+            with self._load_lock:
+                if self._explainer is None:
+                    self.load_model()
+                explainer = self._explainer
+        if explainer is None:
+            raise ValueError("Decision explainer not loaded. Run load_model() first.")
+        if self._watch is not None and self._watch.latest() > self._generation:
+            self._reload_in_background(self._watch.latest())
+        return explainer
+
+    def announce_reload(self):
+        """After a reload in this worker: make the other workers reload too (shared state only)"""
+        if shared_state.enabled():
+            self._generation = shared_state.bump_generation("explainer")
+
+    def _reload_in_background(self, generation):
+        with self._load_lock:
+            if self._reloading or generation <= self._generation:
+                return
+            self._reloading = True
+
+        def reload():
+            try:
+                if self.load_model():
+                    for listener in self.reload_listeners:
+                        listener()
+            finally:
+                # not retried on failure: the current explainer keeps serving
+                self._generation = generation
+                self._reloading = False
+
+        threading.Thread(target=reload, daemon=True).start()
+
+
+decision_explainer = DecisionExplainerService()
 
 
 def explain_insurance_decision(insurance_data, 
@@ -182,7 +713,8 @@ def explain_insurance_decision(insurance_data,
                                encoder_path="../../assets/label_encoder.joblib",
                                use_gpt=True,
                                gpt_model="gpt-4",
-                               verbose=True):
+                               verbose=True,
+                               pred_proba=None):
     """
     Convenience function to get insurance decision with explanation.
     
@@ -194,15 +726,12 @@ def explain_insurance_decision(insurance_data,
         use_gpt: Whether to generate GPT explanation (default: True)
         gpt_model: Which GPT model to use (default: "gpt-4")
         verbose: Whether to print formatted results (default: True)
+        pred_proba: Class probabilities if already known (skips the forest call)
         
     Returns:
         dict with prediction results and explanation
     """
-    # Initialize explainer
-    explainer = InsuranceDecisionExplainer(
-        model_path=model_path,
-        encoder_path=encoder_path
-    )
+    explainer = _get_explainer(model_path, encoder_path)
     
     # Get prediction with explanation
     result = explainer.predict_with_explanation(
@@ -211,35 +740,115 @@ def explain_insurance_decision(insurance_data,
         SMOKER=insurance_data['SMOKER'],
         PRACTICE_SPORT=insurance_data['PRACTICE_SPORT'],
         use_gpt=use_gpt,
-        gpt_model=gpt_model
+        gpt_model=gpt_model,
+        pred_proba=pred_proba
     )
     
     # Print formatted output if verbose
     if verbose:
-        print("="*80)
-        print(f"Insurance Decision Analysis")
-        print("="*80)
-        print(f"\nApplicant Profile:")
-        print(f"  BMI: {insurance_data['BMI']}")
-        print(f"  AGE: {insurance_data['AGE']}")
-        print(f"  SMOKER: {'Yes' if insurance_data['SMOKER'] else 'No'}")
-        print(f"  PRACTICE_SPORT: {'Yes' if insurance_data['PRACTICE_SPORT'] else 'No'}")
-        
-        print(f"\nDecision: {result['decision']}")
-        print(f"Confidence: {result['probability']:.1%}")
-        
-        print(f"\nTop Contributing Features:")
-        for feat, shap_val in result['top_features']:
-            print(f"  {feat:20s}: {shap_val:+.4f}")
-        
-        if 'explanation' in result:
-            print(f"\nGPT Explanation:\n  {result['explanation']}")
-        
-        print("="*80)
+        _print_analysis(insurance_data, result)
+    
+    return result
+
+
+async def explain_insurance_decision_async(insurance_data,
+                                           model_path="../../assets/predictor_decision.joblib",
+                                           encoder_path="../../assets/label_encoder.joblib",
+                                           use_gpt=True,
+                                           gpt_model="gpt-4",
+                                           verbose=True,
+                                           pred_proba=None,
+                                           deadline=None):
+    """
+    Async `explain_insurance_decision` for the API: the forest and SHAP part
+    runs on the CPU executor and the GPT call is awaited (with timeout and
+    concurrency cap), neither blocks the event loop.
+    
+    With use_gpt, result["explanation_source"] tells where the explanation
+    came from ("cache", "gpt" or "template", see `explain_within_deadline`;
+    deadline is a `time.monotonic()` time).
+    """
+    result = await run_cpu(explain_features, insurance_data, model_path, encoder_path, pred_proba)
+    
+    if use_gpt:
+        explainer = _get_explainer(model_path, encoder_path)
+        result["explanation"], result["explanation_source"] = await explainer.explain_within_deadline(
+            result, gpt_model, deadline
+        )
+    
+    if verbose:
+        _print_analysis(insurance_data, result)
     
     return result
 
 
+async def gpt_explanations_async(results, gpt_model="gpt-4"):
+    """
+    GPT explanations of many explainer results, requested concurrently through
+    the explanation cache, the LLM concurrency cap and the timeout.
+    """
+    explainer = decision_explainer.get_explainer()
+    return await asyncio.gather(*[
+        explainer._generate_gpt_explanation_async(result, gpt_model) for result in results
+    ])
+
+
+def explain_features(insurance_data,
+                     model_path="../../assets/predictor_decision.joblib",
+                     encoder_path="../../assets/label_encoder.joblib",
+                     pred_proba=None):
+    """
+    Decision, probabilities and SHAP values of one applicant, without GPT
+    (module-level, so the CPU executor can also run it in a process pool).
+    """
+    return _get_explainer(model_path, encoder_path).predict_with_explanation(
+        BMI=insurance_data['BMI'],
+        AGE=insurance_data['AGE'],
+        SMOKER=insurance_data['SMOKER'],
+        PRACTICE_SPORT=insurance_data['PRACTICE_SPORT'],
+        use_gpt=False,
+        pred_proba=pred_proba
+    )
+
+
+def explain_features_batch(data):
+    """`explain_features` for a DataFrame of applicants, in one forest/SHAP pass (for the CPU executor)"""
+    return decision_explainer.get_explainer().predict_with_explanation_batch(data, use_gpt=False)
+
+
+def _get_explainer(model_path, encoder_path):
+    """Reuse the warm explainer unless other artifacts were requested"""
+    if model_path == decision_explainer.model_path and encoder_path == decision_explainer.encoder_path:
+        return decision_explainer.get_explainer()
+    return InsuranceDecisionExplainer(
+        model_path=model_path,
+        encoder_path=encoder_path
+    )
+
+
+def _print_analysis(insurance_data, result):
+    """Print the formatted decision analysis"""
+    print("="*80)
+    print(f"Insurance Decision Analysis")
+    print("="*80)
+    print(f"\nApplicant Profile:")
+    print(f"  BMI: {insurance_data['BMI']}")
+    print(f"  AGE: {insurance_data['AGE']}")
+    print(f"  SMOKER: {'Yes' if insurance_data['SMOKER'] else 'No'}")
+    print(f"  PRACTICE_SPORT: {'Yes' if insurance_data['PRACTICE_SPORT'] else 'No'}")
+    
+    print(f"\nDecision: {result['decision']}")
+    print(f"Confidence: {result['probability']:.1%}")
+    
+    print(f"\nTop Contributing Features:")
+    for feat, shap_val in result['top_features']:
+        print(f"  {feat:20s}: {shap_val:+.4f}")
+    
+    if 'explanation' in result:
+        print(f"\nGPT Explanation:\n  {result['explanation']}")
+    
+    print("="*80)
+
 if __name__ == "__main__":
     # Example usage of the convenience function
     insurance_data = {
@@ -0,0 +1,300 @@
+"""
+rule_index.py - Nearest-Rule Index for the Learned Rule Table
+
+This module provides `RuleIndex`, a NumPy-backed index over the learned rule
+table used by `decide.find_best_rule`. It returns exactly the same best rule and
+similarity as applying `decide.compute_similarity` row by row, without a Python
+call per rule.
+
+The similarity between a rule and an input is
+
+    (1 - |dBMI| / 100) + (1 - |dAGE| / 100) + [SMOKER equal] + [PRACTICE_SPORT equal]
+
+so the rules are partitioned by (SMOKER, PRACTICE_SPORT): inside a partition the
+categorical part is a constant and only the BMI/AGE L1 part has to be evaluated,
+on contiguous arrays. The partition matching the input is visited first, and any
+partition whose best possible score cannot reach the current best is skipped.
+An input equal to a rule on all four keys is answered from a hash map of the
+keys without scanning (an exact match has the maximal similarity).
+
+Ties are resolved like `Series.idxmax`: the rule that comes first in the table
+wins.
+
+Key Components:
+- `RuleIndex`: Partitioned index with `query` (best rule), `query_batch` (best
+  rule for many inputs at once), `query_topk` (k nearest rules), `exact` /
+  `exact_batch` (O(1) exact-match lookup) and `add` (rules appended by the
+  learning loop).
+- `get_rule_index`: Returns the index attached to a rules DataFrame, building it
+  on first use and catching up with rows appended since.
+"""
+
+import weakref
+import numpy as np
+
+# Upper bound of the BMI/AGE part of the similarity (both distances equal to 0)
+MAX_NUMERIC_SIMILARITY = 2.0
+
+# Similarity of an exact match, computed like compute_similarity
+EXACT_MATCH_SIMILARITY = (1 - 0.0 / 100) + (1 - 0.0 / 100) + 1 + 1
+
+# Max number of (input, rule) similarities held in memory by query_batch
+BATCH_BLOCK_SIZE = 1 << 22
+
+PARTITION_KEYS = [(False, False), (False, True), (True, False), (True, True)]
+
+
+def rule_key(BMI, AGE, SMOKER, PRACTICE_SPORT):
+    """Hashable exact-match key of a rule or input"""
+    return float(BMI), float(AGE), bool(SMOKER), bool(PRACTICE_SPORT)
+
+
+class _Partition:
+    """Growable BMI/AGE/position arrays for one (SMOKER, PRACTICE_SPORT) pair."""
+
+    def __init__(self, capacity=64):
+        self.bmi = np.empty(capacity, dtype=np.float64)
+        self.age = np.empty(capacity, dtype=np.float64)
+        self.pos = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def _reserve(self, n):
+        if n <= len(self.pos):
+            return
+        capacity = max(n, 2 * len(self.pos))
+        for name in ("bmi", "age", "pos"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def extend(self, bmi, age, pos):
+        n = self.size + len(pos)
+        self._reserve(n)
+        self.bmi[self.size:n] = bmi
+        self.age[self.size:n] = age
+        self.pos[self.size:n] = pos
+        self.size = n
+
+    def similarities(self, BMI, AGE, smoker_bonus, sport_bonus):
+        # Same operation order as compute_similarity, so results are bit-identical
+        sim = 1 - np.abs(self.bmi[:self.size] - BMI) / 100
+        sim += 1 - np.abs(self.age[:self.size] - AGE) / 100
+        sim += smoker_bonus
+        sim += sport_bonus
+        return sim
+
+
+class RuleIndex:
+    """
+    Nearest-rule index over the BMI, AGE, SMOKER and PRACTICE_SPORT columns of a
+    rules table. Positions returned by the queries are row positions (`iloc`)
+    in the indexed table.
+    """
+
+    def __init__(self, rules_df=None):
+        self._partitions = {key: _Partition() for key in PARTITION_KEYS}
+        # exact key -> position of its first rule (the one queries return)
+        self._exact = {}
+        self.size = 0
+        if rules_df is not None and len(rules_df) > 0:
+            self.extend(
+                rules_df['BMI'].to_numpy(dtype=np.float64),
+                rules_df['AGE'].to_numpy(dtype=np.float64),
+                rules_df['SMOKER'].to_numpy(dtype=bool),
+                rules_df['PRACTICE_SPORT'].to_numpy(dtype=bool),
+            )
+
+    def extend(self, bmi, age, smoker, sport):
+        """Append rules (as arrays) at the end of the indexed table."""
+        pos = np.arange(self.size, self.size + len(bmi), dtype=np.int64)
+        for key in PARTITION_KEYS:
+            mask = (smoker == key[0]) & (sport == key[1])
+            if mask.any():
+                self._partitions[key].extend(bmi[mask], age[mask], pos[mask])
+        keys = zip(bmi.tolist(), age.tolist(), smoker.tolist(), sport.tolist())
+        for key, p in zip(keys, pos.tolist()):
+            self._exact.setdefault(key, p)
+        self.size += len(bmi)
+
+    def add(self, BMI, AGE, SMOKER, PRACTICE_SPORT):
+        """Append a single rule at the end of the indexed table."""
+        self._partitions[(bool(SMOKER), bool(PRACTICE_SPORT))].extend(
+            [float(BMI)], [float(AGE)], [self.size]
+        )
+        self._exact.setdefault(rule_key(BMI, AGE, SMOKER, PRACTICE_SPORT), self.size)
+        self.size += 1
+
+    def exact(self, x_input):
+        """Position of the first rule equal to x_input on all four keys, or None."""
+        return self._exact.get(rule_key(
+            x_input['BMI'], x_input['AGE'], x_input['SMOKER'], x_input['PRACTICE_SPORT']
+        ))
+
+    def exact_batch(self, BMI, AGE, SMOKER, PRACTICE_SPORT):
+        """Vectorized `exact` over arrays of inputs; -1 where no rule matches."""
+        keys = zip(
+            np.asarray(BMI, dtype=np.float64).tolist(), np.asarray(AGE, dtype=np.float64).tolist(),
+            np.asarray(SMOKER, dtype=bool).tolist(), np.asarray(PRACTICE_SPORT, dtype=bool).tolist()
+        )
+        return np.array([self._exact.get(key, -1) for key in keys], dtype=np.int64)
+
+    def _ordered_partitions(self, SMOKER, PRACTICE_SPORT):
+        """Partitions with their categorical bonuses, best possible bonus first."""
+        parts = []
+        for key in PARTITION_KEYS:
+            smoker_bonus = 1 if key[0] == SMOKER else 0
+            sport_bonus = 1 if key[1] == PRACTICE_SPORT else 0
+            parts.append((self._partitions[key], smoker_bonus, sport_bonus))
+        parts.sort(key=lambda p: -(p[1] + p[2]))
+        return parts
+
+    def query(self, x_input):
+        """
+        Find the most similar rule.
+
+        Args:
+            x_input: dict with keys 'BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT'
+
+        Returns:
+            (position, similarity) of the best rule, or (None, None) if the
+            index is empty
+        """
+        pos = self.exact(x_input)
+        if pos is not None:
+            return pos, np.float64(EXACT_MATCH_SIMILARITY)
+
+        BMI, AGE = float(x_input['BMI']), float(x_input['AGE'])
+        best_pos, best_sim = None, None
+        for part, smoker_bonus, sport_bonus in self._ordered_partitions(
+            bool(x_input['SMOKER']), bool(x_input['PRACTICE_SPORT'])
+        ):
+            if part.size == 0:
+                continue
+            if best_sim is not None and smoker_bonus + sport_bonus + MAX_NUMERIC_SIMILARITY < best_sim:
+                continue
+            sims = part.similarities(BMI, AGE, smoker_bonus, sport_bonus)
+            i = int(np.argmax(sims))
+            sim, pos = sims[i], int(part.pos[i])
+            if best_sim is None or sim > best_sim or (sim == best_sim and pos < best_pos):
+                best_pos, best_sim = pos, sim
+        return best_pos, best_sim
+
+    def query_batch(self, BMI, AGE, SMOKER, PRACTICE_SPORT):
+        """
+        Find the most similar rule for each of many inputs given as arrays.
+        Equivalent to calling `query` once per input.
+
+        Returns:
+            (positions, similarities) as NumPy arrays, one entry per input
+        """
+        BMI = np.asarray(BMI, dtype=np.float64)
+        AGE = np.asarray(AGE, dtype=np.float64)
+        SMOKER = np.asarray(SMOKER, dtype=bool)
+        PRACTICE_SPORT = np.asarray(PRACTICE_SPORT, dtype=bool)
+        n = len(BMI)
+        best_pos = np.full(n, -1, dtype=np.int64)
+        best_sim = np.full(n, -np.inf)
+
+        # (input group, rule partition) pairs, highest categorical bonus first,
+        # so most inputs are settled before the partitions that cannot win
+        pairs = []
+        for group in PARTITION_KEYS:
+            members = np.flatnonzero((SMOKER == group[0]) & (PRACTICE_SPORT == group[1]))
+            if len(members) == 0:
+                continue
+            for key in PARTITION_KEYS:
+                smoker_bonus = 1 if key[0] == group[0] else 0
+                sport_bonus = 1 if key[1] == group[1] else 0
+                pairs.append((members, self._partitions[key], smoker_bonus, sport_bonus))
+        pairs.sort(key=lambda p: -(p[2] + p[3]))
+
+        for members, part, smoker_bonus, sport_bonus in pairs:
+            if part.size == 0:
+                continue
+            bound = smoker_bonus + sport_bonus + MAX_NUMERIC_SIMILARITY
+            members = members[best_sim[members] <= bound]
+            step = max(1, BATCH_BLOCK_SIZE // part.size)
+            for start in range(0, len(members), step):
+                rows = members[start:start + step]
+                # Same operation order as compute_similarity, so results are bit-identical
+                sims = 1 - np.abs(part.bmi[None, :part.size] - BMI[rows, None]) / 100
+                sims += 1 - np.abs(part.age[None, :part.size] - AGE[rows, None]) / 100
+                sims += smoker_bonus
+                sims += sport_bonus
+                i = np.argmax(sims, axis=1)
+                sim = sims[np.arange(len(i)), i]
+                pos = part.pos[i]
+                better = (sim > best_sim[rows]) | ((sim == best_sim[rows]) & (pos < best_pos[rows]))
+                best_sim[rows[better]] = sim[better]
+                best_pos[rows[better]] = pos[better]
+
+        return best_pos, best_sim
+
+    def query_topk(self, x_input, k=5):
+        """
+        Find the k most similar rules, most similar first (ties by table order).
+
+        Returns:
+            (positions, similarities) as NumPy arrays of length <= k
+        """
+        BMI, AGE = float(x_input['BMI']), float(x_input['AGE'])
+        cand_pos, cand_sim = [], []
+        for part, smoker_bonus, sport_bonus in self._ordered_partitions(
+            bool(x_input['SMOKER']), bool(x_input['PRACTICE_SPORT'])
+        ):
+            if part.size == 0:
+                continue
+            sims = part.similarities(BMI, AGE, smoker_bonus, sport_bonus)
+            if part.size > k:
+                # keep everything tied with the k-th best so table order decides
+                kth = np.partition(sims, part.size - k)[part.size - k]
+                keep = sims >= kth
+                sims = sims[keep]
+                pos = part.pos[:part.size][keep]
+            else:
+                pos = part.pos[:part.size]
+            cand_pos.append(pos)
+            cand_sim.append(sims)
+
+        if not cand_pos:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        pos = np.concatenate(cand_pos)
+        sims = np.concatenate(cand_sim)
+        order = np.lexsort((pos, -sims))[:k]
+        return pos[order], sims[order]
+
+
+# --------------------------------------------------
+# Index cache attached to rules DataFrames
+# --------------------------------------------------
+_index_cache = {}
+
+
+def get_rule_index(rules_df):
+    """
+    Return the `RuleIndex` for `rules_df`, building it on first use.
+
+    Rows appended to the DataFrame since the last call (e.g. by
+    `decide.decide_and_learn`) are added to the index incrementally; if the
+    table shrank, the index is rebuilt. Key columns of existing rows are
+    assumed not to be edited in place.
+    """
+    entry = _index_cache.get(id(rules_df))
+    index = None
+    if entry is not None and entry[0]() is rules_df:
+        index = entry[1]
+
+    if index is None or len(rules_df) < index.size:
+        index = RuleIndex(rules_df)
+        key = id(rules_df)
+        _index_cache[key] = (weakref.ref(rules_df, lambda _: _index_cache.pop(key, None)), index)
+    elif len(rules_df) > index.size:
+        tail = rules_df.iloc[index.size:]
+        index.extend(
+            tail['BMI'].to_numpy(dtype=np.float64),
+            tail['AGE'].to_numpy(dtype=np.float64),
+            tail['SMOKER'].to_numpy(dtype=bool),
+            tail['PRACTICE_SPORT'].to_numpy(dtype=bool),
+        )
+    return index
@@ -0,0 +1,196 @@
+"""
+rule_store.py - Append-Only Columnar Store for the Learned Rules
+
+`decide_and_learn` grows the learned rule table one rule at a time and corrects
+the decision of existing rules. On a pandas DataFrame each `rules_df.loc[...]`
+write reallocates the frame, so learning loops over large populations get
+slower with every rule learned.
+
+`RuleStore` keeps the rules in NumPy columns with geometric capacity growth:
+- appending a rule is amortized O(1) (the capacity doubles when full),
+- correcting the decision/comment of a rule is an O(1) in-place write,
+- DECISION and COMMENT are stored as codes into small vocabularies,
+- the nearest-rule `RuleIndex` is updated with every appended rule, so lookups
+  always see the rules learned so far.
+
+`to_frame()` returns a DataFrame view with the usual columns (built from the
+arrays and cached until the next write) for code that expects `rules_df`.
+
+Key Components:
+- `RuleStore.from_frame` / `RuleStore.to_frame`: Conversion from/to the
+  DataFrame layout of learned_rules.csv.
+- `append`, `set_decision`, `row`: The operations used by the learning loop
+  (`set_decision_codes` and the code helpers serve `batch_learning`).
+- `best_rule`: Nearest-rule lookup (same result as `decide.find_best_rule`).
+"""
+
+import numpy as np
+import pandas as pd
+from rule_index import RuleIndex
+
+RULE_COLUMNS = ['BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT', 'DECISION', 'COMMENT']
+
+
+class RuleStore:
+    """Columnar, append-only table of learned rules with an in-sync RuleIndex."""
+
+    _ARRAYS = {
+        "bmi": np.float64,
+        "age": np.float64,
+        "smoker": bool,
+        "sport": bool,
+        "decision": np.int32,
+        "comment": np.int32,
+    }
+
+    def __init__(self, capacity=1024):
+        for name, dtype in self._ARRAYS.items():
+            setattr(self, name, np.empty(capacity, dtype=dtype))
+        self.size = 0
+        self.decisions, self._decision_codes = [], {}
+        self.comments, self._comment_codes = [], {}
+        self.index = RuleIndex()
+        self._frame = None
+
+    # --------------------------------------------------
+    # Conversion
+    # --------------------------------------------------
+    @classmethod
+    def from_frame(cls, rules_df):
+        """Build a store from a DataFrame with the RULE_COLUMNS columns (other columns are ignored)."""
+        store = cls(capacity=max(1024, 2 * len(rules_df)))
+        store.extend(
+            rules_df['BMI'].to_numpy(dtype=np.float64),
+            rules_df['AGE'].to_numpy(dtype=np.float64),
+            rules_df['SMOKER'].to_numpy(dtype=bool),
+            rules_df['PRACTICE_SPORT'].to_numpy(dtype=bool),
+            rules_df['DECISION'].tolist(),
+            rules_df['COMMENT'].tolist(),
+        )
+        return store
+
+    def to_frame(self):
+        """
+        DataFrame of the rules in table order (RULE_COLUMNS). The frame is
+        cached until the next write; treat it as read-only.
+        """
+        if self._frame is None:
+            n = self.size
+            age = self.age[:n]
+            if np.all(age == np.floor(age)):
+                age = age.astype(np.int64)
+            self._frame = pd.DataFrame({
+                'BMI': self.bmi[:n].copy(),
+                'AGE': age.copy(),
+                'SMOKER': self.smoker[:n].copy(),
+                'PRACTICE_SPORT': self.sport[:n].copy(),
+                'DECISION': np.array(self.decisions, dtype=object)[self.decision[:n]] if n else [],
+                'COMMENT': np.array(self.comments, dtype=object)[self.comment[:n]] if n else [],
+            }, columns=RULE_COLUMNS)
+        return self._frame
+
+    def __len__(self):
+        return self.size
+
+    # --------------------------------------------------
+    # Writes
+    # --------------------------------------------------
+    def _reserve(self, n):
+        if n <= len(self.bmi):
+            return
+        capacity = max(n, 2 * len(self.bmi))
+        for name in self._ARRAYS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    @staticmethod
+    def _code(value, vocabulary, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(vocabulary)
+            vocabulary.append(value)
+        return code
+
+    def extend(self, bmi, age, smoker, sport, decisions, comments):
+        """Append many rules given as arrays/lists."""
+        start, n = self.size, self.size + len(bmi)
+        self._reserve(n)
+        self.bmi[start:n] = bmi
+        self.age[start:n] = age
+        self.smoker[start:n] = smoker
+        self.sport[start:n] = sport
+        self.decision[start:n] = [self._code(d, self.decisions, self._decision_codes) for d in decisions]
+        self.comment[start:n] = [self._code(c, self.comments, self._comment_codes) for c in comments]
+        self.size = n
+        self.index.extend(self.bmi[start:n], self.age[start:n], self.smoker[start:n], self.sport[start:n])
+        self._frame = None
+
+    def append(self, rule):
+        """
+        Append one rule (dict with the RULE_COLUMNS keys).
+
+        Returns:
+            Position of the new rule
+        """
+        pos = self.size
+        self._reserve(pos + 1)
+        self.bmi[pos] = rule['BMI']
+        self.age[pos] = rule['AGE']
+        self.smoker[pos] = bool(rule['SMOKER'])
+        self.sport[pos] = bool(rule['PRACTICE_SPORT'])
+        self.decision[pos] = self._code(rule['DECISION'], self.decisions, self._decision_codes)
+        self.comment[pos] = self._code(rule['COMMENT'], self.comments, self._comment_codes)
+        self.size = pos + 1
+        self.index.add(rule['BMI'], rule['AGE'], rule['SMOKER'], rule['PRACTICE_SPORT'])
+        self._frame = None
+        return pos
+
+    def set_decision(self, pos, decision, comment):
+        """Correct the decision and comment of the rule at position pos, in place."""
+        if not 0 <= pos < self.size:
+            raise IndexError(f"rule position {pos} out of range (size {self.size})")
+        self.decision[pos] = self._code(decision, self.decisions, self._decision_codes)
+        self.comment[pos] = self._code(comment, self.comments, self._comment_codes)
+        self._frame = None
+
+    def decision_code(self, decision):
+        """Code of a decision string in this store (added to the vocabulary if new)"""
+        return self._code(decision, self.decisions, self._decision_codes)
+
+    def comment_code(self, comment):
+        """Code of a comment string in this store (added to the vocabulary if new)"""
+        return self._code(comment, self.comments, self._comment_codes)
+
+    def set_decision_codes(self, positions, decision_codes, comment_codes):
+        """Vectorized `set_decision` with decision/comment codes."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) and (positions.min() < 0 or positions.max() >= self.size):
+            raise IndexError(f"rule positions out of range (size {self.size})")
+        self.decision[positions] = decision_codes
+        self.comment[positions] = comment_codes
+        self._frame = None
+
+    # --------------------------------------------------
+    # Reads
+    # --------------------------------------------------
+    def row(self, pos):
+        """Rule at position pos as a dict with the RULE_COLUMNS keys."""
+        return {
+            'BMI': float(self.bmi[pos]),
+            'AGE': float(self.age[pos]),
+            'SMOKER': bool(self.smoker[pos]),
+            'PRACTICE_SPORT': bool(self.sport[pos]),
+            'DECISION': self.decisions[self.decision[pos]],
+            'COMMENT': self.comments[self.comment[pos]],
+        }
+
+    def best_rule(self, x_input):
+        """
+        Most similar rule to x_input.
+
+        Returns:
+            (position, similarity), or (None, None) if the store is empty
+        """
+        return self.index.query(x_input)
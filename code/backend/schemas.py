@@ -1,6 +1,10 @@
+import os
 from pydantic import BaseModel, Field
 from typing import List, Optional
 
+# Max records of one /predict_batch request; larger inputs go to /predict_bulk
+BATCH_MAX_RECORDS = int(os.getenv("BATCH_MAX_RECORDS", 1000))
+
 class PredictionOutput(BaseModel):
     predicted_price: float
     base_price: float
@@ -20,6 +24,14 @@ class FormData(BaseModel):
     sports: Optional[List[str]] = Field(None, description="List of sports the person practices")
     insurance_price: Optional[float] = Field(None, description="Price of the insurance in CHF (optional)")
 
+class BatchFormData(BaseModel):
+    """Many applicants to underwrite in one request (group contracts, broker portfolios)"""
+    records: List[FormData] = Field(
+        max_length=BATCH_MAX_RECORDS,
+        description=f"Applicants (at most {BATCH_MAX_RECORDS}, use /predict_bulk for larger files)"
+    )
+    use_gpt: bool = Field(False, description="Generate a GPT explanation for every record (slow)")
+
 class RuleItem(BaseModel):
     BMI: float
     AGE: int
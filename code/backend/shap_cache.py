@@ -0,0 +1,95 @@
+"""
+shap_cache.py - In-Memory Cache of SHAP Values for the Decision Explainer
+
+The SHAP values of a decision only depend on the model and on the applicant
+features, and those take few distinct values: BMI at 0.1 resolution, an
+integer age and two booleans. The same profiles therefore recur constantly,
+and each one used to pay a full `TreeExplainer.shap_values` run (a few
+milliseconds per applicant on the 300-tree decision forest).
+
+`ShapCache` keeps the SHAP vector of the predicted class under the input
+quantized the way the forest sees it (BMI as float32, AGE as int, booleans),
+so a cached vector is exactly what a new computation would return. It is a
+bounded LRU owned by the explainer instance: reloading the explainer starts
+from an empty cache, so values of an old model are never served.
+
+Configuration (environment variables):
+- `SHAP_CACHE_MAX_ENTRIES`: max cached SHAP vectors (default: 50000)
+- `SHAP_CACHE_WARMUP_SAMPLES`: synthetic applicants drawn from the traffic
+  distribution (`helpers.sample_population`) to pre-warm the cache after the
+  explainer is loaded; 0 disables the warm-up (default: 0)
+- `SHAP_CACHE_WARMUP_KEYS`: max number of (most frequent) profiles computed
+  during the warm-up (default: 10000)
+"""
+
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+SHAP_CACHE_MAX_ENTRIES = int(os.getenv("SHAP_CACHE_MAX_ENTRIES", 50_000))
+SHAP_CACHE_WARMUP_SAMPLES = int(os.getenv("SHAP_CACHE_WARMUP_SAMPLES", 0))
+SHAP_CACHE_WARMUP_KEYS = int(os.getenv("SHAP_CACHE_WARMUP_KEYS", 10_000))
+
+
+def shap_key(BMI, AGE, SMOKER, PRACTICE_SPORT, class_idx):
+    """
+    Cache key of the SHAP vector of one applicant and class. BMI is quantized
+    to float32 like the forest input, AGE to int like the explainer input.
+    """
+    return (float(np.float32(BMI)), int(AGE), bool(SMOKER), bool(PRACTICE_SPORT), int(class_idx))
+
+
+class ShapCache:
+    """Bounded LRU of SHAP vectors with hit/miss counters. Safe to use from several threads."""
+
+    def __init__(self, max_entries=SHAP_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "warmed": 0}
+
+    def get(self, key):
+        """Returns the cached SHAP vector for key, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def put(self, key, value, warm=False):
+        """Stores a SHAP vector (kept read-only, it is shared by all hits)"""
+        value = np.array(value, dtype=np.float64)
+        value.flags.writeable = False
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if warm:
+                self.counters["warmed"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters, hit rate and number of entries"""
+        with self._lock:
+            counters = dict(self.counters)
+            counters["entries"] = len(self._entries)
+        counters["max_entries"] = self.max_entries
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        return counters
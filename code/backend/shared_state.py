@@ -0,0 +1,230 @@
+"""
+shared_state.py - Generation-Numbered State Shared by the Workers of a Host
+
+With several uvicorn workers, every process used to hold its own learned rules
+table and flat model arrays, and `/admin/update_rules` only changed the worker
+that received the call. When `SHARED_STATE_DIR` is set, the workers instead
+share that directory:
+
+- Rule tables are published as numbered generations: the columns (and arrays
+  bound to the table, like the decision-table positions of its rules) are
+  written as `.npy` files into `rules/<generation>/`, then the `rules.generation`
+  file is atomically switched to the new number. Workers check that number
+  (at most every `SHARED_STATE_POLL_SECONDS`) and attach a newer generation
+  memory-mapped and read-only, in a background thread while they keep serving
+  the current one, so all of them serve the same table under the same
+  `rules_version` and no worker recomputes what the publisher computed.
+- Flat forest arrays (`forest_eval.FlatForest`) are written once per model file
+  content into `models/<sha256>/` and memory-mapped by every worker, so the
+  page cache holds a single copy for the host.
+- Other changes (e.g. an explainer reload) are announced by bumping a named
+  generation counter (`bump_generation`) that the workers watch.
+
+Publishing is serialized across processes with a file lock, and every file is
+written under a temporary name and renamed into place, so readers never see a
+partial generation.
+
+Configuration (environment variables):
+- `SHARED_STATE_DIR`: directory shared by the workers (default: unset, every
+  worker keeps its own state)
+- `SHARED_STATE_POLL_SECONDS`: how often a worker checks the generation numbers
+  (default: 0.25)
+- `SHARED_STATE_KEEP_GENERATIONS`: rule table generations kept on disk
+  (default: 4)
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR") or None
+SHARED_STATE_POLL_SECONDS = float(os.getenv("SHARED_STATE_POLL_SECONDS", 0.25))
+SHARED_STATE_KEEP_GENERATIONS = int(os.getenv("SHARED_STATE_KEEP_GENERATIONS", 4))
+
+NUMERIC_RULE_COLUMNS = ['BMI', 'AGE', 'SMOKER', 'PRACTICE_SPORT']
+TEXT_RULE_COLUMNS = ['DECISION', 'COMMENT']
+
+
+def enabled():
+    """Whether the workers share their state (SHARED_STATE_DIR is set)"""
+    return SHARED_STATE_DIR is not None
+
+
+def _path(*parts):
+    return os.path.join(SHARED_STATE_DIR, *parts)
+
+
+@contextmanager
+def _publish_lock():
+    """Exclusive lock across the processes publishing into the shared directory"""
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    with open(_path("publish.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+# --------------------------------------------------
+# Generation counters
+# --------------------------------------------------
+def generation(name):
+    """Current generation number of name (0 if nothing was published yet)"""
+    try:
+        with open(_path(f"{name}.generation")) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_generation(name):
+    """Announce a change of name to all workers; returns the new generation"""
+    with _publish_lock():
+        new_generation = generation(name) + 1
+        _write_atomic(_path(f"{name}.generation"), str(new_generation))
+    return new_generation
+
+
+class GenerationWatch:
+    """Generation number of name, re-read from disk at most every poll_seconds"""
+
+    def __init__(self, name, poll_seconds=SHARED_STATE_POLL_SECONDS):
+        self.name = name
+        self.poll_seconds = poll_seconds
+        self._generation = 0
+        self._next_check = 0.0
+
+    def latest(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.poll_seconds
+            self._generation = generation(self.name)
+        return self._generation
+
+
+# --------------------------------------------------
+# Rule tables
+# --------------------------------------------------
+def publish_rules(rules_df, arrays=None, only_if_first=False):
+    """
+    Write a rules table (with optional named arrays bound to it) as the next
+    generation and make it current.
+
+    Args:
+        rules_df: DataFrame with the columns BMI, AGE, SMOKER, PRACTICE_SPORT,
+                  DECISION, COMMENT (other columns are not shared)
+        arrays: dict of name -> numpy array stored with the table
+        only_if_first: publish only if no table was published yet (startup)
+
+    Returns:
+        Generation number of the table (the existing one if only_if_first and
+        a table was already published)
+    """
+    with _publish_lock():
+        current = generation("rules")
+        if only_if_first and current > 0:
+            return current
+        new_generation = current + 1
+        os.makedirs(_path("rules"), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=_path("rules"), prefix=".tmp-")
+        meta = {"rows": len(rules_df), "vocabularies": {}, "arrays": sorted(arrays or {})}
+        for column in NUMERIC_RULE_COLUMNS:
+            np.save(os.path.join(tmp, f"{column}.npy"), rules_df[column].to_numpy())
+        for column in TEXT_RULE_COLUMNS:
+            codes, vocabulary = pd.factorize(rules_df[column])
+            np.save(os.path.join(tmp, f"{column}.npy"), codes.astype(np.int32))
+            meta["vocabularies"][column] = [str(v) for v in vocabulary]
+        for name, array in (arrays or {}).items():
+            np.save(os.path.join(tmp, f"array-{name}.npy"), np.asarray(array))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp, _path("rules", str(new_generation)))
+        _write_atomic(_path("rules.generation"), str(new_generation))
+        _prune_rules(new_generation)
+    return new_generation
+
+
+def load_rules(rules_generation):
+    """
+    Attach a published rules table.
+
+    Returns:
+        (rules_df, arrays); the numeric columns and the arrays are read-only
+        memory maps shared with the other workers
+    """
+    directory = _path("rules", str(rules_generation))
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    columns = {
+        column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode="r")
+        for column in NUMERIC_RULE_COLUMNS
+    }
+    for column in TEXT_RULE_COLUMNS:
+        codes = np.load(os.path.join(directory, f"{column}.npy"))
+        columns[column] = np.array(meta["vocabularies"][column], dtype=object)[codes]
+    rules_df = pd.DataFrame(columns, columns=NUMERIC_RULE_COLUMNS + TEXT_RULE_COLUMNS, copy=False)
+    arrays = {
+        name: np.load(os.path.join(directory, f"array-{name}.npy"), mmap_mode="r")
+        for name in meta["arrays"]
+    }
+    return rules_df, arrays
+
+
+def _prune_rules(latest):
+    # workers still using an older generation keep their memory maps: removed
+    # files stay readable until they are unmapped
+    for entry in os.listdir(_path("rules")):
+        if entry.isdigit() and int(entry) <= latest - SHARED_STATE_KEEP_GENERATIONS:
+            shutil.rmtree(_path("rules", entry), ignore_errors=True)
+
+
+# --------------------------------------------------
+# Flat forests
+# --------------------------------------------------
+_forest_lock = threading.Lock()
+
+
+def shared_flat_forest(model, model_path):
+    """
+    The FlatForest of a fitted forest, memory-mapped from the shared directory
+    (written there first if no worker did yet).
+
+    Args:
+        model: the fitted sklearn forest loaded from model_path
+        model_path: its file; the arrays are keyed by the file content
+
+    Raises:
+        TypeError: If the model cannot be flattened
+    """
+    from forest_eval import FlatForest
+
+    with open(model_path, "rb") as f:
+        key = hashlib.sha256(f.read()).hexdigest()
+    directory = _path("models", key)
+    with _forest_lock:
+        if not os.path.exists(os.path.join(directory, "meta.json")):
+            flat = FlatForest.from_sklearn(model)
+            with _publish_lock():
+                if not os.path.exists(os.path.join(directory, "meta.json")):
+                    os.makedirs(_path("models"), exist_ok=True)
+                    tmp = tempfile.mkdtemp(dir=_path("models"), prefix=".tmp-")
+                    flat.save(tmp)
+                    os.rename(tmp, directory)
+    return FlatForest.load(directory, mmap_mode="r")
@@ -0,0 +1,93 @@
+"""
+startup.py - Startup Mode, Load Timings and Readiness
+
+Importing the whole backend used to pull in sklearn, SHAP and the OpenAI SDK
+and read the learned rules CSV before the server could accept a connection,
+which made worker starts and autoscaling slow. The components now import their
+heavy dependencies when they load, and this module decides when that happens:
+
+- "eager" mode (default): the lifespan loads every component before the
+  server accepts requests, as before.
+- "lazy" mode: the lifespan only loads the cheap components (rules table,
+  decision table); the price model and the decision explainer, with sklearn,
+  SHAP and OpenAI, load on first use.
+
+An optional warm-up runs one prediction once everything is loaded (in the
+background in lazy mode), and `/health/ready` reports ready only afterwards.
+Every component records how long it took to load (`timed`), for the startup
+breakdown of `/health/ready`.
+
+Configuration (environment variables):
+- `STARTUP_MODE`: "eager" or "lazy" (default: "eager")
+- `STARTUP_WARMUP`: "1" to run the warm-up prediction (default: "0")
+- `MODEL_MMAP`: "1" to load joblib artifacts memory-mapped, read-only
+  (default: "1" in lazy mode, "0" otherwise)
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# First import of this module, before the rest of the backend is imported
+IMPORT_START = time.perf_counter()
+
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager")
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "0") == "1"
+MODEL_MMAP = os.getenv("MODEL_MMAP", "1" if STARTUP_MODE == "lazy" else "0") == "1"
+
+_lock = threading.Lock()
+_timings = {}
+_state = {"ready": False, "warmup": "pending" if STARTUP_WARMUP else "off", "warmup_error": None}
+
+
+def record(component, seconds):
+    """Store the load time of a component (the last load wins)"""
+    with _lock:
+        _timings[component] = round(seconds, 4)
+
+
+@contextmanager
+def timed(component):
+    """Context manager recording the time spent in its block as the load time of component"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(component, time.perf_counter() - start)
+
+
+def timings():
+    """Load time of every component in seconds, in load order"""
+    with _lock:
+        return dict(_timings)
+
+
+def load_joblib(path):
+    """`joblib.load`, with numpy arrays memory-mapped read-only when MODEL_MMAP is set"""
+    import joblib
+    return joblib.load(path, mmap_mode="r" if MODEL_MMAP else None)
+
+
+# --------------------------------------------------
+# Readiness
+# --------------------------------------------------
+def mark_ready():
+    with _lock:
+        _state["ready"] = True
+
+
+def set_warmup(status, error=None):
+    """Warm-up status: "off", "pending", "running", "done" or "failed" """
+    with _lock:
+        _state["warmup"] = status
+        _state["warmup_error"] = error
+
+
+def status():
+    """Startup mode, readiness and warm-up state"""
+    with _lock:
+        state = dict(_state)
+    state["mode"] = STARTUP_MODE
+    state["model_mmap"] = MODEL_MMAP
+    return state
@@ -2,95 +2,56 @@ import numpy as np
 import pandas as pd
 
 
-def sample_population(n_samples=10_000, seed=42):
-    """
-    Generate a realistic Swiss population sample (all ages) 
-    based on menuCH data and Swiss demographics.
+# Rows per block of the synthetic population (see iter_population)
+POPULATION_CHUNK_SIZE = 1_000_000
 
-    Returns:
-        DataFrame with columns:
-        ['AGE', 'SEX', 'HEIGHT_CM', 'WEIGHT_KG', 'BMI', 'SMOKER', 'PRACTICE_SPORT']
-    """
-    np.random.seed(seed)
+# Swiss population age distribution (source: Swiss Federal Statistics),
+# as [low, high) age bounds and probabilities. Total adds up to 1.0
+AGE_GROUPS = {
+    '0-19': (0, 20, 0.20),
+    '20-64': (20, 65, 0.60),
+    '65-79': (65, 80, 0.14),
+    '80+': (80, 95, 0.06),
+}
 
-    # -------------------------------------------------------------------------
-    # 1. Swiss population age distribution (source: Swiss Federal Statistics)
-    # -------------------------------------------------------------------------
-    # Total adds up to 1.0
-    age_groups = {
-        '0-19': 0.20,
-        '20-64': 0.60,
-        '65-79': 0.14,
-        '80+': 0.06
-    }
-
-    # Sex ratio roughly 50/50
-    sex_categories = ['Male', 'Female']
-    sex_probs = [0.5, 0.5]
 
+def _sample_block(rng, n_samples, start=0):
+    """One block of `n_samples` people drawn from the Generator `rng`."""
     # -------------------------------------------------------------------------
-    # 2. Sample age (continuous within each group)
+    # 1. Sample age (uniform integer within each group)
     # -------------------------------------------------------------------------
-    ages = []
-    for _ in range(n_samples):
-        group = np.random.choice(list(age_groups.keys()), p=list(age_groups.values()))
-        if group == '0-19':
-            ages.append(np.random.randint(0, 20))
-        elif group == '20-64':
-            ages.append(np.random.randint(20, 65))
-        elif group == '65-79':
-            ages.append(np.random.randint(65, 80))
-        else:
-            ages.append(np.random.randint(80, 95))
-    ages = np.array(ages)
+    bounds = np.array([(low, high) for low, high, _ in AGE_GROUPS.values()])
+    group = rng.choice(len(AGE_GROUPS), size=n_samples, p=[p for _, _, p in AGE_GROUPS.values()])
+    ages = rng.integers(bounds[group, 0], bounds[group, 1])
 
     # -------------------------------------------------------------------------
-    # 3. Assign sex
+    # 2. Assign sex (roughly 50/50)
     # -------------------------------------------------------------------------
-    sexes = np.random.choice(sex_categories, size=n_samples, p=sex_probs)
+    sexes = rng.choice(np.array(['Male', 'Female'], dtype=object), size=n_samples, p=[0.5, 0.5])
+    male = sexes == 'Male'
 
     # -------------------------------------------------------------------------
-    # 4. Anthropometrics
+    # 3. Anthropometrics: mean/sd of height and BMI per age band and sex
     # -------------------------------------------------------------------------
-    height = np.zeros(n_samples)
-    weight = np.zeros(n_samples)
-    bmi = np.zeros(n_samples)
-
-    for i, sex in enumerate(sexes):
-        age = ages[i]
-
-        # Children & adolescents
-        if age < 20:
-            if sex == 'Male':
-                height[i] = np.random.normal(165 if age > 15 else 150, 10)
-                bmi[i] = np.random.normal(20 if age > 15 else 18, 2.5)
-            else:
-                height[i] = np.random.normal(160 if age > 15 else 145, 10)
-                bmi[i] = np.random.normal(19 if age > 15 else 17.5, 2.5)
-
-        # Adults
-        elif age < 65:
-            if sex == 'Male':
-                bmi_mean = 25.0 if age < 50 else 25.9
-                bmi_sd = 3.8
-                height[i] = np.random.normal(178, 7.5)
-            else:
-                bmi_mean = 23.8 if age < 50 else 24.5
-                bmi_sd = 4.0
-                height[i] = np.random.normal(165, 6.5)
-            bmi[i] = np.random.normal(bmi_mean, bmi_sd)
-
-        # Seniors (65+)
-        else:
-            if sex == 'Male':
-                bmi[i] = np.random.normal(26.0, 3.5)
-                height[i] = np.random.normal(173, 7.0)
-            else:
-                bmi[i] = np.random.normal(25.0, 3.8)
-                height[i] = np.random.normal(160, 6.0)
-
-        # Compute weight
-        weight[i] = bmi[i] * (height[i] / 100) ** 2
+    child = ages < 20
+    teen = ages > 15
+    adult = (ages >= 20) & (ages < 65)
+    over_50 = ages >= 50
+
+    conditions = [child & male, child & ~male, adult & male, adult & ~male, male]
+    height_mean = np.select(conditions, [
+        np.where(teen, 165, 150), np.where(teen, 160, 145), 178, 165, 173
+    ], default=160)
+    height_sd = np.select(conditions, [10, 10, 7.5, 6.5, 7.0], default=6.0)
+    bmi_mean = np.select(conditions, [
+        np.where(teen, 20, 18), np.where(teen, 19, 17.5),
+        np.where(over_50, 25.9, 25.0), np.where(over_50, 24.5, 23.8), 26.0
+    ], default=25.0)
+    bmi_sd = np.select(conditions, [2.5, 2.5, 3.8, 4.0, 3.5], default=3.8)
+
+    height = rng.normal(height_mean, height_sd)
+    bmi = rng.normal(bmi_mean, bmi_sd)
+    weight = bmi * (height / 100) ** 2
 
     # Sanity checks (clip)
     height = np.clip(height, 50, 202)
@@ -98,37 +59,23 @@ def sample_population(n_samples=10_000, seed=42):
     bmi = np.round(weight / (height / 100) ** 2, 1)
 
     # -------------------------------------------------------------------------
-    # 5. Lifestyle & behavior (only for adults)
+    # 4. Lifestyle & behavior (no smoking under 16)
     # -------------------------------------------------------------------------
-    smoker = np.zeros(n_samples, dtype=bool)
-    practice_sport = np.zeros(n_samples, dtype=bool)
-
-    for i, age in enumerate(ages):
-        if age < 16:
-            smoker[i] = False
-            practice_sport[i] = np.random.rand() < 0.65  # active kids
-        else:
-            # Smoking: ~25% overall, slightly higher in men
-            smoker[i] = np.random.rand() < (0.27 if sexes[i] == 'Male' else 0.22)
-
-            # Physical activity: decreases with age
-            if age < 35:
-                p_sport = 0.65
-            elif age < 65:
-                p_sport = 0.55
-            elif age < 80:
-                p_sport = 0.45
-            else:
-                p_sport = 0.30
-            practice_sport[i] = np.random.rand() < p_sport
-    # ------------------- NEW: Remove sport for obese adults -------------------
-    for i in range(n_samples):
-        if (sexes[i] == 'Female' and weight[i] > 90) or (sexes[i] == 'Male' and weight[i] > 100):
-            practice_sport[i] = False
+    # Smoking: ~25% overall, slightly higher in men
+    p_smoke = np.where(ages < 16, 0.0, np.where(male, 0.27, 0.22))
+    smoker = rng.random(n_samples) < p_smoke
+
+    # Physical activity: active kids, then decreases with age
+    p_sport = np.select([ages < 35, ages < 65, ages < 80], [0.65, 0.55, 0.45], default=0.30)
+    practice_sport = rng.random(n_samples) < p_sport
+
+    # Remove sport for obese adults
+    practice_sport &= ~((~male & (weight > 90)) | (male & (weight > 100)))
+
     # -------------------------------------------------------------------------
-    # 6. Assemble DataFrame
+    # 5. Assemble DataFrame
     # -------------------------------------------------------------------------
-    df = pd.DataFrame({
+    return pd.DataFrame({
         'AGE': ages,
         'SEX': sexes,
         'HEIGHT_CM': np.round(height, 1),
@@ -136,6 +83,37 @@ def sample_population(n_samples=10_000, seed=42):
         'BMI': bmi,
         'SMOKER': smoker,
         'PRACTICE_SPORT': practice_sport
-    })
+    }, index=pd.RangeIndex(start, start + n_samples))
+
 
-    return df
\ No newline at end of file
+def iter_population(n_samples, seed=42, chunk_size=POPULATION_CHUNK_SIZE):
+    """
+    Stream a synthetic population as DataFrames of `chunk_size` rows (the last
+    one may be shorter), indexed by global row number. Only one block is held
+    in memory at a time, so `n_samples` can exceed RAM.
+
+    With the same seed and chunk_size, the concatenated blocks are exactly
+    `sample_population(n_samples, seed, chunk_size)`.
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_samples, chunk_size):
+        yield _sample_block(rng, min(chunk_size, n_samples - start), start)
+
+
+def sample_population(n_samples=10_000, seed=42, chunk_size=POPULATION_CHUNK_SIZE):
+    """
+    Generate a realistic Swiss population sample (all ages) 
+    based on menuCH data and Swiss demographics.
+
+    Draws are vectorized on a `numpy.random.Generator` (the distributions are
+    the ones of the former per-person loop, but the random stream differs, so
+    a given seed yields a different sample than before).
+
+    Returns:
+        DataFrame with columns:
+        ['AGE', 'SEX', 'HEIGHT_CM', 'WEIGHT_KG', 'BMI', 'SMOKER', 'PRACTICE_SPORT']
+    """
+    blocks = list(iter_population(n_samples, seed, chunk_size))
+    if not blocks:
+        return _sample_block(np.random.default_rng(seed), 0)
+    return blocks[0] if len(blocks) == 1 else pd.concat(blocks)